@@ -4,12 +4,15 @@ Obtains permutation samples of distances.
 
 from click import *
 from logging import *
+from typing import *
 
+import functools as ft
 import joblib as jl
 import numpy as np
 import pandas as pd
 import tqdm
 
+from sequential_testing import SequentialTest, run_sequential_test
 from sklearn.utils import shuffle
 
 
@@ -48,6 +51,35 @@ def do_permutation_test(X: pd.DataFrame, seed: int) -> pd.DataFrame:
     return Y
 
 
+def get_exceedances(
+    X: pd.DataFrame, base_distances: pd.Series, threads: int, seeds: List[int]
+) -> np.ndarray:
+    """
+    Determines, for each of the given seeds and each classification, whether the
+    permuted distance is below the observed one.
+
+    Args:
+        X: probabilities for each reference site
+        base_distances: observed distances, indexed by classification
+        threads: the number of threads
+        seeds: the seeds
+    """
+
+    samples = jl.Parallel(n_jobs=threads)(
+        jl.delayed(do_permutation_test)(X, seed) for seed in seeds
+    )
+
+    return np.array(
+        [
+            Y.set_index("classification")["distance"]
+            .reindex(base_distances.index)
+            .values
+            < base_distances.values
+            for Y in samples
+        ]
+    )
+
+
 @command()
 @option(
     "--data-input",
@@ -63,7 +95,52 @@ def do_permutation_test(X: pd.DataFrame, seed: int) -> pd.DataFrame:
     show_default=True,
     help="the number of threads",
 )
-def main(data_input, seed_input, output, threads):
+@option(
+    "--base-input",
+    help="the Feather file to read the base distances from, as required by "
+    "--sequential-h",
+)
+@option(
+    "--sequential-h",
+    type=IntRange(1),
+    help="stop permuting a classification once SEQUENTIAL_H permutations fall "
+    "below its base distance, and write P-values and the numbers of permutations "
+    "drawn instead of samples",
+)
+@option(
+    "--sequential-alpha",
+    type=FloatRange(0, 1),
+    help="also stop once the P-value is resolved with respect to significance "
+    "level SEQUENTIAL_ALPHA, as required by --sequential-h: significant "
+    "classifications never reach SEQUENTIAL_H permutations, so without it every "
+    "permutation is still drawn",
+)
+@option(
+    "--sequential-error",
+    type=FloatRange(0, 1),
+    default=1e-3,
+    show_default=True,
+    help="the probability of resolving a P-value wrongly overall, split equally "
+    "across batches of permutations",
+)
+def main(
+    data_input,
+    seed_input,
+    output,
+    threads,
+    base_input,
+    sequential_h,
+    sequential_alpha,
+    sequential_error,
+):
+
+    if sequential_h and not base_input:
+
+        raise UsageError("--sequential-h requires --base-input")
+
+    if sequential_h and sequential_alpha is None:
+
+        raise UsageError("--sequential-h requires --sequential-alpha")
 
     basicConfig(level=DEBUG)
 
@@ -107,6 +184,37 @@ def main(data_input, seed_input, output, threads):
 
     debug(f"Result: {X_reformatted.shape}")
 
+    # Conduct the permutation test sequentially if required.
+
+    if sequential_h:
+
+        info("Loading base distances")
+
+        base_distances = pd.read_feather(base_input).set_index("classification")[
+            "distance"
+        ]
+
+        info("Conducting sequential permutation tests")
+
+        test = run_sequential_test(
+            ft.partial(get_exceedances, X_reformatted, base_distances, threads),
+            seeds,
+            SequentialTest(
+                (base_distances.size,),
+                len(seeds),
+                h=sequential_h,
+                alpha=sequential_alpha,
+                error=sequential_error,
+                batch_size=16 * threads,
+            ),
+        )
+
+        info("Writing output")
+
+        test.to_frame(base_distances.index).reset_index().to_feather(output)
+
+        return
+
     # Conduct the permutation test.
 
     info("Conducting permutation tests")
@@ -4,11 +4,8 @@ Calculates conditional joint co-occurrence data.
 
 import click
 import feather
-import itertools as it
-import joblib as jl
 import numpy as np
 import pandas as pd
-import tqdm
 
 from logging import *
 
@@ -65,53 +62,63 @@ def split_data(df_data, clusters):
     }
 
 
-def _get_co_occurrence(k, i, xi, j, xj):
+def _divide(numerator, denominator):
     """
-    Calculates the raw and conditional joint co-occurrence frequencies for a
-    given cluster, reference joint, values for the reference joint, co-
-    occurring joint, and values for the co-occurring joint.
+    Divides the given numerator by the given denominator elementwise, giving
+    NaN where the denominator is 0.
 
-    :param int k
+    :param np.ndarray numerator
 
-    :param str i
+    :param np.ndarray denominator
 
-    :param pd.Series[int] xi
+    :rtype: np.ndarray
+    """
 
-    :param str j
+    with np.errstate(divide='ignore', invalid='ignore'):
 
-    :param pd.Series[int] xj
+        return np.where(denominator > 0, numerator / denominator, np.nan)
 
-    :rtype: pd.DataFrame
+
+def _get_co_occurrence(k, df, variables):
     """
+    Calculates the raw and conditional joint co-occurrence frequencies for a
+    given cluster between all pairs of the given joints, with the reference
+    joint varying slowest.
+
+    :param int k
+
+    :param pd.DataFrame df
+
+    :param pd.Index[str] variables
 
-    frequency = (xi & xj).sum()
+    :rtype: pd.DataFrame
+    """
 
-    reference_count = xi.sum()
+    X = (df[variables].values > 0).astype(np.int64)
 
-    probability = frequency / xi.size
+    # Entry (i, j) of the Gram matrix counts the patients involved at both
+    # joints i and j, and its diagonal counts the patients involved at each.
 
-    conditional_probability = (frequency / reference_count
-                               if reference_count > 0 else np.nan)
+    frequencies = X.T @ X
 
-    jaccard_denominator = (xi | xj).sum()
+    counts = np.diag(frequencies)
 
-    jaccard = (frequency / jaccard_denominator
-               if jaccard_denominator > 0 else np.nan)
+    n = variables.size
 
-    return pd.DataFrame(
-        {
-            'classification': k,
-            'reference_site': i,
-            'co_occurring_site': j,
-            'frequency': frequency,
-            'probability': probability,
-            'conditional_probability': conditional_probability,
-            'jaccard': jaccard
-        },
-        index=[0])
+    return pd.DataFrame({
+        'classification': np.repeat(k, n**2),
+        'reference_site': np.repeat(variables.values, n),
+        'co_occurring_site': np.tile(variables.values, n),
+        'frequency': frequencies.ravel(),
+        'probability': (frequencies / X.shape[0]).ravel(),
+        'conditional_probability': _divide(frequencies,
+                                           counts[:, np.newaxis]).ravel(),
+        'jaccard': _divide(frequencies, counts[:, np.newaxis] + counts -
+                           frequencies).ravel()
+    })
 
 
-def get_co_occurrences(dfs, variables, cores=None):
+def get_co_occurrences(dfs, variables):
     """
     Obtains raw and conditional joint co-occurrence frequencies from the given
     data.
@@ -120,22 +127,14 @@ def get_co_occurrences(dfs, variables, cores=None):
 
     :param pd.Index[str] variables
 
-    :param int cores
-
     :rtype: pd.DataFrame
     """
 
     info('Calculating joint co-occurrences')
 
-    # An iterator of tuples of (cluster, reference joint, co-occuring joint).
-
-    jobs = tqdm.tqdm(
-        it.product(dfs.keys(), variables, variables),
-        total=len(dfs) * variables.size**2)
-
     results = pd.concat(
-        jl.Parallel(n_jobs=cores)(jl.delayed(_get_co_occurrence)(k, i, dfs[k][
-            i], j, dfs[k][j]) for k, i, j in jobs))
+        [_get_co_occurrence(k, df, variables) for k, df in dfs.items()],
+        ignore_index=True)
 
     for j in ['reference_site', 'co_occurring_site']:
 
@@ -172,9 +171,7 @@ def write_output(df, filename):
     help='read cluster assignments from CLUSTER_INPUT')
 @click.option(
     '--output', required=True, help='write output to Feather file OUTPUT')
-@click.option(
-    '--cores', type=int, default=-1, help='run the analysis on CORES cores')
-def main(original_input, cluster_input, output, cores):
+def main(original_input, cluster_input, output):
 
     basicConfig(
         level=INFO,
@@ -187,7 +184,7 @@ def main(original_input, cluster_input, output, cores):
 
     splitted_data = split_data(data, clusters)
 
-    co_occurrences = get_co_occurrences(splitted_data, data.columns, cores)
+    co_occurrences = get_co_occurrences(splitted_data, data.columns)
 
     write_output(co_occurrences, output)
 
@@ -7,12 +7,15 @@ from click import *
 from logging import *
 from typing import *
 
-import itertools as it
+import functools as ft
 import joblib as jl
 import numpy as np
 import pandas as pd
 import tqdm
 
+from p_value_accumulators import PValueAccumulator, get_labels
+from sequential_testing import SequentialTest, run_sequential_test
+
 
 def get_seeds(iterations: int, seed: int) -> List[int]:
     """
@@ -54,152 +57,242 @@ def split_data(X: pd.DataFrame, clusters: pd.Series) -> Dict[int, pd.DataFrame]:
     return {k: X.loc[clusters.index[clusters == k]] for k in clusters.unique()}
 
 
-def _get_co_occurrence(i: str, xi: pd.Series, j: str, xj: pd.Series) -> pd.DataFrame:
+def _get_permutation_indices(
+    n: int, n_variables: int, seeds: Sequence[int]
+) -> np.ndarray:
     """
-    Calculates the conditional joint co-occurrence probability for a given reference
-    joint, values for the reference joint, co-occurring joint, and values for the
-    co-occurring joint.
+    Obtains, for each seed, an independent permutation of the rows for each
+    variable.
+
+    The permutations for a seed are those drawn by permuting each column of the
+    data in turn after seeding the generator with the seed.
 
     Args:
-        i: the reference joint
-        xi: values for the reference joint
-        j: the co-occurring joint
-        xj: values for the co-occurring joint
+        n: the number of rows
+        n_variables: the number of variables
+        seeds: seeds to initialize the permutations with
+
+    Returns:
+        Row indices with shape (seeds, variables, rows).
     """
 
-    frequency = (xi & xj).sum()
+    result = np.empty((len(seeds), n_variables, n), dtype=np.intp)
 
-    reference_count = xi.sum()
+    for b, seed in enumerate(seeds):
 
-    conditional_probability = (
-        frequency / reference_count if reference_count > 0 else np.nan
-    )
+        random_state = np.random.RandomState(seed)
 
-    return pd.DataFrame(
-        {
-            "reference_site": [i],
-            "co_occurring_site": [j],
-            "conditional_probability": [conditional_probability],
-        }
-    )
+        for j in range(n_variables):
 
+            result[b, j] = random_state.permutation(n)
 
-def _get_permuted_conditional_probabilities(
-    k: int, X: pd.DataFrame, seed: int
-) -> pd.DataFrame:
+    return result
+
+
+def _get_conditional_probabilities(X: np.ndarray) -> np.ndarray:
     """
-    Obtains conditional probabilities from permuted data for a given cluster with the
-    given data frame, and seed.
+    Calculates the conditional joint co-occurrence probabilities between all
+    pairs of joints from the given binary involvement matrices, with joints in
+    rows.
+
+    Args:
+        X: involvement matrices with shape (..., joints, patients)
 
-    k: the cluster number
-    X: data to permute
-    seed: the seed to initialize the algorithm with
+    Returns:
+        Conditional probabilities with shape (..., reference joints,
+        co-occurring joints), with NaN for reference joints that are never
+        involved.
     """
 
-    np.random.seed(seed)
+    frequencies = X @ np.swapaxes(X, -1, -2)
 
-    shuffled_df = X.apply(np.random.permutation)
+    reference_counts = np.diagonal(frequencies, axis1=-2, axis2=-1)[..., np.newaxis]
 
-    shuffled_df.reset_index(drop=True, inplace=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
 
-    variables = X.columns
+        return np.where(
+            reference_counts > 0, frequencies / reference_counts, np.nan
+        )
 
-    jobs = it.product(variables, variables)
 
-    results = pd.concat(
-        _get_co_occurrence(i, shuffled_df[i], j, shuffled_df[j]) for i, j in jobs
-    )
+def _get_permuted_probabilities(Xt: np.ndarray, seeds: Sequence[int]) -> np.ndarray:
+    """
+    Calculates the conditional probabilities between all pairs of joints for
+    each of a batch of permutations of the given data.
 
-    results["classification"] = k
+    Args:
+        Xt: binary involvement data, with joints in rows
+        seeds: seeds to initialize the permutations with
 
-    results["seed"] = seed
+    Returns:
+        Conditional probabilities with shape (seeds, reference joints,
+        co-occurring joints).
+    """
 
-    for j in ["reference_site", "co_occurring_site"]:
+    indices = _get_permutation_indices(Xt.shape[1], Xt.shape[0], seeds)
 
-        results[j] = results[j].astype("category")
+    permuted = np.take_along_axis(Xt[np.newaxis], indices, axis=2)
 
-    return results
+    return _get_conditional_probabilities(permuted)
 
 
-def get_permuted_conditional_probabilities(
-    Xs: Dict[int, pd.DataFrame], seeds: pd.Series, threads: int
-) -> pd.DataFrame:
+def _get_exceedances(
+    Xt: np.ndarray, observed: np.ndarray, seeds: Sequence[int]
+) -> np.ndarray:
     """
-    Obtains conditional probabilities from permuted data with the given data
-    frames and seeds.
+    Determines, for each of a batch of permutations of the given data and each
+    pair of joints, whether the permuted conditional probability is higher than
+    the given observed one.
 
     Args:
-        Xs: data split by cluster
-        seeds: seeds to initialize the algorithms with
-        threads: the number of CPU cores
+        Xt: binary involvement data, with joints in rows
+        observed: observed conditional probabilities
+        seeds: seeds to initialize the permutations with
+
+    Returns:
+        Indicators with shape (seeds, reference joints, co-occurring joints).
     """
 
-    n_jobs = len(Xs) * len(seeds)
+    return _get_permuted_probabilities(Xt, seeds) > observed
 
-    jobs = tqdm.tqdm(it.product(Xs.keys(), seeds), total=n_jobs)
 
-    return pd.concat(
-        jl.Parallel(n_jobs=threads)(
-            jl.delayed(_get_permuted_conditional_probabilities)(k, Xs[k], s)
-            for k, s in jobs
+def _accumulate_permutations(
+    Xt: np.ndarray,
+    accumulator: PValueAccumulator,
+    seeds: Sequence[int],
+    batch_size: int,
+) -> PValueAccumulator:
+    """
+    Adds the conditional probabilities of permutations of the given data to
+    the given accumulator, over flattened pairs of joints.
+
+    Permutations are drawn in batches of the given size, and only the running
+    counts are kept.
+
+    Args:
+        Xt: binary involvement data, with joints in rows
+        accumulator: the accumulator to update
+        seeds: seeds to initialize the permutations with
+        batch_size: the number of permutations to draw at once
+    """
+
+    for start in range(0, len(seeds), batch_size):
+
+        batch = seeds[start : start + batch_size]
+
+        accumulator.update(
+            _get_permuted_probabilities(Xt, batch).reshape((len(batch), -1))
         )
-    ).reset_index(drop=True)
+
+    return accumulator
 
 
-def _get_p_value(
-    k: Tuple[int, str, str],
-    conditional_probability: float,
-    probability_samples: pd.Series,
+def _get_p_values(
+    k: int,
+    X: pd.DataFrame,
+    co_occurrences: pd.Series,
+    seeds: Sequence[int],
+    batch_size: int,
+    sequential: Optional[Dict[str, Any]],
 ) -> pd.DataFrame:
     """
-    Calculates, for a conditional probability, the probability that higher conditional
-    probabilities will be observed at random.
+    Calculates, for each conditional probability of a cluster, the probability
+    that higher conditional probabilities will be observed at random.
 
     Args:
-        k: the classification, reference joint, and co-occurring joint
-        conditional_probability: the observed conditional probability
-        probability_samples: bootstrapped probability samples
+        k: the classification
+        X: data for the classification
+        co_occurrences: observed conditional probabilities for all
+            classifications
+        seeds: seeds to initialize the permutations with
+        batch_size: the number of permutations to draw at once
+        sequential: if given, arguments for a sequential test that stops
+            permuting each pair once its P-value is resolved
     """
 
-    return pd.DataFrame(
-        {
-            "classification": k[0],
-            "reference_site": k[1],
-            "co_occurring_site": k[2],
-            "p": (probability_samples > conditional_probability).mean(),
-        },
-        index=[0],
+    variables = X.columns
+
+    pairs = pd.MultiIndex.from_product([variables, variables])
+
+    observed = co_occurrences.loc[k].reindex(pairs).values.reshape(
+        (variables.size, variables.size)
     )
 
+    Xt = (X.values > 0).astype(np.float64).T
+
+    if sequential is not None:
+
+        test = run_sequential_test(
+            ft.partial(_get_exceedances, Xt, observed),
+            seeds,
+            SequentialTest(
+                observed.shape, len(seeds), batch_size=batch_size, **sequential
+            ),
+        )
+
+        result = test.to_frame(pairs)[["n", "p"]]
+
+    else:
+
+        # Undefined permuted probabilities never exceed the observed ones.
+
+        accumulator = _accumulate_permutations(
+            Xt,
+            PValueAccumulator(observed.ravel(), get_labels(pairs)),
+            seeds,
+            batch_size,
+        )
+
+        result = pd.DataFrame(
+            {"p": accumulator.get_p_values(missing="ignored")}, index=pairs
+        )
+
+    result.index.names = ["reference_site", "co_occurring_site"]
+
+    result.insert(0, "classification", k)
+
+    return result.reset_index()[
+        ["classification", "reference_site", "co_occurring_site"]
+        + list(result.columns[1:])
+    ]
+
 
 def get_p_values(
-    co_occurrences: pd.Series, X_conditionals: pd.DataFrame
+    Xs: Dict[int, pd.DataFrame],
+    co_occurrences: pd.Series,
+    seeds: List[int],
+    threads: int,
+    batch_size: int = 100,
+    sequential: Optional[Dict[str, Any]] = None,
 ) -> pd.DataFrame:
     """
-    Obtains P-values for the given co-occurrences and permuted conditional
-    probabilities.
+    Obtains P-values for the given co-occurrences by permuting the given data
+    frames with the given seeds.
 
     Args:
+        Xs: data split by cluster
         co_occurrences: co-occurrences
-        X_conditionals: conditional co-occurrences
+        seeds: seeds to initialize the permutations with
+        threads: the number of CPU cores
+        batch_size: the number of permutations to draw at once
+        sequential: if given, arguments for a sequential test that stops
+            permuting each pair once its P-value is resolved
     """
 
     info("Calculating P-values")
 
-    g = X_conditionals.groupby(
-        ["classification", "reference_site", "co_occurring_site"]
-    )
-
-    iterator = tqdm.tqdm(g.groups.items())
-
     results = pd.concat(
-        _get_p_value(
-            k, co_occurrences.loc[k], X_conditionals.loc[ix, "conditional_probability"]
+        jl.Parallel(n_jobs=threads)(
+            jl.delayed(_get_p_values)(
+                k, X, co_occurrences, seeds, batch_size, sequential
+            )
+            for k, X in tqdm.tqdm(Xs.items())
         )
-        for k, ix in iterator
-    ).reset_index(drop=True)
+    )
 
-    return results[["classification", "reference_site", "co_occurring_site", "p"]]
+    return results.sort_values(
+        ["classification", "reference_site", "co_occurring_site"]
+    ).reset_index(drop=True)
 
 
 def write_output(df, path):
@@ -249,10 +342,46 @@ def write_output(df, path):
     default=53730459,
     help="the seed to initialize the analysis with",
 )
+@option(
+    "--sequential-h",
+    type=IntRange(1),
+    help="stop permuting a pair once SEQUENTIAL_H permutations exceed its "
+    "observed conditional probability, and report the number of permutations "
+    "drawn",
+)
+@option(
+    "--sequential-alpha",
+    type=FloatRange(0, 1),
+    help="also stop once the P-value is resolved with respect to significance "
+    "level SEQUENTIAL_ALPHA, as required by --sequential-h: significant pairs "
+    "never reach SEQUENTIAL_H permutations, so without it every permutation is "
+    "still drawn",
+)
+@option(
+    "--sequential-error",
+    type=FloatRange(0, 1),
+    default=1e-3,
+    show_default=True,
+    help="the probability of resolving a P-value wrongly overall, split equally "
+    "across batches of permutations",
+)
 def main(
-    data_input, co_occurrence_input, output, cluster_input, iterations, threads, seed
+    data_input,
+    co_occurrence_input,
+    output,
+    cluster_input,
+    iterations,
+    threads,
+    seed,
+    sequential_h,
+    sequential_alpha,
+    sequential_error,
 ):
 
+    if sequential_h and sequential_alpha is None:
+
+        raise UsageError("--sequential-h requires --sequential-alpha")
+
     basicConfig(level=DEBUG)
 
     # Load data.
@@ -293,21 +422,19 @@ def main(
 
     seeds = get_seeds(iterations, seed)
 
-    # Obtain conditional probabilities from permutations.
+    # Get P-values from permutations.
 
-    info("Obtaining conditional probabilities from permutations")
+    info("Calculating P-values from permutations")
 
-    permuted_conditionals = get_permuted_conditional_probabilities(
-        splitted_data, seeds, threads
+    sequential = (
+        {"h": sequential_h, "alpha": sequential_alpha, "error": sequential_error}
+        if sequential_h
+        else None
     )
 
-    debug(f"Result: {permuted_conditionals.shape}")
-
-    # Get P-values.
-
-    info("Calculating P-values")
-
-    p_values = get_p_values(co_occurrences, permuted_conditionals)
+    p_values = get_p_values(
+        splitted_data, co_occurrences, seeds, threads, sequential=sequential
+    )
 
     # Write output.
 
@@ -0,0 +1,351 @@
+"""
+Accumulates permutation and bootstrap samples into counters from which P-values
+are calculated, instead of keeping the samples.
+
+For each hypothesis, an accumulator counts the samples drawn, the samples more
+extreme than the observed statistic, and the missing samples, and optionally
+keeps the first two moments and a histogram of the samples. Accumulators over
+the same hypotheses and observed statistics can be merged, so that batch jobs
+can each write a small NumPy archive of counters, to be merged when P-values
+are calculated.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+
+from typing import *
+
+TAILS = ("upper", "lower")
+
+MISSING = ("extreme", "excluded", "ignored")
+
+
+class PValueAccumulator:
+    """
+    Counters of samples for an array of hypotheses.
+    """
+
+    def __init__(
+        self,
+        observed: np.ndarray,
+        labels: List[Any],
+        tail: str = "upper",
+        moments: bool = False,
+        bins: Optional[np.ndarray] = None,
+    ):
+        """
+        Args:
+            observed: the observed statistic of each hypothesis
+            labels: a JSON-serializable label for each hypothesis
+            tail: "upper" to count samples greater than the observed
+                statistic as extreme, or "lower" to count samples less than it
+            moments: whether to keep the sum and the sum of squares of the
+                samples
+            bins: if given, the edges of bins for a histogram of the samples
+        """
+
+        if tail not in TAILS:
+
+            raise ValueError("tail must be one of {}".format(TAILS))
+
+        self.observed = np.asarray(observed, dtype=np.float64)
+
+        self.labels = [list(x) if isinstance(x, tuple) else x for x in labels]
+
+        self.tail = tail
+
+        self.n = np.zeros(self.observed.shape, dtype=np.int64)
+
+        self.n_extreme = np.zeros(self.observed.shape, dtype=np.int64)
+
+        self.n_missing = np.zeros(self.observed.shape, dtype=np.int64)
+
+        self.sums = (
+            np.zeros((2,) + self.observed.shape, dtype=np.float64) if moments else None
+        )
+
+        self.bins = None if bins is None else np.asarray(bins, dtype=np.float64)
+
+        self.histogram = (
+            None
+            if bins is None
+            else np.zeros(
+                self.observed.shape + (self.bins.size - 1,), dtype=np.int64
+            )
+        )
+
+    def update(self, samples: np.ndarray):
+        """
+        Adds samples to the counters.
+
+        Args:
+            samples: samples with shape (draws, hypotheses), with NaN for
+                missing samples
+        """
+
+        samples = np.asarray(samples, dtype=np.float64)
+
+        missing = np.isnan(samples)
+
+        with np.errstate(invalid="ignore"):
+
+            if self.tail == "upper":
+
+                extreme = samples > self.observed
+
+            else:
+
+                extreme = samples < self.observed
+
+        self.n += samples.shape[0]
+
+        self.n_extreme += extreme.sum(axis=0)
+
+        self.n_missing += missing.sum(axis=0)
+
+        if self.sums is not None:
+
+            present = np.where(missing, 0., samples)
+
+            self.sums[0] += present.sum(axis=0)
+
+            self.sums[1] += (present ** 2).sum(axis=0)
+
+        if self.histogram is not None:
+
+            for j in range(samples.shape[1]):
+
+                self.histogram[j] += np.histogram(
+                    samples[~missing[:, j], j], self.bins
+                )[0]
+
+    def merge(self, other: "PValueAccumulator"):
+        """
+        Merges the given accumulator into this one.
+
+        Args:
+            other: an accumulator over the same hypotheses
+        """
+
+        if (
+            other.labels != self.labels
+            or other.tail != self.tail
+            or not np.array_equal(other.observed, self.observed, equal_nan=True)
+        ):
+
+            raise ValueError("cannot merge accumulators of different hypotheses")
+
+        if (other.sums is None) != (self.sums is None) or (
+            other.bins is None
+            and self.bins is not None
+            or other.bins is not None
+            and not np.array_equal(other.bins, self.bins)
+        ):
+
+            raise ValueError("cannot merge accumulators with different statistics")
+
+        self.n += other.n
+
+        self.n_extreme += other.n_extreme
+
+        self.n_missing += other.n_missing
+
+        if self.sums is not None:
+
+            self.sums += other.sums
+
+        if self.histogram is not None:
+
+            self.histogram += other.histogram
+
+    def get_p_values(self, missing: str = "extreme") -> np.ndarray:
+        """
+        Calculates P-values as the fraction of samples that are extreme.
+
+        Args:
+            missing: "extreme" to count missing samples as extreme, "excluded"
+                to leave them out altogether, or "ignored" to count them as
+                not extreme
+        """
+
+        if missing not in MISSING:
+
+            raise ValueError("missing must be one of {}".format(MISSING))
+
+        numerator = self.n_extreme + (self.n_missing if missing == "extreme" else 0)
+
+        denominator = self.n - (self.n_missing if missing == "excluded" else 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+
+            return numerator / denominator
+
+    def get_moments(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculates the mean and the variance of the samples that are present.
+        """
+
+        if self.sums is None:
+
+            raise ValueError("moments were not kept")
+
+        n = self.n - self.n_missing
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+
+            mean = self.sums[0] / n
+
+            return mean, self.sums[1] / n - mean ** 2
+
+    def to_frame(self, missing: str = "extreme") -> pd.DataFrame:
+        """
+        Summarizes the counters and P-values, with one row per hypothesis.
+
+        Args:
+            missing: how to count missing samples, as for get_p_values
+        """
+
+        return pd.DataFrame(
+            {
+                "observed": self.observed,
+                "n": self.n,
+                "n_missing": self.n_missing,
+                "n_extreme": self.n_extreme,
+                "p": self.get_p_values(missing),
+            },
+            index=get_index(self.labels),
+        )
+
+    def save(self, path: str):
+        """
+        Saves the accumulator to the given NumPy archive.
+
+        Args:
+            path: the path to save to
+        """
+
+        arrays = {
+            "observed": self.observed,
+            "n": self.n,
+            "n_extreme": self.n_extreme,
+            "n_missing": self.n_missing,
+        }
+
+        if self.sums is not None:
+
+            arrays["sums"] = self.sums
+
+        if self.histogram is not None:
+
+            arrays.update(bins=self.bins, histogram=self.histogram)
+
+        np.savez(
+            path,
+            header=np.array(json.dumps({"tail": self.tail, "labels": self.labels})),
+            **arrays
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "PValueAccumulator":
+        """
+        Loads an accumulator from the given NumPy archive.
+
+        Args:
+            path: the path to load from
+        """
+
+        with np.load(path) as archive:
+
+            header = json.loads(str(archive["header"]))
+
+            result = cls(
+                archive["observed"],
+                header["labels"],
+                header["tail"],
+                moments="sums" in archive.files,
+                bins=archive["bins"] if "bins" in archive.files else None,
+            )
+
+            for name in ["n", "n_extreme", "n_missing", "sums", "histogram"]:
+
+                if name in archive.files:
+
+                    setattr(result, name, archive[name])
+
+        return result
+
+
+def get_index(labels: List[Any]) -> pd.Index:
+    """
+    Converts hypothesis labels to an index, with one level per element for
+    labels that are lists.
+
+    Args:
+        labels: the labels
+    """
+
+    if labels and isinstance(labels[0], list):
+
+        return pd.MultiIndex.from_tuples([tuple(x) for x in labels])
+
+    return pd.Index(labels)
+
+
+def get_labels(index: pd.Index) -> List[Any]:
+    """
+    Converts an index to JSON-serializable hypothesis labels.
+
+    Args:
+        index: the index
+    """
+
+    def convert(x):
+
+        return x.item() if isinstance(x, np.generic) else x
+
+    if isinstance(index, pd.MultiIndex):
+
+        return [[convert(y) for y in x] for x in index]
+
+    return [convert(x) for x in index]
+
+
+def accumulate_samples(
+    samples: pd.DataFrame, observed: pd.Series, **kwargs
+) -> PValueAccumulator:
+    """
+    Accumulates samples, with one row per draw and one column per hypothesis,
+    against the given observed statistics.
+
+    Args:
+        samples: the samples; hypotheses that are missing from the columns
+            have all samples missing
+        observed: the observed statistics, indexed by hypothesis
+        kwargs: further arguments for the accumulator
+    """
+
+    result = PValueAccumulator(observed.values, get_labels(observed.index), **kwargs)
+
+    result.update(samples.reindex(columns=observed.index).values)
+
+    return result
+
+
+def load_accumulators(paths: Iterable[str]) -> PValueAccumulator:
+    """
+    Loads the accumulators at the given paths and merges them.
+
+    Args:
+        paths: the paths to load from
+    """
+
+    paths = list(paths)
+
+    result = PValueAccumulator.load(paths[0])
+
+    for path in paths[1:]:
+
+        result.merge(PValueAccumulator.load(path))
+
+    return result
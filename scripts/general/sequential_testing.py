@@ -0,0 +1,238 @@
+"""
+Stops permutation tests early once their P-values are resolved.
+
+Following Besag and Clifford (1991), sampling for a hypothesis stops as soon as
+h permutations are at least as extreme as the observed statistic, after which
+the P-value is h divided by the number of permutations drawn. Hypotheses that
+are clearly non-significant thus need only a few dozen permutations.
+Optionally, sampling also stops once an exact binomial confidence interval for
+the P-value lies entirely on one side of a significance level. As the
+intervals are checked after every batch of permutations, the error probability
+is split equally across the batches (a Bonferroni correction), so that each
+hypothesis is resolved wrongly with respect to that level with at most the
+given error probability overall.
+
+P-values are the fraction of drawn permutations that are as extreme as the
+observed statistic. Each caller chooses how permutations in which the statistic
+is missing count, by how it encodes them: NaN leaves them out of the P-value,
+while False or True counts them as present and not extreme, or as extreme, as
+the matching fixed-size test does. Hypotheses that are never resolved are
+sampled up to the given maximum, in which case their P-values are those of the
+fixed-size test.
+"""
+
+import numpy as np
+import pandas as pd
+
+from logging import *
+from scipy.stats import beta
+from typing import *
+
+
+class SequentialTest:
+    """
+    Tracks the permutations drawn for an array of hypotheses, and which of the
+    hypotheses have been resolved.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, ...],
+        max_draws: int,
+        h: int = 10,
+        alpha: Optional[float] = None,
+        error: float = 1e-3,
+        batch_size: int = 1,
+    ):
+        """
+        Args:
+            shape: the shape of the array of hypotheses
+            max_draws: the maximum number of permutations per hypothesis
+            h: the number of extreme permutations after which to stop
+            alpha: if given, also stop once the P-value is resolved with
+                respect to this significance level
+            error: the probability of resolving a hypothesis with respect to
+                the significance level wrongly
+            batch_size: the number of permutations drawn at once, so that
+                intervals are checked at most ceil(max_draws / batch_size)
+                times
+        """
+
+        self.max_draws = max_draws
+
+        self.h = h
+
+        self.alpha = alpha
+
+        self.error = error
+
+        self.batch_size = batch_size
+
+        self.n_drawn = np.zeros(shape, dtype=np.int64)
+
+        self.n = np.zeros(shape, dtype=np.int64)
+
+        self.n_exceeded = np.zeros(shape, dtype=np.int64)
+
+        self.stopped = np.zeros(shape, dtype=bool)
+
+    @property
+    def active(self) -> np.ndarray:
+        """
+        Whether each hypothesis still needs permutations.
+        """
+
+        return ~self.stopped & (self.n_drawn < self.max_draws)
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether all hypotheses have been resolved or fully sampled.
+        """
+
+        return not self.active.any()
+
+    def update(self, exceeded: np.ndarray):
+        """
+        Adds a batch of at most batch_size permutations to the active
+        hypotheses.
+
+        Permutations are taken in order, and those after a hypothesis stops
+        are ignored for it. Permutations given as NaN count towards the
+        maximum number of permutations, but not towards the P-value.
+
+        Args:
+            exceeded: whether each permutation is at least as extreme as the
+                observed statistic, with shape (permutations, *shape); callers
+                give NaN for permutations to leave out of the P-value, or
+                False or True to count them as not extreme or as extreme
+        """
+
+        exceeded = np.asarray(exceeded, dtype=np.float64)
+
+        n_draws = exceeded.shape[0]
+
+        if n_draws > self.batch_size:
+
+            raise ValueError("batches must have at most batch_size permutations")
+
+        if n_draws == 0:
+
+            return
+
+        present = ~np.isnan(exceeded)
+
+        cumulative = np.cumsum(present & (exceeded > 0), axis=0)
+
+        cumulative_present = np.cumsum(present, axis=0)
+
+        # The number of permutations needed to reach h extreme ones.
+
+        reached = self.n_exceeded + cumulative >= self.h
+
+        to_h = np.where(reached.any(axis=0), reached.argmax(axis=0) + 1, n_draws)
+
+        taken = np.minimum(to_h, self.max_draws - self.n_drawn)
+
+        taken = np.where(self.active, np.minimum(taken, n_draws), 0)
+
+        last = np.maximum(taken - 1, 0)[np.newaxis]
+
+        self.n_drawn += taken
+
+        self.n += np.where(
+            taken > 0, np.take_along_axis(cumulative_present, last, axis=0)[0], 0
+        )
+
+        self.n_exceeded += np.where(
+            taken > 0, np.take_along_axis(cumulative, last, axis=0)[0], 0
+        )
+
+        self.stopped |= self.n_exceeded >= self.h
+
+        if self.alpha is not None:
+
+            self.stopped |= self._is_resolved()
+
+    def _is_resolved(self) -> np.ndarray:
+        """
+        Determines which hypotheses have Clopper-Pearson confidence intervals
+        for their P-values that exclude the significance level, at the error
+        probability for a single batch.
+        """
+
+        n = self.n
+
+        k = self.n_exceeded
+
+        error = self.error / -(-self.max_draws // self.batch_size)
+
+        with np.errstate(invalid="ignore"):
+
+            lower = np.where(k > 0, beta.ppf(error / 2, k, n - k + 1), 0.)
+
+            upper = np.where(k < n, beta.ppf(1 - error / 2, k + 1, n - k), 1.)
+
+        return (n > 0) & ((lower > self.alpha) | (upper < self.alpha))
+
+    def get_p_values(self) -> np.ndarray:
+        """
+        Obtains the P-values of the hypotheses from the permutations drawn so
+        far.
+        """
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+
+            return self.n_exceeded / self.n
+
+    def to_frame(self, index: pd.Index) -> pd.DataFrame:
+        """
+        Summarizes the hypotheses, with the numbers of permutations in which
+        the statistic is present and of extreme permutations, and P-values.
+
+        Args:
+            index: labels for the flattened hypotheses
+        """
+
+        return pd.DataFrame(
+            {
+                "n": self.n.ravel(),
+                "n_exceeded": self.n_exceeded.ravel(),
+                "p": self.get_p_values().ravel(),
+            },
+            index=index,
+        )
+
+
+def run_sequential_test(
+    get_exceedances: Callable[[List[int]], np.ndarray],
+    seeds: List[int],
+    test: SequentialTest,
+) -> SequentialTest:
+    """
+    Draws permutations in batches with the given seeds until all hypotheses
+    are resolved or the seeds run out.
+
+    Args:
+        get_exceedances: calculates, for a batch of seeds, whether each
+            permutation is at least as extreme as the observed statistic, with
+            shape (seeds, *shape)
+        seeds: seeds to initialize the permutations with
+        test: the test to update, drawing its batch size of permutations at
+            once
+    """
+
+    for start in range(0, len(seeds), test.batch_size):
+
+        test.update(get_exceedances(seeds[start : start + test.batch_size]))
+
+        if test.done:
+
+            break
+
+    info(
+        "Drew {:.1f} permutations per hypothesis on average, {} hypotheses "
+        "stopped early".format(test.n.mean(), test.stopped.sum())
+    )
+
+    return test
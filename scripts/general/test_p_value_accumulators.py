@@ -0,0 +1,160 @@
+"""
+Tests accumulating, merging, saving, and loading P-value counters.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from p_value_accumulators import (
+    PValueAccumulator,
+    accumulate_samples,
+    load_accumulators,
+)
+
+
+def _get_samples(seed, draws=50):
+
+    samples = np.random.RandomState(seed).normal(size=(draws, 3))
+
+    samples[::7, 1] = np.nan
+
+    return samples
+
+
+def _make_accumulator(**kwargs):
+
+    return PValueAccumulator(
+        np.array([0.0, 1.0, -1.0]), [["a", 1], ["a", 2], ["b", 1]], **kwargs
+    )
+
+
+@pytest.mark.parametrize("tail", ["upper", "lower"])
+def test_counts_match_samples(tail):
+
+    samples = _get_samples(0)
+
+    accumulator = _make_accumulator(tail=tail)
+
+    accumulator.update(samples)
+
+    observed = accumulator.observed
+
+    with np.errstate(invalid="ignore"):
+
+        extreme = samples > observed if tail == "upper" else samples < observed
+
+    missing = np.isnan(samples)
+
+    np.testing.assert_array_equal(accumulator.n, [50] * 3)
+
+    np.testing.assert_array_equal(accumulator.n_extreme, extreme.sum(axis=0))
+
+    np.testing.assert_array_equal(accumulator.n_missing, missing.sum(axis=0))
+
+    np.testing.assert_allclose(
+        accumulator.get_p_values("extreme"), (extreme | missing).mean(axis=0)
+    )
+
+    np.testing.assert_allclose(
+        accumulator.get_p_values("excluded"),
+        extreme.sum(axis=0) / (~missing).sum(axis=0),
+    )
+
+    np.testing.assert_allclose(
+        accumulator.get_p_values("ignored"), extreme.mean(axis=0)
+    )
+
+
+def test_merge_matches_single_update():
+
+    bins = np.linspace(-3, 3, 7)
+
+    merged = _make_accumulator(moments=True, bins=bins)
+
+    merged.update(_get_samples(0))
+
+    other = _make_accumulator(moments=True, bins=bins)
+
+    other.update(_get_samples(1))
+
+    merged.merge(other)
+
+    single = _make_accumulator(moments=True, bins=bins)
+
+    single.update(np.concatenate([_get_samples(0), _get_samples(1)]))
+
+    for name in ["n", "n_extreme", "n_missing", "histogram"]:
+
+        np.testing.assert_array_equal(getattr(merged, name), getattr(single, name))
+
+    np.testing.assert_allclose(merged.sums, single.sums)
+
+    np.testing.assert_allclose(merged.get_moments(), single.get_moments())
+
+
+def test_merge_rejects_different_hypotheses():
+
+    accumulator = _make_accumulator()
+
+    with pytest.raises(ValueError):
+
+        accumulator.merge(_make_accumulator(tail="lower"))
+
+    with pytest.raises(ValueError):
+
+        accumulator.merge(
+            PValueAccumulator(accumulator.observed + 1, accumulator.labels)
+        )
+
+    with pytest.raises(ValueError):
+
+        accumulator.merge(_make_accumulator(moments=True))
+
+
+def test_save_and_load(tmp_path):
+
+    paths = []
+
+    for seed in range(3):
+
+        accumulator = _make_accumulator(tail="lower", moments=True, bins=[-1, 0, 1])
+
+        accumulator.update(_get_samples(seed))
+
+        paths.append(str(tmp_path / "{}.npz".format(seed)))
+
+        accumulator.save(paths[-1])
+
+    loaded = PValueAccumulator.load(paths[0])
+
+    assert loaded.tail == "lower"
+
+    assert loaded.labels == accumulator.labels
+
+    merged = load_accumulators(paths)
+
+    single = _make_accumulator(tail="lower", moments=True, bins=[-1, 0, 1])
+
+    single.update(np.concatenate([_get_samples(seed) for seed in range(3)]))
+
+    pd.testing.assert_frame_equal(merged.to_frame(), single.to_frame())
+
+    np.testing.assert_array_equal(merged.histogram, single.histogram)
+
+
+def test_accumulate_samples_reindexes_hypotheses():
+
+    observed = pd.Series(
+        [0.0, 1.0], index=pd.MultiIndex.from_tuples([("a", 1), ("b", 2)])
+    )
+
+    samples = pd.DataFrame({("a", 1): [1.0, -1.0, 2.0]})
+
+    result = accumulate_samples(samples, observed).to_frame()
+
+    assert result.index.equals(observed.index)
+
+    np.testing.assert_array_equal(result["n_extreme"], [2, 0])
+
+    np.testing.assert_array_equal(result["n_missing"], [0, 3])
@@ -0,0 +1,90 @@
+"""
+Tests the stopping rules of sequential permutation tests.
+"""
+
+import numpy as np
+import pytest
+
+from sequential_testing import SequentialTest, run_sequential_test
+
+
+def test_stops_after_h_exceedances():
+
+    test = SequentialTest((3,), 100, h=5, batch_size=20)
+
+    exceeded = np.zeros((20, 3), dtype=bool)
+
+    exceeded[:, 0] = True
+
+    exceeded[::2, 1] = True
+
+    test.update(exceeded)
+
+    np.testing.assert_array_equal(test.n, [5, 9, 20])
+
+    np.testing.assert_array_equal(test.n_exceeded, [5, 5, 0])
+
+    np.testing.assert_array_equal(test.active, [False, False, True])
+
+    np.testing.assert_allclose(test.get_p_values(), [1.0, 5 / 9, 0.0])
+
+
+def test_missing_permutations_are_excluded():
+
+    test = SequentialTest((2,), 6, h=10, batch_size=6)
+
+    test.update(
+        [[1, np.nan], [0, np.nan], [np.nan, np.nan], [1, np.nan], [0, 1], [0, 1]]
+    )
+
+    np.testing.assert_array_equal(test.n, [5, 2])
+
+    np.testing.assert_array_equal(test.n_exceeded, [2, 2])
+
+    assert test.done
+
+
+def test_error_is_spent_across_batches():
+
+    # Every hypothesis has a P-value of exactly alpha, so any hypothesis
+    # resolved with respect to alpha is resolved wrongly.
+
+    random_state = np.random.RandomState(0)
+
+    alpha = error = 0.05
+
+    test = SequentialTest(
+        (2000,), 10000, h=10001, alpha=alpha, error=error, batch_size=100
+    )
+
+    run_sequential_test(
+        lambda seeds: random_state.random_sample((len(seeds), 2000)) < alpha,
+        list(range(10000)),
+        test,
+    )
+
+    assert test.stopped.mean() <= error
+
+
+def test_resolves_clear_hypotheses():
+
+    test = SequentialTest((2,), 10000, h=10001, alpha=0.05, batch_size=100)
+
+    exceeded = np.zeros((100, 2), dtype=bool)
+
+    exceeded[:, 1] = True
+
+    run_sequential_test(lambda seeds: exceeded[: len(seeds)], range(10000), test)
+
+    assert test.done
+
+    np.testing.assert_array_equal(test.stopped, [True, True])
+
+    assert test.n.max() < 10000
+
+
+def test_rejects_large_batches():
+
+    with pytest.raises(ValueError):
+
+        SequentialTest((1,), 10, batch_size=2).update(np.ones((3, 1), dtype=bool))
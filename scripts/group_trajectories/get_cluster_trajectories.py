@@ -7,42 +7,40 @@ import feather
 import functools as ft
 import operator
 import pandas as pd
-import string
-import tqdm
 
 from click import *
+from cluster_assignment import (assign, get_labels, get_letter_labels,
+                                get_number_labels, pivot_scores)
 from logging import *
 from typing import *
 
 
-def get_l1_patient_group(x: pd.DataFrame) -> str:
+def _get_level_patient_groups(df_scores: pd.DataFrame, mask: pd.Series,
+                              get_factor_labels: Callable) -> pd.DataFrame:
     """
-    Obtains a level 1 patient group for given level 1 scores for a patient-
-    visit.
+    Obtains patient group assignments from given scores at one level for the
+    patient-visits selected by a given mask.
 
     Args:
-        x: Level 1 scores.
+        df_scores: Scores, indexed by patient and visit, with one row per
+            factor.
+        mask: Whether to assign each patient-visit at this level.
+        get_factor_labels: Labels the factors of this level.
 
     Returns:
-        The patient group.
+        Patient group assignments for the selected patient-visits.
     """
 
-    return '{:02d}'.format(x.set_index('factor')['score'].argmax())
+    scores = pivot_scores(df_scores.reset_index(), ['subject_id', 'visit_id'])
 
+    scores = scores.loc[mask.reindex(scores.index, fill_value=False).values]
 
-def get_l2_patient_group(x: pd.DataFrame) -> str:
-    """
-    Obtains a level 2 patient group for given level 2 scores for a patient-
-    visit.
-
-    Args:
-        x: Level 2 scores.
+    result = scores.index.to_frame(index=False)
 
-    Returns:
-        The patient group.
-    """
+    result['classification'] = get_labels(
+        assign(scores.values), get_factor_labels(scores.columns))
 
-    return string.ascii_uppercase[x.set_index('factor')['score'].argmax() - 1]
+    return result
 
 
 def get_patient_groups(df_l1_scores: pd.DataFrame,
@@ -65,35 +63,15 @@ def get_patient_groups(df_l1_scores: pd.DataFrame,
 
     zero_keys = subcohorts.index[subcohorts == 'zero']
 
-    df_l1_scores = df_l1_scores.drop(zero_keys, axis=0)
-
-    df_l2_scores = df_l2_scores.drop(zero_keys, axis=0)
-
-    # Obtain assignments for localized oligos.
-
-    l1_ids = subcohorts.index[subcohorts == 'localized_oligo']
-
-    df_l1_scores = df_l1_scores.loc[df_l1_scores.index & l1_ids]
-
-    l1_clusters = df_l1_scores.reset_index().groupby(
-        ['subject_id', 'visit_id']).apply(get_l1_patient_group)
-
-    l1_clusters.name = 'classification'
-
-    l1_clusters = l1_clusters.reset_index()
-
-    # Obtain assignments for diffuse oligos and non-oligos.
-
-    l2_ids = subcohorts.index[subcohorts.isin(['diffuse_oligo', 'non_oligo'])]
-
-    df_l2_scores = df_l2_scores.loc[df_l2_scores.index & l2_ids]
-
-    l2_clusters = df_l2_scores.reset_index().groupby(
-        ['subject_id', 'visit_id']).apply(get_l2_patient_group)
+    # Obtain assignments for localized oligos from level 1 scores, and for
+    # diffuse oligos and non-oligos from level 2 scores.
 
-    l2_clusters.name = 'classification'
+    l1_clusters = _get_level_patient_groups(
+        df_l1_scores, subcohorts.isin(['localized_oligo']), get_number_labels)
 
-    l2_clusters = l2_clusters.reset_index()
+    l2_clusters = _get_level_patient_groups(
+        df_l2_scores, subcohorts.isin(['diffuse_oligo', 'non_oligo']),
+        get_letter_labels)
 
     # Generate the assignments for the zero keys.
 
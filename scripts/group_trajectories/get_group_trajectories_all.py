@@ -4,9 +4,9 @@ Obtains group trajectories for all patients in REACCH OUT.
 
 import click
 import pandas as pd
-import string
-import tqdm
 
+from cluster_assignment import (assign, get_labels, get_letter_labels,
+                                pivot_scores)
 from logging import *
 
 
@@ -30,23 +30,6 @@ def load_data(handle):
     return result
 
 
-def _get_cluster(df):
-    """
-    Obtains a patient group assignment from a table of scores for a given
-    patient.
-
-    :param pd.DataFrame df
-
-    :rtype: int
-    """
-
-    if df['score'].max() == 0.:
-
-        return 0
-
-    return df.set_index('factor')['score'].argmax()
-
-
 def get_clusters(df):
     """
     Obtains patient groups from the given table.
@@ -58,20 +41,18 @@ def get_clusters(df):
 
     info('Calculating patient groups')
 
-    g = df.groupby(['subject_id', 'visit_id'])
-
-    tqdm.tqdm.pandas()
+    scores = pivot_scores(df, ['subject_id', 'visit_id'])
 
-    clusters = g.progress_apply(_get_cluster)
+    # Patients with no positive scores are unassigned.
 
-    clusters.name = 'classification_int'
+    assignments = assign(scores.values, 0., inclusive=False)
 
-    clusters = clusters.reset_index()
+    clusters = scores.index.to_frame(index=False)
 
-    clusters['classification'] = pd.Series(['0'] + list(
-        string.ascii_uppercase))[clusters['classification_int']].values
+    clusters['classification'] = get_labels(
+        assignments, get_letter_labels(scores.columns), '0')
 
-    return clusters.drop('classification_int', axis=1)
+    return clusters
 
 
 def write_output(df, filename):
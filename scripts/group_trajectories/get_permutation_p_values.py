@@ -3,67 +3,79 @@ Obtains P-values from the permutation test.
 """
 
 import feather
-import itertools as it
 import numpy as np
 import pandas as pd
-import tqdm
 
 from click import *
+from get_permutation_samples_any import load_observed_probabilities
 from logging import *
+from p_value_accumulators import (
+    PValueAccumulator,
+    accumulate_samples,
+    load_accumulators,
+)
+from typing import *
 
 
-def calculate_probability(
-    probabilities: pd.DataFrame, samples: pd.DataFrame, source: str, target: str
-) -> pd.DataFrame:
+def accumulate_sample_table(
+    observed: pd.Series, samples: pd.DataFrame
+) -> PValueAccumulator:
     """
-    Calculates the probability that the sampled probabilities are at least the
-    observed probabilities or are unobserved.
+    Accumulates sampled probabilities, with one row per seed, source, and
+    target, against the observed probabilities.
+
+    Combinations of sources and targets that are absent for a seed count as
+    missing for that seed.
 
     Args:
-        probabilities: The observed probabilities.
+        observed: The observed probabilities, indexed by source and target.
         samples: The sampled probabilities.
-        source: The source cluster.
-        target: The target cluster.
 
     Returns:
-        The probability.
+        The accumulator.
     """
 
-    probabilities_filtered = probabilities.query(
-        "source == @source and target == @target"
+    samples = (
+        samples.astype({"seed": np.int64, "source": str, "target": str})
+        .set_index(["seed", "source", "target"])["probability"]
+        .unstack(["source", "target"])
     )
 
-    samples_filtered = samples.query("source == @source and target == @target")
+    return accumulate_samples(samples, observed)
 
-    # XXX Fix for pandas 0.23.x bug.
 
-    # total_iterations = samples["seed"].unique().size
-    total_iterations = len(set(samples["seed"]))
+def load_samples(observed: pd.Series, paths: Tuple[str, ...]) -> PValueAccumulator:
+    """
+    Loads samples from the given Feather files of sampled probabilities or
+    NumPy archives of P-value counters, and merges them.
 
-    base_probability = (
-        probabilities_filtered["probability"].iloc[0]
-        if probabilities_filtered.shape[0] > 0
-        else 0.
-    )
+    Args:
+        observed: The observed probabilities, indexed by source and target.
+        paths: The paths to load samples from.
 
-    # num_missing_iterations = total_iterations - samples_filtered["seed"].unique().size
-    num_missing_iterations = total_iterations - len(set(samples_filtered["seed"]))
+    Returns:
+        The accumulator.
+    """
 
-    num_geq = (samples_filtered["probability"] > base_probability).sum()
+    counter_paths = [x for x in paths if x.endswith(".npz")]
 
-    p = (num_missing_iterations + num_geq) / total_iterations
+    accumulators = [load_accumulators(counter_paths)] if counter_paths else []
 
-    return pd.DataFrame(
-        {
-            "source": source,
-            "target": target,
-            "n": total_iterations,
-            "n_missing": num_missing_iterations,
-            "n_above": num_geq,
-            "p": p,
-        },
-        index=[0],
-    )
+    for path in paths:
+
+        if not path.endswith(".npz"):
+
+            accumulators.append(
+                accumulate_sample_table(observed, pd.read_feather(path))
+            )
+
+    result = accumulators[0]
+
+    for accumulator in accumulators[1:]:
+
+        result.merge(accumulator)
+
+    return result
 
 
 @command()
@@ -72,7 +84,13 @@ def calculate_probability(
     required=True,
     help="the CSV file to read base probabilities from",
 )
-@option("--sample-input", required=True, help="the Feather file to read samples from")
+@option(
+    "--sample-input",
+    required=True,
+    multiple=True,
+    help="the Feather files to read samples from, or NumPy archives ending in "
+    ".npz to read P-value counters from",
+)
 @option("--output", required=True, help="the CSV file to write P-values to")
 def main(probability_input, sample_input, output):
 
@@ -82,37 +100,29 @@ def main(probability_input, sample_input, output):
 
     info("Loading base probabilities")
 
-    X_probabilities = pd.read_csv(
-        probability_input, dtype={"source": "category", "target": "category"}
-    )
+    observed = load_observed_probabilities(probability_input)
 
-    debug(f"Result: {X_probabilities.shape}")
+    debug(f"Result: {observed.shape}")
 
     # Load the samples.
 
     info("Loading samples")
 
-    samples = pd.read_feather(sample_input)
+    accumulator = load_samples(observed, sample_input)
 
     # For each combination of sources and targets, calculate the probability
-    # that the sampled probability is higher than the observed probability.
+    # that the sampled probability is higher than the observed probability or
+    # is unobserved.
 
     info("Calculating P(sampled > observed)")
 
-    source_unique = X_probabilities["source"].unique()
-
-    target_unique = X_probabilities["target"].unique()
+    probs = accumulator.to_frame(missing="extreme")
 
-    n_pairs = source_unique.shape[0] * target_unique.shape[0]
+    probs.index.names = ["source", "target"]
 
-    iterator = tqdm.tqdm(
-        it.product(source_unique, target_unique), total=n_pairs, mininterval=1
-    )
-
-    probs = pd.concat(
-        calculate_probability(X_probabilities, samples, source, target)
-        for source, target in iterator
-    )
+    probs = probs.rename(columns={"n_extreme": "n_above"}).reset_index()[
+        ["source", "target", "n", "n_missing", "n_above", "p"]
+    ]
 
     # Write the output.
 
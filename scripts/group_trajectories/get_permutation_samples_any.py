@@ -4,112 +4,128 @@ of reaching any other patient group at any time point.
 """
 
 import feather
-import itertools as it
-import joblib as jl
+import functools as ft
 import numpy as np
 import pandas as pd
 import tqdm
 
 from click import *
 from logging import *
+from p_value_accumulators import PValueAccumulator, get_labels
+from sequential_testing import SequentialTest, run_sequential_test
+from transition_permutations import (EncodedVisits, encode_visits,
+                                     sample_transition_probabilities, to_frame)
+from typing import *
 
 
-def get_transition_probability(df_reference: pd.DataFrame,
-                               df_future: pd.DataFrame,
-                               source_group: str,
-                               target_group: str) -> pd.DataFrame:
+def load_observed_probabilities(path: str) -> pd.Series:
     """
-    Obtains transition probabilities from a given reference patient group to
-    other patient groups at any visit.
+    Loads observed transition probabilities, for every combination of source
+    and target patient groups, with 0 for unobserved combinations.
 
     Args:
-        df_reference: The reference patient groups.
-        df_future: The future patient groups.
-        source_group: The reference patient group.
-        target_group: The target patient group.
+        path: The CSV file to load probabilities from.
 
     Returns:
-        The transition probability.
+        The observed probabilities, indexed by source and target.
     """
 
-    df_reference = df_reference.loc[df_reference['classification'] ==
-                                    source_group].drop(
-                                        'visit_id',
-                                        axis=1).set_index('subject_id')
+    df = pd.read_csv(path, dtype={'source': str, 'target': str})
 
-    df_future = df_future.set_index('subject_id')
+    pairs = pd.MultiIndex.from_product(
+        [df['source'].unique(), df['target'].unique()],
+        names=['source', 'target'])
 
-    df_future = df_future.loc[df_reference.index & df_future.index]
+    return df.set_index(['source', 'target'])['probability'].reindex(
+        pairs).fillna(0.)
 
-    if df_future.shape[0] < 1:
 
-        return None
-
-    is_target = pd.Series(
-        df_future['classification'] == target_group,
-        name='is_target').reset_index()
-
-    is_target_merged = is_target.groupby('subject_id')['is_target'].max()
-
-    return pd.DataFrame(
-        {
-            'source': source_group,
-            'target': target_group,
-            'probability': is_target_merged.mean(),
-            'count': is_target_merged.sum()
-        },
-        index=[0])
-
-
-def permute_visit(df: pd.DataFrame) -> pd.DataFrame:
+def get_sampled_probabilities(encoded: EncodedVisits, observed: pd.Series,
+                              cores: int, seeds: List[int]) -> np.ndarray:
     """
-    Permutes labels for a given visit.
+    Obtains, for each of the given seeds, the permuted transition probability
+    of each combination of source and target patient groups.
 
     Args:
-        df: The data frame of labels to permute.
+        encoded: The encoded patient groups.
+        observed: The observed probabilities.
+        cores: The number of cores to run the permutations with.
+        seeds: The seeds to permute the patient groups with.
 
     Returns:
-        The permuted labels.
+        Probabilities with shape (seeds, combinations), with NaN for
+        unobserved combinations.
     """
 
-    df = df.copy()
+    probabilities, _ = sample_transition_probabilities(encoded, seeds, cores)
+
+    pairs = pd.MultiIndex.from_product(
+        [encoded.source_groups.astype(str),
+         encoded.target_groups.astype(str)])
+
+    positions = pairs.get_indexer(observed.index)
 
-    df['classification'] = df['classification'].sample(frac=1).values
+    # Append a column of NaN for combinations that are never sampled.
 
-    return df
+    probabilities = np.concatenate(
+        [
+            probabilities.reshape((len(seeds), -1)),
+            np.full((len(seeds), 1), np.nan)
+        ],
+        axis=1)
 
+    return probabilities[:, positions]
 
-def do_permutation(df_reference: pd.DataFrame,
-                   df_future: pd.DataFrame,
-                   seed: int) -> pd.DataFrame:
+
+def get_exceedances(encoded: EncodedVisits, observed: pd.Series, cores: int,
+                    seeds: List[int]) -> np.ndarray:
     """
-    Conducts a permutation test with the given reference classifications,
-    future classifications, and seed.
+    Determines, for each of the given seeds and each combination of source
+    and target patient groups, whether the permuted transition probability is
+    higher than the observed one or is unobserved.
+
+    Args:
+        encoded: The encoded patient groups.
+        observed: The observed probabilities.
+        cores: The number of cores to run the permutations with.
+        seeds: The seeds to permute the patient groups with.
+
+    Returns:
+        Indicators with shape (seeds, combinations).
     """
 
-    # Permute the reference and future data.
+    probabilities = get_sampled_probabilities(encoded, observed, cores, seeds)
+
+    with np.errstate(invalid='ignore'):
 
-    np.random.seed(seed)
+        return np.isnan(probabilities) | (probabilities > observed.values)
 
-    df_reference_shuffled = permute_visit(df_reference)
 
-    unique_visits = sorted(df_future['visit_id'].unique())
+def accumulate_permutations(encoded: EncodedVisits, observed: pd.Series,
+                            cores: int, seeds: List[int],
+                            batch_size: int) -> PValueAccumulator:
+    """
+    Accumulates permuted transition probabilities against the observed ones,
+    in batches of seeds.
 
-    df_future_shuffled = pd.concat(
-        permute_visit(df_future.query('visit_id == @i'))
-        for i in unique_visits)
+    Args:
+        encoded: The encoded patient groups.
+        observed: The observed probabilities.
+        cores: The number of cores to run the permutations with.
+        seeds: The seeds to permute the patient groups with.
+        batch_size: The number of seeds to permute at once.
 
-    reference_groups = sorted(df_reference_shuffled['classification'].unique())
+    Returns:
+        The accumulator.
+    """
 
-    future_groups = sorted(df_future_shuffled['classification'].unique())
+    result = PValueAccumulator(observed.values, get_labels(observed.index))
 
-    result = pd.concat(
-        get_transition_probability(df_reference_shuffled, df_future_shuffled,
-                                   source_group, target_group)
-        for source_group, target_group in it.product(reference_groups,
-                                                     future_groups))
+    for start in tqdm.trange(0, len(seeds), batch_size):
 
-    result['seed'] = seed
+        result.update(
+            get_sampled_probabilities(encoded, observed, cores,
+                                      seeds[start:start + batch_size]))
 
     return result
 
@@ -117,7 +133,11 @@ def do_permutation(df_reference: pd.DataFrame,
 @command()
 @option('--input', required=True, help='read input data from CSV file INPUT')
 @option('--seedlist', required=True, help='read seeds from text file SEEDLIST')
-@option('--output', required=True, help='write output data to CSV file OUTPUT')
+@option(
+    '--output',
+    required=True,
+    help=('write output data to Feather file OUTPUT, or P-value counters to '
+          'it if it ends in .npz'))
 @option(
     '--reference-visit',
     type=int,
@@ -126,7 +146,43 @@ def do_permutation(df_reference: pd.DataFrame,
           '(default: 1)'))
 @option(
     '--cores', type=int, default=1, help='utilize CORES cores (default: 1)')
-def main(input, seedlist, output, reference_visit, cores):
+@option(
+    '--probability-input',
+    help='read observed probabilities from CSV file PROBABILITY_INPUT, as '
+    'required by --sequential-h and .npz outputs')
+@option(
+    '--sequential-h',
+    type=IntRange(1),
+    help=('stop permuting a combination of patient groups once SEQUENTIAL_H '
+          'permutations exceed its observed probability, and write P-values '
+          'and the numbers of permutations drawn instead of samples'))
+@option(
+    '--sequential-alpha',
+    type=FloatRange(0, 1),
+    help=('also stop once the P-value is resolved with respect to '
+          'significance level SEQUENTIAL_ALPHA, as required by '
+          '--sequential-h: significant combinations never reach SEQUENTIAL_H '
+          'permutations, so without it every permutation is still drawn'))
+@option(
+    '--sequential-error',
+    type=FloatRange(0, 1),
+    default=1e-3,
+    help='the probability of resolving a P-value wrongly overall, split '
+    'equally across batches of permutations (default: 0.001)')
+def main(input, seedlist, output, reference_visit, cores, probability_input,
+         sequential_h, sequential_alpha, sequential_error):
+
+    if sequential_h and not probability_input:
+
+        raise UsageError('--sequential-h requires --probability-input')
+
+    if sequential_h and sequential_alpha is None:
+
+        raise UsageError('--sequential-h requires --sequential-alpha')
+
+    if output.endswith('.npz') and not probability_input:
+
+        raise UsageError('.npz outputs require --probability-input')
 
     basicConfig(
         level=INFO,
@@ -161,19 +217,64 @@ def main(input, seedlist, output, reference_visit, cores):
 
     future_data = data.query('visit_id > @reference_visit')
 
-    # Conduct the permutation test per seed.
+    # Encode subjects and patient groups once for all permutations.
 
-    info('Generating permutations')
+    info('Encoding patient groups')
+
+    encoded = encode_visits(reference_data, future_data)
+
+    # Conduct the permutation test sequentially if required.
+
+    if sequential_h:
+
+        info('Loading observed probabilities')
+
+        observed = load_observed_probabilities(probability_input)
+
+        info('Conducting sequential permutation tests')
+
+        test = run_sequential_test(
+            ft.partial(get_exceedances, encoded, observed, cores), seeds,
+            SequentialTest((observed.size, ),
+                           len(seeds),
+                           h=sequential_h,
+                           alpha=sequential_alpha,
+                           error=sequential_error,
+                           batch_size=16 * cores))
+
+        info('Writing output')
+
+        feather.write_dataframe(
+            test.to_frame(observed.index).reset_index(), output)
 
-    iterator = tqdm.tqdm(seeds)
+        return
 
-    results = (
-        do_permutation(reference_data, future_data, seed)
-        for seed in iterator) if cores == 1 else jl.Parallel(cores=cores)(
-            jl.delayed(do_permutation)(reference_data, future_data, seed)
-            for seed in iterator)
+    # Accumulate counters instead of keeping the samples if required.
+
+    if output.endswith('.npz'):
+
+        info('Loading observed probabilities')
+
+        observed = load_observed_probabilities(probability_input)
+
+        info('Accumulating permutations')
+
+        accumulator = accumulate_permutations(encoded, observed, cores, seeds,
+                                              16 * cores)
+
+        info('Writing output')
+
+        accumulator.save(output)
+
+        return
+
+    # Conduct the permutation test per seed.
+
+    info('Generating permutations')
 
-    permutations = pd.concat(results)
+    permutations = to_frame(
+        encoded, seeds,
+        *sample_transition_probabilities(encoded, seeds, cores))
 
     for j in ['seed', 'source', 'target']:
 
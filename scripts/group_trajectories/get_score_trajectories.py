@@ -7,9 +7,9 @@ import logging
 import numpy as np
 import pandas as pd
 import string
-import tqdm
 
-from sklearn.externals import joblib
+from nmf_model import load_model
+from score_projection import get_gap_mask, melt_scores, project, stack_visits
 
 
 def get_arguments():
@@ -127,12 +127,10 @@ def _load_nmf_model(handle):
 
     :param io.file handle
 
-    :rtype sklearn.decomposition.NMF
+    :rtype Union[NMFModel, sklearn.decomposition.NMF]
     """
 
-    logging.info('Loading NMF model from {}'.format(handle.name))
-
-    result = joblib.load(handle.name)
+    result = load_model(handle.name)
 
     return result
 
@@ -211,64 +209,6 @@ def reformat_baseline_clusters(series):
     return result
 
 
-def _get_visit_scores(visit_number, df, scaling_parameters, nmf_models):
-    """
-    Calculates factors with the given data for a single visit, scaling
-    parameters, and models.
-
-    :param int visit_number
-
-    :param pd.DataFrame df
-
-    :param List[pd.DataFrame] scaling_parameters
-
-    :param List[sklearn.decomposition.NMF] nmf_models
-
-    :rtype pd.DataFrame
-    """
-
-    result = df
-
-    for sp, nm in zip(scaling_parameters, nmf_models):
-
-        result = (result + sp['shift']) * sp['scale']
-
-        result = pd.DataFrame(nm.transform(
-            result), index=result.index, columns=pd.np.arange(nm.n_components,
-                                                              dtype=int) + 1)
-
-    result = pd.melt(result.reset_index(), id_vars=['SubjectID'],
-                     var_name='factor', value_name='score')
-
-    result.insert(1, 'visit_number', visit_number)
-
-    return result
-
-
-def _remove_gaps_patient(df):
-    """
-    Removes gaps in cluster assignments for a given patient.
-
-    :param pd.DataFrame
-
-    :rtype pd.DataFrame
-    """
-
-    unique_visits = df['visit_number'].unique()
-
-    diff = unique_visits[1:] - unique_visits[:-1]
-
-    if (diff > 1).any():
-
-        ix = np.where(diff > 1)[0][0]
-
-        visit = unique_visits[ix]
-
-        return df[df['visit_number'] <= visit]
-
-    return df
-
-
 def _remove_gaps(df):
     """
     Removes given scores for patients after the time point where no score
@@ -281,9 +221,10 @@ def _remove_gaps(df):
 
     logging.info('Removing gaps in scores')
 
-    g = df.groupby('SubjectID')
+    result = df.loc[get_gap_mask(df, 'SubjectID', 'visit_number')]
 
-    return g.apply(_remove_gaps_patient).reset_index(drop=True)
+    return result.sort_values(
+        ['SubjectID', 'visit_number'], kind='mergesort').reset_index(drop=True)
 
 
 def get_scores(data, baseline_scores, scaling_parameters, nmf_models):
@@ -310,11 +251,14 @@ def get_scores(data, baseline_scores, scaling_parameters, nmf_models):
 
     baseline_scores.insert(1, 'visit_number', 1)
 
-    future_scores = [_get_visit_scores(i + 2, d, scaling_parameters,
-                                       nmf_models) for i, d in tqdm.tqdm(
-        enumerate(data), total=len(data))]
+    # Visits after baseline are numbered from 2.
+
+    future_scores = melt_scores(
+        project(
+            stack_visits(data, 'SubjectID', 'visit_number', first_visit=2),
+            scaling_parameters, nmf_models))
 
-    combined_scores = pd.concat([baseline_scores] + future_scores)
+    combined_scores = pd.concat([baseline_scores, future_scores])
 
     # Apply a filter to the scores: patients who are missing data at any one
     # time point should not have scores after that time point.
@@ -4,12 +4,11 @@ Obtains score trajectories for all patients in REACCH OUT.
 
 import click
 import feather
-import functools as ft
 import pandas as pd
-import tqdm
 
 from logging import *
-from sklearn.externals import joblib
+from nmf_model import load_model
+from score_projection import get_gap_mask, melt_scores, project
 
 
 def _load_scaling_parameters(handle):
@@ -36,12 +35,10 @@ def _load_nmf_model(handle):
 
     :param io.file handle
 
-    :rtype: sklearn.decomposition.NMF
+    :rtype: Union[NMFModel, sklearn.decomposition.NMF]
     """
 
-    info('Loading NMF model from {}'.format(handle.name))
-
-    result = joblib.load(handle.name)
+    result = load_model(handle.name)
 
     # XXX
 
@@ -80,45 +77,6 @@ def load_data(joint_path, scaling_parameter_handles, nmf_model_handles):
     return joint_data, scaling_parameters, nmf_models
 
 
-def _filter_trajectories(df, max_visit):
-    """
-    Filters trajectories for a patient in the given table to ensure a
-    contiguous trajectory.
-
-    :param pd.DataFrame df
-
-    :param int max_visit
-
-    :rtype: pd.DataFrame
-    """
-
-    df = df.loc[df['visit_id'] > 0.]
-
-    if max_visit is not None:
-
-        df = df.loc[df['visit_id'] <= max_visit]
-
-    sorted_visits = df['visit_id'].sort_values()
-
-    # Must start at the baseline visit (1).
-
-    if sorted_visits.min() > 1:
-
-        return df.loc[[]]
-
-    # Return a contiguous range of visits.
-
-    gaps = sorted_visits.diff()
-
-    mask = pd.isnull(gaps) | (gaps == 1)
-
-    if mask.min() == False:
-
-        return df.loc[:mask.argmin()].head(-1)
-
-    return df
-
-
 def filter_trajectories(df, max_visit):
     """
     Filters visits in the given table to ensure contiguous trajectories.
@@ -136,11 +94,16 @@ def filter_trajectories(df, max_visit):
 
     info('Filtering entries by trajectories')
 
-    tqdm.tqdm.pandas()
+    df = df.loc[df['visit_id'] > 0.]
+
+    if max_visit is not None:
+
+        df = df.loc[df['visit_id'] <= max_visit]
+
+    result = df.loc[get_gap_mask(df, 'subject_id', 'visit_id', first_visit=1)]
 
-    result = df.groupby('subject_id').progress_apply(
-        ft.partial(
-            _filter_trajectories, max_visit=max_visit)).reset_index(drop=True)
+    result = result.sort_values(
+        'subject_id', kind='mergesort').reset_index(drop=True)
 
     info('Result is a table with shape {}'.format(result.shape))
 
@@ -163,23 +126,10 @@ def get_scores(data, scaling_parameters, nmf_models):
 
     info('Calculating scores')
 
-    result = data.set_index(['subject_id', 'visit_id'])
-
-    for sp, nm in zip(scaling_parameters, nmf_models):
-
-        result = (result + sp['shift']) * sp['scale']
-
-        result = pd.DataFrame(
-            nm.transform(result),
-            index=result.index,
-            columns=pd.np.arange(
-                nm.n_components, dtype=int) + 1)
-
-    melted_result = pd.melt(
-        result.reset_index(),
-        id_vars=['subject_id', 'visit_id'],
-        var_name='factor',
-        value_name='score')
+    melted_result = melt_scores(
+        project(
+            data.set_index(['subject_id', 'visit_id']), scaling_parameters,
+            nmf_models))
 
     info('Result is a table with shape {}'.format(melted_result.shape))
 
@@ -0,0 +1,120 @@
+"""
+Projects visits onto chains of NMF models in one pass, and removes gaps from
+the resulting trajectories.
+
+Visits from all time points are stacked into a single table indexed by
+subject and visit, so that each level of scaling and projection is applied
+once to the whole table rather than once per visit.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+
+
+def stack_visits(dfs, subject_column, visit_column, first_visit=1):
+    """
+    Stacks the given tables of visit data, one per visit, into a single table
+    indexed by subject and visit.
+
+    :param List[pd.DataFrame] dfs: tables indexed by subject
+
+    :param str subject_column
+
+    :param str visit_column
+
+    :param int first_visit: the visit number of the first table
+
+    :rtype: pd.DataFrame
+    """
+
+    result = pd.concat(
+        dfs, keys=range(first_visit, first_visit + len(dfs)),
+        names=[visit_column, subject_column])
+
+    return result.swaplevel()
+
+
+def project(df, scaling_parameters, nmf_models):
+    """
+    Projects the given data through the given chain of scaling parameters and
+    models, with factors numbered from 1 at each level.
+
+    :param pd.DataFrame df
+
+    :param List[pd.DataFrame] scaling_parameters
+
+    :param List[Union[NMFModel, sklearn.decomposition.NMF]] nmf_models
+
+    :rtype: pd.DataFrame
+    """
+
+    logging.info('Projecting a table with shape {} through {} levels'.format(
+        df.shape, len(nmf_models)))
+
+    for sp, nm in zip(scaling_parameters, nmf_models):
+
+        df = (df + sp['shift']) * sp['scale']
+
+        df = pd.DataFrame(
+            nm.transform(df.values),
+            index=df.index,
+            columns=np.arange(nm.n_components, dtype=int) + 1)
+
+    return df
+
+
+def melt_scores(df):
+    """
+    Reshapes the given scores, indexed by subject and visit with one column
+    per factor, to one row per subject, visit, and factor.
+
+    :param pd.DataFrame df
+
+    :rtype: pd.DataFrame
+    """
+
+    return pd.melt(
+        df.reset_index(),
+        id_vars=list(df.index.names),
+        var_name='factor',
+        value_name='score')
+
+
+def get_gap_mask(df, subject_column, visit_column, first_visit=None):
+    """
+    Determines which rows of the given table precede the first gap in the
+    visits of their subject.
+
+    :param pd.DataFrame df
+
+    :param str subject_column
+
+    :param str visit_column
+
+    :param int first_visit: if given, also exclude subjects whose earliest
+        visit is later than this visit
+
+    :rtype: np.ndarray[bool]
+    """
+
+    visits = df[[subject_column, visit_column]].drop_duplicates().sort_values(
+        [subject_column, visit_column])
+
+    steps = visits.groupby(subject_column)[visit_column].diff()
+
+    # The earliest visit after a gap, for subjects with gaps.
+
+    cutoffs = visits.loc[steps > 1].groupby(subject_column)[visit_column].min()
+
+    if first_visit is not None:
+
+        starts = visits.groupby(subject_column)[visit_column].min()
+
+        cutoffs = cutoffs.reindex(starts.index)
+
+        cutoffs[starts > first_visit] = -np.inf
+
+    cutoffs = df[subject_column].map(cutoffs).fillna(np.inf)
+
+    return (df[visit_column] < cutoffs).values
@@ -0,0 +1,247 @@
+"""
+Permutes patient group labels and calculates transition probabilities between
+patient groups on integer-encoded arrays.
+
+Subjects and patient groups are encoded once. Each permutation then shuffles
+the label arrays within the reference visit and within each future visit, and
+obtains the full matrix of probabilities that a patient in each source group
+reaches each target group at any future visit, without building data frames.
+"""
+
+import joblib as jl
+import numpy as np
+import pandas as pd
+
+from typing import *
+
+
+class EncodedVisits(NamedTuple):
+    """
+    Reference and future patient groups, encoded as integers.
+    """
+
+    # Subject and patient group codes of the reference rows.
+
+    reference_subjects: np.ndarray
+
+    reference_groups: np.ndarray
+
+    # Subject and patient group codes of the future rows.
+
+    future_subjects: np.ndarray
+
+    future_groups: np.ndarray
+
+    # Positions of the future rows at each future visit, in visit order.
+
+    future_visits: List[np.ndarray]
+
+    n_subjects: int
+
+    source_groups: np.ndarray
+
+    target_groups: np.ndarray
+
+
+def encode_visits(df_reference: pd.DataFrame,
+                  df_future: pd.DataFrame) -> EncodedVisits:
+    """
+    Encodes the given reference and future patient groups.
+
+    Args:
+        df_reference: The reference patient groups, with subject_id and
+            classification columns.
+        df_future: The future patient groups, with subject_id, visit_id, and
+            classification columns.
+
+    Returns:
+        The encoded patient groups, with source and target groups in sorted
+        order.
+    """
+
+    subjects = pd.Index(
+        np.union1d(df_reference['subject_id'], df_future['subject_id']))
+
+    source_groups, reference_groups = np.unique(
+        df_reference['classification'].values, return_inverse=True)
+
+    target_groups, future_groups = np.unique(
+        df_future['classification'].values, return_inverse=True)
+
+    visits = df_future['visit_id'].values
+
+    return EncodedVisits(
+        reference_subjects=subjects.get_indexer(df_reference['subject_id']),
+        reference_groups=reference_groups,
+        future_subjects=subjects.get_indexer(df_future['subject_id']),
+        future_groups=future_groups,
+        future_visits=[np.flatnonzero(visits == i) for i in np.unique(visits)],
+        n_subjects=subjects.size,
+        source_groups=source_groups,
+        target_groups=target_groups)
+
+
+def permute_groups(encoded: EncodedVisits,
+                   random_state: np.random.RandomState
+                   ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Permutes the reference patient groups, and the future patient groups
+    within each future visit.
+
+    The reference visit is permuted first, followed by the future visits in
+    order, with one permutation of the rows drawn for each.
+
+    Args:
+        encoded: The encoded patient groups.
+        random_state: The random number generator to permute with.
+
+    Returns:
+        The permuted reference and future patient group codes.
+    """
+
+    reference_groups = encoded.reference_groups[random_state.permutation(
+        encoded.reference_groups.size)]
+
+    future_groups = encoded.future_groups.copy()
+
+    for rows in encoded.future_visits:
+
+        future_groups[rows] = future_groups[rows[random_state.permutation(
+            rows.size)]]
+
+    return reference_groups, future_groups
+
+
+def get_transition_counts(encoded: EncodedVisits,
+                          reference_groups: np.ndarray,
+                          future_groups: np.ndarray
+                          ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts, for each source group, the subjects with future visits, and, for
+    each source and target group, the subjects reaching the target group at
+    any future visit.
+
+    Args:
+        encoded: The encoded patient groups.
+        reference_groups: Reference patient group codes.
+        future_groups: Future patient group codes.
+
+    Returns:
+        Counts with shapes (source groups, ) and (source groups, target
+        groups).
+    """
+
+    n_sources = encoded.source_groups.size
+
+    n_targets = encoded.target_groups.size
+
+    # Whether each subject reaches each target group, and belongs to each
+    # source group.
+
+    reached = np.bincount(
+        encoded.future_subjects * n_targets + future_groups,
+        minlength=encoded.n_subjects * n_targets).reshape(
+            (encoded.n_subjects, n_targets)) > 0
+
+    members = np.bincount(
+        reference_groups * encoded.n_subjects + encoded.reference_subjects,
+        minlength=n_sources * encoded.n_subjects).reshape(
+            (n_sources, encoded.n_subjects)) > 0
+
+    members = members.astype(np.int64)
+
+    return members @ reached.any(axis=1), members @ reached
+
+
+def get_transition_probabilities(
+        encoded: EncodedVisits,
+        seeds: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates transition probabilities and counts for permutations of the
+    given patient groups with the given seeds.
+
+    Args:
+        encoded: The encoded patient groups.
+        seeds: The seeds to permute the patient groups with.
+
+    Returns:
+        Probabilities and numbers of subjects reaching each target group, with
+        shape (seeds, source groups, target groups), and with NaN
+        probabilities for source groups without subjects with future visits.
+    """
+
+    shape = (len(seeds), encoded.source_groups.size,
+             encoded.target_groups.size)
+
+    probabilities = np.empty(shape)
+
+    counts = np.empty(shape, dtype=np.int64)
+
+    for b, seed in enumerate(seeds):
+
+        n_subjects, counts[b] = get_transition_counts(
+            encoded, *permute_groups(encoded, np.random.RandomState(seed)))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            probabilities[b] = counts[b] / n_subjects[:, np.newaxis]
+
+    return probabilities, counts
+
+
+def sample_transition_probabilities(
+        encoded: EncodedVisits, seeds: Sequence[int],
+        cores: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates transition probabilities and counts for permutations with the
+    given seeds, split evenly across the given number of processes.
+
+    Args:
+        encoded: The encoded patient groups.
+        seeds: The seeds to permute the patient groups with.
+        cores: The number of processes to run the permutations with.
+
+    Returns:
+        Probabilities and counts as for get_transition_probabilities.
+    """
+
+    if cores == 1 or len(seeds) < 2:
+
+        return get_transition_probabilities(encoded, seeds)
+
+    chunks = np.array_split(np.asarray(seeds), min(cores, len(seeds)))
+
+    results = jl.Parallel(n_jobs=cores)(
+        jl.delayed(get_transition_probabilities)(encoded, chunk.tolist())
+        for chunk in chunks)
+
+    return (np.concatenate([x[0] for x in results]),
+            np.concatenate([x[1] for x in results]))
+
+
+def to_frame(encoded: EncodedVisits, seeds: Sequence[int],
+             probabilities: np.ndarray, counts: np.ndarray) -> pd.DataFrame:
+    """
+    Converts the given transition probabilities and counts to a table with
+    one row per seed, source group, and target group, omitting source groups
+    without subjects with future visits.
+
+    Args:
+        encoded: The encoded patient groups.
+        seeds: The seeds the patient groups were permuted with.
+        probabilities: Transition probabilities.
+        counts: Numbers of subjects reaching each target group.
+
+    Returns:
+        A table with source, target, probability, count, and seed columns.
+    """
+
+    b, i, j = np.nonzero(~np.isnan(probabilities))
+
+    return pd.DataFrame({
+        'source': encoded.source_groups[i],
+        'target': encoded.target_groups[j],
+        'probability': probabilities[b, i, j],
+        'count': counts[b, i, j],
+        'seed': np.asarray(seeds)[b]
+    })
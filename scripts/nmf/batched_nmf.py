@@ -0,0 +1,804 @@
+"""
+Fits many small NMF models at once over a leading batch axis, using either
+coordinate descent, as scikit-learn does by default, or multiplicative updates.
+
+Training blocks of different shapes and ranks are zero-padded to a common
+shape and rank. Padded rows, columns, and factors start at zero and remain at
+zero under either solver, so they do not affect the fit of any member. Sparse
+blocks stay sparse: the data only enter the updates through products with the
+factors, and the residual norms are obtained from Gram matrices. Each member
+stops updating once it meets the same convergence criterion as the matching
+scikit-learn solver, with an objective of
+
+    0.5 * ||X - WH||_F^2 + alpha * l1_ratio * (|W|_1 + |H|_1)
+        + 0.5 * alpha * (1 - l1_ratio) * (||W||_F^2 + ||H||_F^2)
+
+Coordinate descent follows scikit-learn's cyclic updates exactly, updating
+each factor of W for all rows at once, as the rows of W are independent given
+H, and likewise for H.
+
+Members may carry a weight per row of X, e.g., bootstrap multiplicities, in
+which case each row's terms in the objective count that many times. This is
+the objective of the data with each row repeated by its weight, with repeated
+rows sharing a row of W. When every member is fitted to the same data, the
+data are shared across members rather than copied.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+from collections import namedtuple
+
+EPSILON = np.finfo(np.float32).eps
+
+BatchResult = namedtuple('BatchResult',
+                         ['W', 'H', 'n_iter', 'reconstruction_err'])
+
+SOLVERS = ('cd', 'mu')
+
+
+def get_nndsvd(X, svd, k, init='nndsvd', eps=1e-6, mean=None):
+    """
+    Obtains an NNDSVD initialization of rank k for the given data from the
+    given thin SVD, following the procedure used by scikit-learn.
+
+    As the singular triplets for a smaller rank are a prefix of those for a
+    larger rank, the same SVD serves every rank. The data are only used for
+    their mean, which may be given instead.
+
+    :param np.ndarray X
+
+    :param Tuple[np.ndarray, np.ndarray, np.ndarray] svd
+
+    :param int k
+
+    :param str init: one of nndsvd, nndsvda, or nndsvdar
+
+    :param float eps
+
+    :param float mean: the mean of X, if X is None
+
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+
+    U, S, V = svd[0][:, :k], svd[1][:k], svd[2][:k]
+
+    # Take the positive and negative parts of all singular vectors at once.
+
+    x_p, y_p = np.maximum(U, 0), np.maximum(V, 0)
+
+    x_n, y_n = np.maximum(-U, 0), np.maximum(-V, 0)
+
+    x_p_nrm, y_p_nrm = np.linalg.norm(x_p, axis=0), np.linalg.norm(y_p, axis=1)
+
+    x_n_nrm, y_n_nrm = np.linalg.norm(x_n, axis=0), np.linalg.norm(y_n, axis=1)
+
+    m_p, m_n = x_p_nrm * y_p_nrm, x_n_nrm * y_n_nrm
+
+    positive = m_p > m_n
+
+    u = np.where(positive, x_p, x_n)
+
+    v = np.where(positive[:, np.newaxis], y_p, y_n)
+
+    u_nrm = np.where(positive, x_p_nrm, x_n_nrm)
+
+    v_nrm = np.where(positive, y_p_nrm, y_n_nrm)
+
+    sigma = np.where(positive, m_p, m_n)
+
+    # The leading singular triplet is non-negative, so it is used as is.
+
+    u[:, 0], v[0], u_nrm[0], v_nrm[0], sigma[0] = np.abs(U[:, 0]), np.abs(
+        V[0]), 1., 1., 1.
+
+    lbd = np.sqrt(S * sigma)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        W = np.nan_to_num(lbd * u / u_nrm)
+
+        H = np.nan_to_num((lbd / v_nrm)[:, np.newaxis] * v)
+
+    W[W < eps] = 0
+
+    H[H < eps] = 0
+
+    if init == 'nndsvda':
+
+        avg = X.mean() if mean is None else mean
+
+        W[W == 0] = avg
+
+        H[H == 0] = avg
+
+    elif init == 'nndsvdar':
+
+        avg = X.mean() if mean is None else mean
+
+        W[W == 0] = abs(avg * np.random.randn(len(W[W == 0])) / 100)
+
+        H[H == 0] = abs(avg * np.random.randn(len(H[H == 0])) / 100)
+
+    return W, H
+
+
+def thin_svd(X):
+    """
+    Calculates the thin SVD of the given data.
+
+    For sparse data, the SVD is obtained from the eigendecomposition of the
+    Gram matrix of the columns, which is small for site-level data.
+
+    :param Union[np.ndarray, sp.spmatrix] X
+
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+
+    if not sp.issparse(X):
+
+        return np.linalg.svd(X, full_matrices=False)
+
+    eigenvalues, V = np.linalg.eigh(X.T.dot(X).toarray())
+
+    order = np.argsort(eigenvalues)[::-1]
+
+    S = np.sqrt(np.maximum(eigenvalues[order], 0))
+
+    V = V[:, order]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        U = np.nan_to_num(np.asarray(X.dot(V)) / S)
+
+    return U, S, V.T
+
+
+def _initialize(shape, mean, k, init, get_svd):
+    """
+    Initializes factors of rank k for data of the given shape and mean in the
+    same way as scikit-learn, obtaining the thin SVD of the data from get_svd
+    only if needed.
+
+    :param Tuple[int, int] shape
+
+    :param float mean
+
+    :param int k
+
+    :param str init
+
+    :param Callable[[], Tuple[np.ndarray, np.ndarray, np.ndarray]] get_svd
+
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+
+    if init is None:
+
+        init = 'nndsvd' if k <= min(shape) else 'random'
+
+    if init == 'random':
+
+        avg = np.sqrt(mean / k)
+
+        H = np.abs(avg * np.random.randn(k, shape[1]))
+
+        W = np.abs(avg * np.random.randn(shape[0], k))
+
+        return W, H
+
+    return get_nndsvd(None, get_svd(), k, init, mean=mean)
+
+
+def initialize(X, k, init, svd=None):
+    """
+    Initializes factors of rank k for the given data in the same way as
+    scikit-learn, drawing random values from the global NumPy random state.
+
+    :param np.ndarray X
+
+    :param int k
+
+    :param str init: one of random, nndsvd, nndsvda, nndsvdar, or None to
+        choose between nndsvd and random by rank
+
+    :param Tuple[np.ndarray, np.ndarray, np.ndarray] svd: a precomputed thin
+        SVD of X, if available
+
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+
+    return _initialize(X.shape, X.mean(), k, init,
+                       lambda: thin_svd(X) if svd is None else svd)
+
+
+def _get_weighted_gram(X, weights, chunk_size=1024):
+    """
+    Calculates X'CX for the diagonal matrix C of the given row weights, in
+    chunks of rows so that no weighted copy of the data is formed.
+
+    :param Union[np.ndarray, sp.spmatrix] X
+
+    :param np.ndarray weights
+
+    :param int chunk_size
+
+    :rtype: np.ndarray
+    """
+
+    gram = np.zeros((X.shape[1], X.shape[1]))
+
+    for start in range(0, X.shape[0], chunk_size):
+
+        rows = X[start:start + chunk_size]
+
+        c = weights[start:start + chunk_size]
+
+        weighted = sp.diags(c).dot(rows) if sp.issparse(X) else \
+            c[:, np.newaxis] * rows
+
+        product = rows.T.dot(weighted)
+
+        gram += product.toarray() if sp.issparse(product) else product
+
+    return gram
+
+
+def _get_weighted_svd(X, weights, k):
+    """
+    Calculates the leading k singular triplets of the given data with rows
+    scaled by the square roots of the given weights, from the
+    eigendecomposition of the weighted Gram matrix of the columns.
+
+    :param Union[np.ndarray, sp.spmatrix] X
+
+    :param np.ndarray weights
+
+    :param int k
+
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+
+    eigenvalues, V = np.linalg.eigh(_get_weighted_gram(X, weights))
+
+    order = np.argsort(eigenvalues)[::-1][:k]
+
+    S = np.sqrt(np.maximum(eigenvalues[order], 0))
+
+    V = V[:, order]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        U = np.nan_to_num(
+            np.sqrt(weights)[:, np.newaxis] * np.asarray(X.dot(V)) / S)
+
+    return U, S, V.T
+
+
+def initialize_weighted(X, weights, k, init):
+    """
+    Initializes factors of rank k for the given data with the given row
+    weights.
+
+    The factors are those of the data with rows scaled by the square roots of
+    their weights, which has the same right singular vectors as the data with
+    each row repeated by its weight. For NNDSVD, this reproduces the
+    initialization of the repeated data exactly. The scaled data are never
+    formed: their mean comes from the row sums of the data, and their SVD
+    from the weighted Gram matrix of the columns. Rows with zero weight are
+    initialized to zero.
+
+    :param Union[np.ndarray, sp.spmatrix] X
+
+    :param np.ndarray weights
+
+    :param int k
+
+    :param str init
+
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+
+    weights = np.asarray(weights, dtype=np.float64)
+
+    scale = np.sqrt(weights)
+
+    row_sums = np.asarray(X.sum(axis=1)).ravel()
+
+    mean = scale.dot(row_sums) / (X.shape[0] * X.shape[1])
+
+    W, H = _initialize(X.shape, mean, k, init,
+                       lambda: _get_weighted_svd(X, weights, k))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        W = np.where(scale[:, np.newaxis] > 0, W / scale[:, np.newaxis], 0.)
+
+    return W, H
+
+
+def _broadcast(value, n):
+    """
+    Broadcasts the given scalar or sequence to an array of length n.
+
+    :param Union[float, Sequence[float]] value
+
+    :param int n
+
+    :rtype: np.ndarray
+    """
+
+    return np.broadcast_to(np.asarray(value, dtype=float), (n, )).copy()
+
+
+def _pad(arrays, shape):
+    """
+    Stacks the given arrays into one zero-padded array with a leading batch
+    axis.
+
+    :param List[np.ndarray] arrays
+
+    :param Tuple[int, int] shape
+
+    :rtype: np.ndarray
+    """
+
+    result = np.zeros((len(arrays), ) + shape)
+
+    for i, a in enumerate(arrays):
+
+        result[i, :a.shape[0], :a.shape[1]] = a
+
+    return result
+
+
+def _pad_sparse(blocks, shape):
+    """
+    Pads the given sparse blocks with zeros to the given shape.
+
+    :param List[sp.spmatrix] blocks
+
+    :param Tuple[int, int] shape
+
+    :rtype: List[sp.csr_matrix]
+    """
+
+    result = [sp.csr_matrix(X, dtype=np.float64, copy=True) for X in blocks]
+
+    for X in result:
+
+        X.resize(shape)
+
+    return result
+
+
+def _take(X, ix):
+    """
+    Takes the given members of the given data.
+
+    :param Union[np.ndarray, List[sp.csr_matrix]] X
+
+    :param np.ndarray ix
+
+    :rtype: Union[np.ndarray, List[sp.csr_matrix]]
+    """
+
+    if isinstance(X, np.ndarray):
+
+        # Data shared by all members have a batch axis of length one.
+
+        return X if len(X) == 1 else X[ix]
+
+    return [X[i] for i in ix]
+
+
+def _dot_right(X, Ht):
+    """
+    Calculates XH' for each member.
+
+    :param Union[np.ndarray, List[sp.csr_matrix]] X
+
+    :param np.ndarray Ht: (batch, features, factors)
+
+    :rtype: np.ndarray
+    """
+
+    if isinstance(X, np.ndarray):
+
+        return np.matmul(X, Ht)
+
+    return np.stack([X_.dot(Ht_) for X_, Ht_ in zip(X, Ht)])
+
+
+def _dot_left(Wt, X):
+    """
+    Calculates W'X for each member.
+
+    :param np.ndarray Wt: (batch, factors, samples)
+
+    :param Union[np.ndarray, List[sp.csr_matrix]] X
+
+    :rtype: np.ndarray
+    """
+
+    if isinstance(X, np.ndarray):
+
+        return np.matmul(Wt, X)
+
+    return np.stack([X_.T.dot(Wt_.T).T for Wt_, X_ in zip(Wt, X)])
+
+
+def _get_errors(X, W, H, C=None):
+    """
+    Calculates the Frobenius norm of the residual of each member, with rows
+    weighted by C if given.
+
+    For sparse data, the squared norm is expanded as
+    ||X||^2 - 2 <W'X, H> + <W'W, HH'> so that WH is never formed.
+
+    :param Union[np.ndarray, List[sp.csr_matrix]] X
+
+    :param np.ndarray W
+
+    :param np.ndarray H
+
+    :param np.ndarray C: (batch, samples, 1)
+
+    :rtype: np.ndarray
+    """
+
+    if isinstance(X, np.ndarray):
+
+        squared_residuals = (X - np.matmul(W, H))**2
+
+        if C is not None:
+
+            squared_residuals *= C
+
+        return np.sqrt(np.sum(squared_residuals, axis=(1, 2)))
+
+    Wt = np.swapaxes(W if C is None else C * W, 1, 2)
+
+    if C is None:
+
+        squared_norms = np.array([X_.multiply(X_).sum() for X_ in X])
+
+    else:
+
+        squared_norms = np.array([
+            C_[:, 0].dot(np.asarray(X_.multiply(X_).sum(axis=1))[:, 0])
+            for X_, C_ in zip(X, C)
+        ])
+
+    cross = np.sum(_dot_left(Wt, X) * H, axis=(1, 2))
+
+    gram = np.sum(
+        np.matmul(Wt, W) * np.matmul(H, np.swapaxes(H, 1, 2)), axis=(1, 2))
+
+    return np.sqrt(np.maximum(squared_norms - 2 * cross + gram, 0))
+
+
+def _update_mu(X, W, H, l1, l2, C=None):
+    """
+    Applies one multiplicative update to W and then H, in place.
+
+    Row weights cancel out of the update of each row of W, so they only enter
+    the update of H.
+
+    :param Union[np.ndarray, List[sp.csr_matrix]] X: (batch, samples,
+        features)
+
+    :param np.ndarray W: (batch, samples, factors)
+
+    :param np.ndarray H: (batch, factors, features)
+
+    :param np.ndarray l1: (batch, 1, 1)
+
+    :param np.ndarray l2: (batch, 1, 1)
+
+    :param np.ndarray C: (batch, samples, 1)
+    """
+
+    Ht = np.swapaxes(H, 1, 2)
+
+    numerator = _dot_right(X, Ht)
+
+    denominator = np.matmul(W, np.matmul(H, Ht)) + l1 + l2 * W
+
+    denominator[denominator == 0] = EPSILON
+
+    W *= numerator / denominator
+
+    Wt = np.swapaxes(W if C is None else C * W, 1, 2)
+
+    numerator = _dot_left(Wt, X)
+
+    denominator = np.matmul(np.matmul(Wt, W), H) + l1 + l2 * H
+
+    denominator[denominator == 0] = EPSILON
+
+    H *= numerator / denominator
+
+
+def _update_factor_cd(W, A, B, l1, l2, C=None):
+    """
+    Applies one cycle of coordinate descent to W in place, minimizing
+    0.5 * <W'W, B> - <W, A> + l1 * |W|_1 + 0.5 * l2 * ||W||_F^2 as
+    scikit-learn does, where A = XH' and B = HH'. Returns the sum of the
+    absolute projected gradients of each member over the cycle, with rows
+    weighted by C if given.
+
+    :param np.ndarray W: (batch, samples, factors)
+
+    :param np.ndarray A: (batch, samples, factors)
+
+    :param np.ndarray B: (batch, factors, factors)
+
+    :param np.ndarray l1: (batch, 1, 1)
+
+    :param np.ndarray l2: (batch, 1, 1)
+
+    :param np.ndarray C: (batch, samples)
+
+    :rtype: np.ndarray
+    """
+
+    B = B + l2 * np.eye(B.shape[1])
+
+    A = A - l1
+
+    violation = np.zeros(len(W))
+
+    for t in range(W.shape[2]):
+
+        gradient = np.matmul(W, B[:, :, t:t + 1])[:, :, 0] - A[:, :, t]
+
+        projected_gradient = np.where(W[:, :, t] == 0,
+                                      np.minimum(gradient, 0), gradient)
+
+        if C is not None:
+
+            projected_gradient *= C
+
+        violation += np.abs(projected_gradient).sum(axis=1)
+
+        hessian = B[:, t, t][:, np.newaxis]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            W[:, :, t] = np.where(
+                hessian != 0, np.maximum(W[:, :, t] - gradient / hessian, 0),
+                W[:, :, t])
+
+    return violation
+
+
+def _update_cd(X, W, H, l1, l2, C=None):
+    """
+    Applies one cycle of coordinate descent to W and then H, in place,
+    returning the sum of the absolute projected gradients of each member.
+
+    Row weights cancel out of the update of each row of W, so they only enter
+    the update of H, and the projected gradients of W, of which each row
+    counts as many times as it is repeated.
+
+    :param Union[np.ndarray, List[sp.csr_matrix]] X: (batch, samples,
+        features)
+
+    :param np.ndarray W: (batch, samples, factors)
+
+    :param np.ndarray H: (batch, factors, features)
+
+    :param np.ndarray l1: (batch, 1, 1)
+
+    :param np.ndarray l2: (batch, 1, 1)
+
+    :param np.ndarray C: (batch, samples, 1)
+
+    :rtype: np.ndarray
+    """
+
+    Ht = np.swapaxes(H, 1, 2)
+
+    violation = _update_factor_cd(W, _dot_right(X, Ht), np.matmul(H, Ht), l1,
+                                  l2, None if C is None else C[:, :, 0])
+
+    Wt = np.swapaxes(W if C is None else C * W, 1, 2)
+
+    Ht = np.ascontiguousarray(Ht)
+
+    violation += _update_factor_cd(Ht, np.swapaxes(_dot_left(Wt, X), 1, 2),
+                                   np.matmul(Wt, W), l1, l2)
+
+    H[:] = np.swapaxes(Ht, 1, 2)
+
+    return violation
+
+
+def fit_batch(blocks,
+              k,
+              alpha=0.,
+              l1_ratio=0.,
+              W=None,
+              H=None,
+              init=None,
+              tol=1e-4,
+              max_iter=200,
+              weights=None,
+              solver='cd'):
+    """
+    Fits one NMF model to each of the given training blocks.
+
+    Initial factors are taken from W and H if given, and otherwise generated
+    with the given initialization method. If weights are given, the rows of
+    each block are weighted by them in the objective. The solver is cd for
+    coordinate descent or mu for multiplicative updates, as in scikit-learn.
+
+    :param List[Union[np.ndarray, sp.spmatrix]] blocks: dense or sparse
+        training blocks
+
+    :param Union[int, Sequence[int]] k
+
+    :param Union[float, Sequence[float]] alpha
+
+    :param Union[float, Sequence[float]] l1_ratio
+
+    :param List[np.ndarray] W
+
+    :param List[np.ndarray] H
+
+    :param str init
+
+    :param float tol
+
+    :param int max_iter
+
+    :param List[np.ndarray] weights: row weights for each block
+
+    :param str solver
+
+    :rtype: List[BatchResult]
+    """
+
+    if solver not in SOLVERS:
+
+        raise ValueError('solver must be one of {}'.format(SOLVERS))
+
+    n = len(blocks)
+
+    k = _broadcast(k, n).astype(int)
+
+    alpha = _broadcast(alpha, n)
+
+    l1_ratio = _broadcast(l1_ratio, n)
+
+    if (W is None or H is None) and weights is not None:
+
+        W, H = zip(*(initialize_weighted(X, c, k_, init)
+                     for X, c, k_ in zip(blocks, weights, k)))
+
+    elif W is None or H is None:
+
+        W, H = zip(*(initialize(X, k_, init) for X, k_ in zip(blocks, k)))
+
+    # Pad everything to a common shape and rank.
+
+    n_samples = max(X.shape[0] for X in blocks)
+
+    n_features = max(X.shape[1] for X in blocks)
+
+    n_components = k.max()
+
+    shared = all(X is blocks[0] for X in blocks)
+
+    if sp.issparse(blocks[0]):
+
+        X_all = _pad_sparse(blocks[:1], blocks[0].shape) * n if shared else \
+            _pad_sparse(blocks, (n_samples, n_features))
+
+    else:
+
+        X_all = np.asarray(blocks[0], dtype=float)[np.newaxis] if shared \
+            else _pad(blocks, (n_samples, n_features))
+
+    W_all = _pad(W, (n_samples, n_components))
+
+    H_all = _pad(H, (n_components, n_features))
+
+    C_all = None if weights is None else _pad(
+        [np.asarray(c, dtype=float)[:, np.newaxis] for c in weights],
+        (n_samples, 1))
+
+    l1_all = (alpha * l1_ratio)[:, np.newaxis, np.newaxis]
+
+    l2_all = (alpha * (1. - l1_ratio))[:, np.newaxis, np.newaxis]
+
+    # Run the updates on active members only, refreshing the active views
+    # whenever a member converges.
+
+    # As in scikit-learn, coordinate descent stops on the decrease of the
+    # projected gradient, and multiplicative updates on the decrease of the
+    # error every ten iterations.
+
+    if solver == 'cd':
+
+        violation_at_init = np.zeros(n)
+
+    else:
+
+        error_at_init = _get_errors(X_all, W_all, H_all, C_all)
+
+        previous_error = error_at_init.copy()
+
+    n_iter = np.zeros(n, dtype=int)
+
+    active = np.arange(n)
+
+    X_, W_, H_, l1, l2, C = X_all, W_all, H_all, l1_all, l2_all, C_all
+
+    for i in range(1, max_iter + 1):
+
+        if solver == 'cd':
+
+            violation = _update_cd(X_, W_, H_, l1, l2, C)
+
+            n_iter[active] = i
+
+            if i == 1:
+
+                violation_at_init[active] = violation
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+
+                converged = (violation_at_init[active] == 0) | (
+                    violation / violation_at_init[active] <= tol)
+
+        else:
+
+            _update_mu(X_, W_, H_, l1, l2, C)
+
+            n_iter[active] = i
+
+            if tol <= 0 or i % 10 != 0:
+
+                continue
+
+            error = _get_errors(X_, W_, H_, C)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+
+                converged = (previous_error[active] - error
+                             ) / error_at_init[active] < tol
+
+            previous_error[active] = error
+
+        if not converged.any():
+
+            continue
+
+        if W_ is not W_all:
+
+            W_all[active], H_all[active] = W_, H_
+
+        active = active[~converged]
+
+        if not len(active):
+
+            break
+
+        X_, W_, H_, l1, l2 = _take(X_all, active), W_all[active], H_all[
+            active], l1_all[active], l2_all[active]
+
+        C = None if C_all is None else C_all[active]
+
+    if W_ is not W_all and len(active):
+
+        W_all[active], H_all[active] = W_, H_
+
+    error = _get_errors(X_all, W_all, H_all, C_all)
+
+    return [
+        BatchResult(W_all[i, :X.shape[0], :k_], H_all[i, :k_, :X.shape[1]],
+                    n_iter[i], error[i])
+        for i, (X, k_) in enumerate(zip(blocks, k))
+    ]
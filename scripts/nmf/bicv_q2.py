@@ -0,0 +1,205 @@
+"""
+Calculates Q2 for bi-cross-validation as outlined in Owen and Perry.
+
+For a training block X_tr ~ WH, the held-out block is reconstructed as
+
+    X_bl pinv(H) pinv(W) X_tr
+
+The pseudo-inverses are obtained by least squares on the factors themselves,
+as the minimum-norm solutions of H P = I and W' Q = I, rather than through
+the Gram matrices HH' and W'W, whose condition numbers are the squares of
+those of the factors. Only products of the blocks with the pseudo-inverses
+are formed, so for sparse blocks, the held-out residual is reduced through
+products with k columns, and the dense reconstruction is never formed.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def _pad(arrays, shape):
+    """
+    Stacks the given arrays into one zero-padded array with a leading batch
+    axis.
+
+    :param List[np.ndarray] arrays
+
+    :param Tuple[int, int] shape
+
+    :rtype: np.ndarray
+    """
+
+    result = np.zeros((len(arrays), ) + shape)
+
+    for i, a in enumerate(arrays):
+
+        result[i, :a.shape[0], :a.shape[1]] = a
+
+    return result
+
+
+def _pinv(A):
+    """
+    Calculates the pseudo-inverse of the given matrix with k rows by least
+    squares.
+
+    :param np.ndarray A: (k, n)
+
+    :rtype: np.ndarray
+    """
+
+    return np.linalg.lstsq(A, np.eye(A.shape[0]), rcond=None)[0]
+
+
+def _project(bottomleft, topright, components, coefficients, k):
+    """
+    Projects each of the given held-out row blocks onto the pseudo-inverse of
+    its fitted H, and each of the given held-out column blocks onto that of
+    its fitted W, so that the reconstruction of the held-out block is the
+    product of the projections.
+
+    :param List[Union[np.ndarray, sp.spmatrix]] bottomleft
+
+    :param List[Union[np.ndarray, sp.spmatrix]] topright
+
+    :param List[np.ndarray] components
+
+    :param List[np.ndarray] coefficients
+
+    :param int k
+
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+
+    n_test = max(x.shape[0] for x in bottomleft)
+
+    m_test = max(x.shape[1] for x in topright)
+
+    left = _pad([
+        np.asarray(bl.dot(_pinv(H)))
+        for bl, H in zip(bottomleft, components)
+    ], (n_test, k))
+
+    right = _pad([
+        np.asarray(tr.T.dot(_pinv(W.T))).T
+        for tr, W in zip(topright, coefficients)
+    ], (k, m_test))
+
+    return left, right
+
+
+def _get_sparse_q2_batch(bottomleft, topright, test, components, coefficients,
+                         k):
+    """
+    Calculates Q2 for each of the given sets of sparse held-out blocks and
+    fitted factors, expanding the squared residual as
+    ||T||^2 - 2 <TR', A> + <A'A, RR'> for the reconstruction AR.
+
+    :param List[sp.spmatrix] bottomleft
+
+    :param List[sp.spmatrix] topright
+
+    :param List[sp.spmatrix] test
+
+    :param List[np.ndarray] components
+
+    :param List[np.ndarray] coefficients
+
+    :param int k
+
+    :rtype: np.ndarray
+    """
+
+    n_test = max(x.shape[0] for x in test)
+
+    A, right = _project(bottomleft, topright, components, coefficients, k)
+
+    projected_test = _pad([
+        T.dot(R[:, :T.shape[1]].T) for T, R in zip(test, right)
+    ], (n_test, k))
+
+    denominator = np.array([T.multiply(T).sum() for T in test])
+
+    numerator = denominator - 2 * np.sum(
+        projected_test * A, axis=(1, 2)) + np.sum(
+            np.matmul(np.swapaxes(A, 1, 2), A) * np.matmul(
+                right, np.swapaxes(right, 1, 2)),
+            axis=(1, 2))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        return 1 - numerator / denominator
+
+
+def get_q2_batch(bottomleft, topright, test, components, coefficients):
+    """
+    Calculates Q2 for each of the given sets of held-out blocks and fitted
+    factors, e.g., for all folds of a seed.
+
+    Blocks and factors of different shapes are zero-padded to a common shape,
+    which affects neither the reconstructions nor the sums of squares. The
+    blocks may be sparse.
+
+    :param List[Union[np.ndarray, sp.spmatrix]] bottomleft: held-out rows,
+        training columns
+
+    :param List[Union[np.ndarray, sp.spmatrix]] topright: training rows,
+        held-out columns
+
+    :param List[Union[np.ndarray, sp.spmatrix]] test: held-out rows, held-out
+        columns
+
+    :param List[np.ndarray] components: fitted H (k x training columns)
+
+    :param List[np.ndarray] coefficients: fitted W (training rows x k)
+
+    :rtype: np.ndarray
+    """
+
+    k = max(x.shape[0] for x in components)
+
+    if sp.issparse(test[0]):
+
+        return _get_sparse_q2_batch(bottomleft, topright, test, components,
+                                    coefficients, k)
+
+    test = _pad(test, (max(x.shape[0] for x in test),
+                       max(x.shape[1] for x in test)))
+
+    left, right = _project(bottomleft, topright, components, coefficients, k)
+
+    reconstructions = np.matmul(left, right)
+
+    # Calculate the numerator and denominator in one pass.
+
+    stacked = np.stack([test - reconstructions, test], axis=1)
+
+    sums = np.einsum('bcij,bcij->bc', stacked, stacked)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        return 1 - sums[:, 0] / sums[:, 1]
+
+
+def get_q2(bottomleft, topright, test, components, coefficients):
+    """
+    Calculates Q2 for the given held-out blocks and fitted factors.
+
+    :param Union[np.ndarray, sp.spmatrix] bottomleft: held-out rows, training
+        columns
+
+    :param Union[np.ndarray, sp.spmatrix] topright: training rows, held-out
+        columns
+
+    :param Union[np.ndarray, sp.spmatrix] test: held-out rows, held-out
+        columns
+
+    :param np.ndarray components: fitted H (k x training columns)
+
+    :param np.ndarray coefficients: fitted W (training rows x k)
+
+    :rtype: float
+    """
+
+    return get_q2_batch([bottomleft], [topright], [test], [components],
+                        [coefficients])[0]
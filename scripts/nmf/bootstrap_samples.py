@@ -0,0 +1,77 @@
+"""
+Stores bootstrapped basis matrix samples as a dense seeds x factors x
+variables array in a NumPy file, with the seed, factor, and variable labels in
+a JSON file of the same name with .json appended.
+"""
+
+import json
+import logging
+import numpy as np
+
+from collections import namedtuple
+
+SampleArray = namedtuple('SampleArray',
+                         ['values', 'seeds', 'factors', 'variables'])
+
+
+def get_metadata_path(path):
+    """
+    Obtains the path of the labels for the sample array at the given path.
+
+    :param str path
+
+    :rtype: str
+    """
+
+    return path + '.json'
+
+
+def write_sample_array(df, path):
+    """
+    Writes the given samples to the given path as a sample array.
+
+    :param pd.DataFrame df: samples indexed by seed and factor, with one
+        column per variable, and with the factors of each seed in order
+
+    :param str path
+    """
+
+    seeds = df.index.get_level_values('seed').unique()
+
+    factors = df.index.get_level_values('factor').unique()
+
+    values = df.values.astype(np.float32).reshape(
+        (len(seeds), len(factors), df.shape[1]))
+
+    logging.info('Writing a sample array with shape {}'.format(values.shape))
+
+    np.save(path, values)
+
+    with open(get_metadata_path(path), 'w') as handle:
+
+        json.dump({
+            'seeds': [int(x) for x in seeds],
+            'factors': [int(x) for x in factors],
+            'variables': [str(x) for x in df.columns]
+        }, handle)
+
+
+def load_sample_array(path):
+    """
+    Loads the sample array at the given path, memory-mapping its values.
+
+    :param str path
+
+    :rtype: SampleArray
+    """
+
+    values = np.load(path, mmap_mode='r')
+
+    with open(get_metadata_path(path)) as handle:
+
+        metadata = json.load(handle)
+
+    logging.info('Loaded a sample array with shape {}'.format(values.shape))
+
+    return SampleArray(values, metadata['seeds'], metadata['factors'],
+                       metadata['variables'])
@@ -0,0 +1,113 @@
+"""
+Assigns patients to clusters from their factor scores.
+
+Assignments are calculated over a whole score matrix at once, with one row per
+patient or patient-visit and one column per factor, and are represented as the
+positions of the assigned factors, or -1 for unassigned rows.
+"""
+
+import numpy as np
+import string
+
+
+def get_variance_thresholds(values, coefficient=1.):
+    """
+    Obtains the minimum score required to count each factor towards an
+    assignment: the given multiple of the MLE standard deviation of the factor,
+    with the mean fixed to 0.
+
+    :param np.ndarray values
+
+    :param float coefficient
+
+    :rtype: np.ndarray
+    """
+
+    return np.sqrt(np.mean(np.square(values), axis=0)) * coefficient
+
+
+def assign(values, thresholds=None, inclusive=True):
+    """
+    Assigns each row of the given scores to its highest-scoring factor.
+
+    :param np.ndarray values
+
+    :param Union[float, np.ndarray] thresholds: if given, rows with no score
+        reaching the threshold of its factor are unassigned
+
+    :param bool inclusive: whether a score equal to its threshold reaches it
+
+    :rtype: np.ndarray[int]
+    """
+
+    values = np.asarray(values)
+
+    result = values.argmax(axis=1)
+
+    if thresholds is None:
+
+        return result
+
+    reached = values >= thresholds if inclusive else values > thresholds
+
+    return np.where(reached.any(axis=1), result, -1)
+
+
+def get_labels(assignments, labels, unassigned=None):
+    """
+    Converts the given assignments to the given factor labels.
+
+    :param np.ndarray[int] assignments
+
+    :param Sequence labels
+
+    :param unassigned: the label for unassigned rows
+
+    :rtype: np.ndarray
+    """
+
+    # Position -1 picks out the unassigned label.
+
+    labels = np.append(np.asarray(labels, dtype=object), [unassigned])
+
+    return labels[assignments]
+
+
+def get_letter_labels(factors):
+    """
+    Labels the given factors, numbered from 1, with letters.
+
+    :param Sequence factors
+
+    :rtype: List[str]
+    """
+
+    return [string.ascii_uppercase[int(x) - 1] for x in factors]
+
+
+def get_number_labels(factors):
+    """
+    Labels the given factors, numbered from 1, with zero-padded numbers.
+
+    :param Sequence factors
+
+    :rtype: List[str]
+    """
+
+    return ['{:02d}'.format(int(x)) for x in factors]
+
+
+def pivot_scores(df, keys):
+    """
+    Reshapes the given scores, with one row per key and factor, to a score
+    matrix indexed by the given keys, with one column per factor in order.
+
+    :param pd.DataFrame df: scores with the given key columns, a factor
+        column, and a score column
+
+    :param List[str] keys
+
+    :rtype: pd.DataFrame
+    """
+
+    return df.set_index(keys + ['factor'])['score'].unstack('factor')
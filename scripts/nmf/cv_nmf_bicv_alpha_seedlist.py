@@ -9,16 +9,30 @@ them.
 
 import argparse
 import feather
+import functools
 import itertools
 import joblib
 import logging
 import numpy as np
+import os
 import pandas as pd
+import scipy.sparse as sp
+import shutil
+import tempfile
+import time
 import tqdm
 
-from collections import namedtuple
+from batched_nmf import fit_batch, get_nndsvd, initialize, thin_svd
+from bicv_q2 import get_q2, get_q2_batch
+from collections import OrderedDict, namedtuple
+from contextlib import ExitStack, contextmanager
+from fit_telemetry import (TELEMETRY_COLUMNS, fit_with_telemetry,
+                           get_batch_telemetry, get_empty_telemetry,
+                           summarize_telemetry, write_telemetry)
+from result_log import ResultLog, order_rows, restore_index
 from sklearn.decomposition import NMF
 from sklearn.model_selection import KFold
+from sparse_data import load_sparse_csv
 
 
 def get_arguments():
@@ -46,6 +60,11 @@ def get_arguments():
         metavar='OUTPUT',
         help='write Q2 values to Feather file %(metavar)s')
 
+    parser.add_argument(
+        '--sparse',
+        action='store_true',
+        help='load the input as a sparse matrix and keep it sparse throughout')
+
     parser.add_argument(
         '--init',
         choices=('random', 'nndsvd', 'nndsvda', 'nndsvdar'),
@@ -86,6 +105,73 @@ def get_arguments():
     parser.add_argument(
         '--alpha-exp-end', type=int, metavar='ALPHA-EXP-END', default=10)
 
+    parser.add_argument(
+        '--svd-cache',
+        type=int,
+        default=0,
+        metavar='SVD-CACHE',
+        help='compute one SVD per seed and fold, keeping up to %(metavar)s '
+        'of them per process, and derive NNDSVD initializations for every '
+        'rank from it (default: %(default)s, i.e., disabled)')
+
+    parser.add_argument(
+        '--engine',
+        choices=('sklearn', 'batched'),
+        default='sklearn',
+        metavar='ENGINE',
+        help='fit models with scikit-learn one at a time, or all models of a '
+        'batch at once with the same coordinate descent (default: '
+        '%(default)s)')
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=64,
+        metavar='BATCH-SIZE',
+        help='fit %(metavar)s models per batch with the batched engine '
+        '(default: %(default)s)')
+
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        help='search the grid by successive halving, dropping configurations '
+        'whose Q2 is clearly below the current best after each round of '
+        'seeds')
+
+    parser.add_argument(
+        '--initial-seeds',
+        type=int,
+        default=2,
+        metavar='INITIAL-SEEDS',
+        help='evaluate all configurations on %(metavar)s seeds in the first '
+        'round of the adaptive search (default: %(default)s)')
+
+    parser.add_argument(
+        '--z',
+        type=float,
+        default=1.96,
+        metavar='Z',
+        help='use %(metavar)s as the critical value of the Q2 confidence '
+        'intervals in the adaptive search (default: %(default)s)')
+
+    parser.add_argument(
+        '--result-log',
+        metavar='RESULT-LOG',
+        help='append results to Arrow IPC stream %(metavar)s as tasks finish')
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='skip tasks whose results are already in the result log')
+
+    parser.add_argument(
+        '--log-every',
+        type=int,
+        default=100,
+        metavar='LOG-EVERY',
+        help='append results to the result log every %(metavar)s tasks '
+        '(default: %(default)s)')
+
     parser.add_argument(
         '--folds',
         type=int,
@@ -101,12 +187,36 @@ def get_arguments():
         default=-1,
         help='use %(metavar)s cores for the analysis')
 
+    parser.add_argument(
+        '--shared-data',
+        action='store_true',
+        help='publish the data once to a read-only memory-mapped buffer that '
+        'workers attach to, instead of sending a copy with every task')
+
+    parser.add_argument(
+        '--shared-dir',
+        metavar='SHARED-DIR',
+        help='place the shared buffer in directory %(metavar)s (e.g., '
+        '/dev/shm; default: the system temporary directory)')
+
+    parser.add_argument(
+        '--telemetry-output',
+        metavar='TELEMETRY-OUTPUT',
+        help='output the convergence and wall time of every fit to Feather '
+        'file %(metavar)s, and log a summary of them')
+
     parser.add_argument(
         '--log',
         metavar='LOG',
         help='write logging information to %(metavar)s')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    if args.resume and not args.result_log:
+
+        parser.error('--resume requires --result-log')
+
+    return args
 
 
 def configure_logging(log=None):
@@ -137,17 +247,23 @@ def configure_logging(log=None):
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 
-def load_data(handle):
+def load_data(handle, sparse=False):
     """
     Loads data from the given handle.
 
     :param io.file handle
 
-    :rtype: pd.DataFrame
+    :param bool sparse
+
+    :rtype: Union[pd.DataFrame, SparseFrame]
     """
 
     logging.info('Loading data')
 
+    if sparse:
+
+        return load_sparse_csv(handle)
+
     result = pd.read_csv(handle, index_col=0)
 
     logging.info('Loaded a table with shape {}'.format(result.shape))
@@ -277,7 +393,7 @@ def _get_parameter_tuples(seed, k, alpha, folds, df):
 
     :param int folds: the number of folds to split the data into
 
-    :param pd.DataFrame df: the data to split
+    :param Union[pd.DataFrame, SparseFrame] df: the data to split
 
     :rtype: generator
     """
@@ -286,9 +402,9 @@ def _get_parameter_tuples(seed, k, alpha, folds, df):
 
     fold_generator = KFold(n_splits=folds, shuffle=True)
 
-    sample_folds = fold_generator.split(data)
+    sample_folds = fold_generator.split(np.arange(df.shape[0]))
 
-    feature_folds = fold_generator.split(data.T)
+    feature_folds = fold_generator.split(np.arange(df.shape[1]))
 
     for f, ix in enumerate(zip(sample_folds, feature_folds)):
 
@@ -299,7 +415,7 @@ def _get_parameter_tuples(seed, k, alpha, folds, df):
                          measurement_ix[1])
 
 
-def _get_parameter_generator(seeds, k, alpha, folds, df):
+def _get_parameter_generator(seeds, configurations, folds, df):
     """
     Produces a generator that yields parameters for a single iteration.
 
@@ -316,24 +432,24 @@ def _get_parameter_generator(seeds, k, alpha, folds, df):
 
     :param List[int] seeds
 
-    :param List[int] k: the numbers of factors to test
-
-    :param List[float] alpha: the values of alpha to test
+    :param List[Tuple[int, float]] configurations: the numbers of factors and
+        values of alpha to test
 
     :param int folds: the number of folds to split the data into
 
-    :param pd.DataFrame df: the data to split
+    :param Union[pd.DataFrame, SparseFrame] df: the data to split
 
     :rtype: generator
     """
 
     return itertools.chain(*(_get_parameter_tuples(s, k_, a, folds, df)
-                             for s in seeds for k_ in k for a in alpha))
+                             for s in seeds for k_, a in configurations))
 
 
-def _make_q2_result(seed, k, alpha, fold, q2):
+def _make_q2_result(seed, k, alpha, fold, q2, telemetry=None):
     """
-    Produces a result with the given values.
+    Produces a result with the given values, and the given telemetry of the
+    fit if there was one.
 
     :param int seed
 
@@ -344,9 +460,11 @@ def _make_q2_result(seed, k, alpha, fold, q2):
     :param int fold
 
     :param float q2
+
+    :param dict telemetry
     """
 
-    return pd.DataFrame({
+    result = pd.DataFrame({
         'seed': [seed],
         'k': [k],
         'alpha': [alpha],
@@ -354,13 +472,267 @@ def _make_q2_result(seed, k, alpha, fold, q2):
         'q2': [q2]
     })
 
+    for key, value in (telemetry or get_empty_telemetry()).items():
+
+        result[key] = value
+
+    return result
+
+
+SharedData = namedtuple('SharedData', ['path', 'shape', 'sparse'])
+
+# Memory-mapped arrays attached by this process, keyed by path.
+
+_attached_data = {}
+
+
+@contextmanager
+def publish_data(df, directory=None):
+    """
+    Publishes the values of the given table to a read-only memory-mapped
+    buffer, yielding a handle that workers can use to attach to it. The buffer
+    is removed on exit.
+
+    Sparse values are published as the data, indices, and index pointer arrays
+    of their CSR representation in the buffer directory.
+
+    :param Union[pd.DataFrame, SparseFrame] df
+
+    :param str directory
+
+    :rtype: SharedData
+    """
+
+    temp_dir = tempfile.mkdtemp(prefix='bicv-', dir=directory)
+
+    sparse = sp.issparse(df.values)
+
+    path = temp_dir if sparse else os.path.join(temp_dir, 'data.npy')
+
+    logging.info('Publishing data to {}'.format(path))
+
+    if sparse:
+
+        for name in ('data', 'indices', 'indptr'):
+
+            np.save(
+                os.path.join(path, name + '.npy'), getattr(df.values, name))
+
+    else:
+
+        np.save(path, np.ascontiguousarray(df.values, dtype=np.float64))
+
+    try:
+
+        yield SharedData(path, df.shape, sparse)
+
+    finally:
+
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _get_values(df):
+    """
+    Obtains the values of the given data as an array, attaching to a shared
+    buffer if a handle is given.
+
+    :param Union[pd.DataFrame, SparseFrame, SharedData] df
+
+    :rtype: Union[np.ndarray, sp.csr_matrix]
+    """
+
+    if not isinstance(df, SharedData):
+
+        return df.values
+
+    if df.path not in _attached_data:
+
+        if df.sparse:
+
+            _attached_data[df.path] = sp.csr_matrix(
+                tuple(
+                    np.load(
+                        os.path.join(df.path, name + '.npy'), mmap_mode='r')
+                    for name in ('data', 'indices', 'indptr')),
+                shape=df.shape)
+
+        else:
+
+            _attached_data[df.path] = np.load(df.path, mmap_mode='r')
+
+    return _attached_data[df.path]
+
+
+def _get_sum_of_squares(x):
+    """
+    Calculates the sum of squares of the given dense or sparse values.
+
+    :param Union[np.ndarray, sp.spmatrix] x
+
+    :rtype: float
+    """
+
+    return x.multiply(x).sum() if sp.issparse(x) else (x**2).sum()
+
+
+Blocks = namedtuple('Blocks', ['train', 'bottomleft', 'topright', 'test'])
+
 
-def _cross_validate(df, init, l1_ratio, parameters):
+def _split_data(values, parameters):
+    """
+    Splits the given data into training, bottom-left, top-right, and test
+    blocks for the given parameters.
+
+    :param np.ndarray values
+
+    :param Parameters parameters
+
+    :rtype: Blocks
+    """
+
+    observation_train_ix = parameters.observation_train_ix
+
+    observation_test_ix = parameters.observation_test_ix
+
+    measurement_train_ix = parameters.measurement_train_ix
+
+    measurement_test_ix = parameters.measurement_test_ix
+
+    return Blocks(
+        values[np.ix_(observation_train_ix, measurement_train_ix)],
+        values[np.ix_(observation_test_ix, measurement_train_ix)],
+        values[np.ix_(observation_train_ix, measurement_test_ix)],
+        values[np.ix_(observation_test_ix, measurement_test_ix)])
+
+
+def _get_q2(blocks, components, coefficients):
+    """
+    Calculates Q2 for the held-out block given a fitted basis and fitted
+    coefficients of the training block.
+
+    :param Blocks blocks
+
+    :param np.ndarray components
+
+    :param np.ndarray coefficients
+
+    :rtype: float
+    """
+
+    return get_q2(blocks.bottomleft, blocks.topright, blocks.test, components,
+                  coefficients)
+
+
+# Thin SVDs of training blocks computed by this process, keyed by seed and
+# fold, in order of least recent use.
+
+_svd_cache = OrderedDict()
+
+
+def _get_svd(blocks, parameters, cache_size):
+    """
+    Obtains the thin SVD of the training block for the given parameters,
+    reusing a cached SVD for the same seed and fold if possible.
+
+    The least recently used SVDs are evicted so that at most the given number
+    of SVDs are kept.
+
+    :param Blocks blocks
+
+    :param Parameters parameters
+
+    :param int cache_size
+
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+
+    key = (parameters.seed, parameters.fold)
+
+    if key in _svd_cache:
+
+        _svd_cache.move_to_end(key)
+
+        return _svd_cache[key]
+
+    result = thin_svd(blocks.train)
+
+    _svd_cache[key] = result
+
+    while len(_svd_cache) > cache_size:
+
+        _svd_cache.popitem(last=False)
+
+    return result
+
+
+def _fit_initial(blocks, parameters, k, alpha, init, l1_ratio, svd_cache):
+    """
+    Fits an NMF model to the training block for the given parameters from the
+    given initialization method, using the SVD cache for NNDSVD
+    initializations if enabled. Returns the model, the coefficients, and the
+    telemetry of the fit.
+
+    :param Blocks blocks
+
+    :param Parameters parameters
+
+    :param int k
+
+    :param float alpha
+
+    :param str init
+
+    :param float l1_ratio
+
+    :param int svd_cache: the maximum number of cached SVDs, or 0 to disable
+        the cache
+
+    :rtype: Tuple[NMF, np.ndarray, dict]
+    """
+
+    if svd_cache > 0 and init.startswith('nndsvd'):
+
+        W, H = get_nndsvd(blocks.train,
+                          _get_svd(blocks, parameters, svd_cache), k, init)
+
+        nmf = _make_nmf(k, alpha, 'custom', l1_ratio)
+
+        return (nmf, ) + fit_with_telemetry(nmf, blocks.train, W=W, H=H)
+
+    nmf = _make_nmf(k, alpha, init, l1_ratio)
+
+    return (nmf, ) + fit_with_telemetry(nmf, blocks.train)
+
+
+def _make_nmf(k, alpha, init, l1_ratio):
+    """
+    Creates an NMF model for cross-validation.
+
+    :param int k
+
+    :param float alpha
+
+    :param str init
+
+    :param float l1_ratio
+
+    :rtype: NMF
+    """
+
+    return NMF(n_components=k,
+               alpha=alpha,
+               tol=1e-6,
+               max_iter=200,
+               init=init,
+               l1_ratio=l1_ratio)
+
+
+def _cross_validate(df, init, l1_ratio, parameters, svd_cache=0):
     """
     Conducts cross-validation for the given data and parameters, returning a
     result containing a value of Q2.
 
-    :param pd.DataFrame df
+    :param Union[pd.DataFrame, SparseFrame, SharedData] df
 
     :param str init
 
@@ -368,62 +740,173 @@ def _cross_validate(df, init, l1_ratio, parameters):
 
     :param Parameters parameters
 
+    :param int svd_cache
+
     :rtype: pd.DataFrame
     """
 
     # Split the data.
 
-    test_data = data.iloc[parameters.observation_test_ix,
-                          parameters.measurement_test_ix]
+    blocks = _split_data(_get_values(df), parameters)
 
     # If the test data is all zeros, this will fail.
 
-    denominator = (test_data**2).sum().sum()
-
-    if denominator == 0.:
+    if _get_sum_of_squares(blocks.test) == 0.:
 
         return _make_q2_result(parameters.seed, parameters.k, parameters.alpha,
                                parameters.fold, np.nan)
 
-    train_data = data.iloc[parameters.observation_train_ix,
-                           parameters.measurement_train_ix]
+    # Set the seed.
 
-    bottomleft_data = data.iloc[parameters.observation_test_ix,
-                                parameters.measurement_train_ix]
+    np.random.seed(parameters.seed)
 
-    topright_data = data.iloc[parameters.observation_train_ix,
-                              parameters.measurement_test_ix]
+    # Run NMF.
 
-    # Set the seed.
+    nmf, coefficients, telemetry = _fit_initial(
+        blocks, parameters, parameters.k, parameters.alpha, init, l1_ratio,
+        svd_cache)
 
-    np.random.seed(parameters.seed)
+    q2 = _get_q2(blocks, nmf.components_, coefficients)
+
+    return _make_q2_result(parameters.seed, parameters.k, parameters.alpha,
+                           parameters.fold, q2, telemetry)
+
+
+def _cross_validate_batch(df, init, l1_ratio, parameters, svd_cache=0):
+    """
+    Conducts cross-validation for the given data and a batch of parameters,
+    fitting all models at once with batched coordinate descent and returning
+    a result containing a value of Q2 per parameter tuple.
+
+    :param Union[pd.DataFrame, SparseFrame, SharedData] df
+
+    :param str init
+
+    :param float l1_ratio
+
+    :param List[Parameters] parameters
+
+    :param int svd_cache
+
+    :rtype: pd.DataFrame
+    """
+
+    values = _get_values(df)
+
+    # Split the data, setting aside folds with all-zero test data.
+
+    blocks = [_split_data(values, p) for p in parameters]
+
+    fitted = [(p, b) for p, b in zip(parameters, blocks)
+              if _get_sum_of_squares(b.test) != 0.]
+
+    # Initialize each model with its own seed.
+
+    initial_factors = []
+
+    for p, b in fitted:
+
+        np.random.seed(p.seed)
+
+        svd = _get_svd(b, p, svd_cache) if svd_cache > 0 and init.startswith(
+            'nndsvd') else None
+
+        initial_factors.append(initialize(b.train, p.k, init, svd=svd))
+
+    W, H = zip(*initial_factors) if initial_factors else ((), ())
 
     # Run NMF.
 
-    nmf = NMF(n_components=parameters.k,
-              alpha=parameters.alpha,
-              tol=1e-6,
-              max_iter=200,
-              init=init,
-              l1_ratio=l1_ratio)
+    start = time.perf_counter()
 
-    coefficients = nmf.fit_transform(train_data)
+    results = fit_batch(
+        [b.train for _, b in fitted], [p.k for p, _ in fitted],
+        [p.alpha for p, _ in fitted],
+        l1_ratio,
+        W=W,
+        H=H,
+        tol=1e-6,
+        max_iter=200) if fitted else []
 
-    test_reconstructions = bottomleft_data.values.dot(
-        np.linalg.pinv(nmf.components_)).dot(np.linalg.pinv(coefficients)).dot(
-            topright_data.values)
+    telemetry = dict(
+        zip((id(p) for p, _ in fitted),
+            get_batch_telemetry(results, 200, time.perf_counter() - start)))
 
-    q2 = 1 - ((test_data - test_reconstructions)**2).sum().sum() / (
-        test_data**2).sum().sum()
+    # Calculate Q2 for all models at once.
 
-    return _make_q2_result(parameters.seed, parameters.k, parameters.alpha,
-                           parameters.fold, q2)
+    q2 = dict(
+        zip((id(p) for p, _ in fitted),
+            get_q2_batch([b.bottomleft for _, b in fitted],
+                         [b.topright for _, b in fitted],
+                         [b.test for _, b in fitted], [r.H for r in results],
+                         [r.W for r in results]))) if fitted else {}
+
+    return pd.concat(
+        _make_q2_result(p.seed, p.k, p.alpha, p.fold, q2.get(id(p), np.nan),
+                        telemetry.get(id(p))) for p in parameters)
 
 
-def cross_validate(data, folds, k, alpha, init, l1_ratio, cores, seeds):
+def _chunk(iterable, size):
+    """
+    Groups the given iterable into lists of at most the given size.
+
+    :param Iterable iterable
+
+    :param int size
+
+    :rtype: generator
+    """
+
+    iterator = iter(iterable)
+
+    while True:
+
+        chunk = list(itertools.islice(iterator, size))
+
+        if not chunk:
+
+            return
+
+        yield chunk
+
+
+Settings = namedtuple('Settings', [
+    'folds', 'init', 'l1_ratio', 'cores', 'svd_cache', 'engine',
+    'batch_size', 'log_every'
+])
+
+
+def cross_validate(data,
+                   folds,
+                   k,
+                   alpha,
+                   init,
+                   l1_ratio,
+                   cores,
+                   seeds,
+                   shared_data=False,
+                   shared_dir=None,
+                   svd_cache=0,
+                   engine='sklearn',
+                   batch_size=64,
+                   adaptive=False,
+                   initial_seeds=2,
+                   z=1.96,
+                   result_log=None,
+                   resume=False,
+                   log_every=100):
     """
     Conducts cross-validation.
 
+    If shared_data is set, the data are published once to a memory-mapped
+    buffer and each task only carries a handle to it. If svd_cache is
+    positive, NNDSVD initializations are derived from one cached SVD per seed
+    and fold. With the batched engine, each task fits batch_size models at
+    once. If adaptive is set, the grid is searched by successive halving (see
+    _search_adaptively). If result_log is given, results are appended to it
+    every log_every tasks, and if resume is also set, tasks whose results are
+    already in it are skipped.
+
     :param pd.DataFrame data
 
     :param int folds
@@ -440,36 +923,333 @@ def cross_validate(data, folds, k, alpha, init, l1_ratio, cores, seeds):
 
     :param List[int] seeds
 
+    :param bool shared_data
+
+    :param str shared_dir
+
+    :param int svd_cache
+
+    :param str engine
+
+    :param int batch_size
+
+    :param bool adaptive
+
+    :param int initial_seeds
+
+    :param float z
+
+    :param str result_log
+
+    :param bool resume
+
+    :param int log_every
+
+    :rtype: pd.DataFrame
+    """
+
+    settings = Settings(folds, init, l1_ratio, cores, svd_cache, engine,
+                        batch_size, log_every)
+
+    configurations = [(k_, a) for k_ in k for a in alpha]
+
+    search = functools.partial(
+        _search_adaptively, initial_seeds=initial_seeds,
+        z=z) if adaptive else _run_cross_validation
+
+    with ExitStack() as stack:
+
+        source = stack.enter_context(
+            publish_data(data, directory=shared_dir)) if shared_data else data
+
+        log = stack.enter_context(ResultLog(
+            result_log, resume=resume)) if result_log else None
+
+        return search(data, source, configurations, seeds, settings, log)
+
+
+def _get_surviving_configurations(q2, configurations, z):
+    """
+    Determines which of the given configurations remain candidates for the
+    highest mean Q2, given the Q2 values obtained so far.
+
+    As in get_k.py, Q2 values of -1 or less are discarded, and configurations
+    left without Q2 values are dropped. Any other configuration is dropped if
+    the upper bound of its confidence interval for the mean Q2 is below the
+    lower bound of that of the current best configuration.
+
+    :param pd.DataFrame q2
+
+    :param List[Tuple[int, float]] configurations
+
+    :param float z: the critical value of the confidence intervals
+
+    :rtype: List[Tuple[int, float]]
+    """
+
+    q2 = q2.loc[q2['q2'] > -1.]
+
+    stats = q2.groupby(['k', 'alpha'])['q2'].agg(['mean', 'std', 'count'])
+
+    half_width = z * (stats['std'] / np.sqrt(stats['count'])).fillna(0.)
+
+    configurations = [c for c in configurations if c in stats.index]
+
+    if not configurations:
+
+        return configurations
+
+    best = stats['mean'].idxmax()
+
+    threshold = stats.loc[best, 'mean'] - half_width.loc[best]
+
+    upper = stats['mean'] + half_width
+
+    return [c for c in configurations if upper.loc[c] >= threshold]
+
+
+def _search_adaptively(data,
+                       source,
+                       configurations,
+                       seeds,
+                       settings,
+                       log=None,
+                       initial_seeds=2,
+                       z=1.96):
+    """
+    Searches the given configurations by successive halving.
+
+    All configurations are first evaluated on initial_seeds seeds. After each
+    round, configurations whose Q2 confidence interval is clearly below that
+    of the current best are dropped, and the survivors are evaluated on twice
+    as many new seeds as in the previous round, until the seeds are exhausted
+    or a single configuration remains.
+
+    :param pd.DataFrame data
+
+    :param Union[pd.DataFrame, SparseFrame, SharedData] source
+
+    :param List[Tuple[int, float]] configurations
+
+    :param List[int] seeds
+
+    :param Settings settings
+
+    :param ResultLog log
+
+    :param int initial_seeds
+
+    :param float z
+
+    :rtype: pd.DataFrame
+    """
+
+    results = []
+
+    start = 0
+
+    n_seeds = initial_seeds
+
+    while start < len(seeds) and configurations:
+
+        round_seeds = seeds[start:start + n_seeds]
+
+        logging.info('Evaluating {} configurations on {} seeds'.format(
+            len(configurations), len(round_seeds)))
+
+        results.append(
+            _run_cross_validation(data, source, configurations, round_seeds,
+                                  settings, log))
+
+        start += n_seeds
+
+        n_seeds *= 2
+
+        configurations = _get_surviving_configurations(
+            pd.concat(results), configurations, z)
+
+        if len(configurations) <= 1:
+
+            break
+
+    logging.info('Remaining configurations: {}'.format(configurations))
+
+    return pd.concat(results)
+
+
+def _get_row_keys(seeds, configurations, folds):
+    """
+    Obtains the keys of the rows produced by cross-validation, in order.
+
+    :param List[int] seeds
+
+    :param List[Tuple[int, float]] configurations
+
+    :param int folds
+
+    :rtype: List[Tuple[int, int, float, int]]
+    """
+
+    return [(s, k, a, f) for s in seeds for k, a in configurations
+            for f in range(1, folds + 1)]
+
+
+def _is_done(parameters, done):
+    """
+    Determines whether the result for the given parameters is done.
+
+    :param Parameters parameters
+
+    :param Set[Tuple[int, int, float, int]] done
+
+    :rtype: bool
+    """
+
+    return (parameters.seed, parameters.k, parameters.alpha,
+            parameters.fold) in done
+
+
+Q2_KEYS = ['seed', 'k', 'alpha', 'fold']
+
+
+def _run_cross_validation(data,
+                          source,
+                          configurations,
+                          seeds,
+                          settings,
+                          log=None):
+    """
+    Conducts cross-validation, sending the given source of the data to each
+    task.
+
+    If a result log is given, results are appended to it as tasks finish, and
+    results recovered from it are used in place of running their tasks.
+
+    :param pd.DataFrame data
+
+    :param Union[pd.DataFrame, SparseFrame, SharedData] source
+
+    :param List[Tuple[int, float]] configurations
+
+    :param List[int] seeds
+
+    :param Settings settings
+
+    :param ResultLog log
+
     :rtype: pd.DataFrame
     """
 
     logging.info('Conducting cross-validation')
 
+    task = _cross_validate
+
+    # Determine which results have been recovered from a previous run.
+
+    row_keys = _get_row_keys(seeds, configurations, settings.folds)
+
+    recovered = None
+
+    done = set()
+
+    if log is not None and log.recovered is not None:
+
+        recovered = restore_index(log.recovered)
+
+        done = set(
+            recovered[Q2_KEYS].itertuples(index=False, name=None)) & set(
+                row_keys)
+
+        logging.info('Skipping {} of {} results already done'.format(
+            len(done), len(row_keys)))
+
     # Obtain an iterator to better distribute jobs across all cores and better
     # measure progress.
 
-    parameter_generator = _get_parameter_generator(seeds, k, alpha, folds,
-                                                   data)
+    parameter_generator = (p for p in _get_parameter_generator(
+        seeds, configurations, settings.folds, data)
+                           if not _is_done(p, done))
 
     # Calculate the number of jobs to perform.
 
-    n_jobs = len(seeds) * len(k) * len(alpha) * folds
+    n_jobs = len(seeds) * len(configurations) * settings.folds
+
+    if done:
+
+        n_jobs = sum(not _is_done(p, done)
+                     for p in _get_parameter_generator(
+                         seeds, configurations, settings.folds, data))
+
+    # With the batched engine, each task is a chunk of parameters.
+
+    if settings.engine == 'batched':
+
+        task = _cross_validate_batch
+
+        parameter_generator = _chunk(parameter_generator, settings.batch_size)
+
+        n_jobs = -(-n_jobs // settings.batch_size)
 
     progress = tqdm.tqdm(parameter_generator, total=n_jobs, mininterval=1.)
 
+    cores = settings.cores
+
     multiprocess = cores != 1 or (cores == -1 and joblib.cpu_count() == 1)
 
     logging.info('Multiprocessing: {}'.format(multiprocess))
 
-    result = joblib.Parallel(n_jobs=cores)(
-        joblib.delayed(_cross_validate)(data, init, l1_ratio, p)
-        for p in progress) if multiprocess else (_cross_validate(data, init,
-                                                                 l1_ratio, p)
-                                                 for p in progress)
+    init, l1_ratio, svd_cache = settings.init, settings.l1_ratio, \
+        settings.svd_cache
+
+    if log is None:
+
+        result = joblib.Parallel(n_jobs=cores)(
+            joblib.delayed(task)(source, init, l1_ratio, p, svd_cache)
+            for p in progress) if multiprocess else (task(
+                source, init, l1_ratio, p, svd_cache) for p in progress)
+
+        logging.info('Concatenating results')
+
+        result = pd.concat(result)
+
+        return result
+
+    # Otherwise, run the tasks in chunks, logging the results of each chunk.
+
+    result = []
+
+    with joblib.Parallel(n_jobs=cores) as parallel:
+
+        for chunk in _chunk(progress, settings.log_every):
+
+            chunk_result = parallel(
+                joblib.delayed(task)(source, init, l1_ratio, p, svd_cache)
+                for p in chunk) if multiprocess else [
+                    task(source, init, l1_ratio, p, svd_cache) for p in chunk
+                ]
+
+            log.append(pd.concat(chunk_result))
+
+            result.extend(chunk_result)
 
     logging.info('Concatenating results')
 
-    return pd.concat(result)
+    # Fill in the recovered results that were not rerun, in their original
+    # order.
+
+    if recovered is not None:
+
+        rerun = set(
+            pd.concat(result)[Q2_KEYS].itertuples(
+                index=False, name=None)) if result else set()
+
+        recovered_keys = recovered[Q2_KEYS].itertuples(index=False, name=None)
+
+        result.append(recovered.loc[[
+            key in done and key not in rerun for key in recovered_keys
+        ]])
+
+    return order_rows(pd.concat(result), Q2_KEYS, row_keys)
 
 
 def write_output(q2, filename):
@@ -483,7 +1263,7 @@ def write_output(q2, filename):
 
     logging.info('Writing output to {}'.format(filename))
 
-    feather.write_dataframe(q2, filename)
+    feather.write_dataframe(q2[Q2_KEYS + ['q2']], filename)
 
 
 if __name__ == '__main__':
@@ -498,7 +1278,7 @@ if __name__ == '__main__':
 
     # Load the data.
 
-    data = load_data(args.input)
+    data = load_data(args.input, sparse=args.sparse)
 
     # Load the list of seeds.
 
@@ -525,8 +1305,27 @@ if __name__ == '__main__':
         init=args.init,
         l1_ratio=args.l1_ratio,
         cores=args.cores,
-        seeds=seedlist)
+        seeds=seedlist,
+        shared_data=args.shared_data,
+        shared_dir=args.shared_dir,
+        svd_cache=args.svd_cache,
+        engine=args.engine,
+        batch_size=args.batch_size,
+        adaptive=args.adaptive,
+        initial_seeds=args.initial_seeds,
+        z=args.z,
+        result_log=args.result_log,
+        resume=args.resume,
+        log_every=args.log_every)
 
     # Write the output.
 
     write_output(q2, args.output)
+
+    if args.telemetry_output:
+
+        telemetry = q2[Q2_KEYS + TELEMETRY_COLUMNS]
+
+        summarize_telemetry(telemetry, ['k', 'alpha'])
+
+        write_telemetry(telemetry, args.telemetry_output)
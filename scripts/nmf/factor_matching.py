@@ -0,0 +1,58 @@
+"""
+Matches the factors of one NMF solution to those of a reference solution.
+"""
+
+import numpy as np
+
+from scipy.optimize import linear_sum_assignment
+
+
+def _normalize(x):
+    """
+    Scales the rows of the given matrix to unit L2 norm, leaving rows of zeros
+    as is.
+
+    :param np.ndarray x
+
+    :rtype: np.ndarray
+    """
+
+    norms = np.sqrt(np.sum(x**2, axis=1, keepdims=True))
+
+    return x / np.where(norms > 0, norms, 1.)
+
+
+def get_cosine_similarities(reference, components):
+    """
+    Calculates the cosine similarity between each reference factor (rows) and
+    each given factor (columns).
+
+    :param np.ndarray reference: reference components (k x variables)
+
+    :param np.ndarray components: components to match (k x variables)
+
+    :rtype: np.ndarray
+    """
+
+    return _normalize(reference).dot(_normalize(components).T)
+
+
+def match_components(reference, components):
+    """
+    Matches the given components to the reference components, maximizing the
+    total cosine similarity between matched factors.
+
+    Returns the order in which to take the given components so that they line
+    up with the reference, i.e., components[result] is aligned to reference.
+
+    :param np.ndarray reference: reference components (k x variables)
+
+    :param np.ndarray components: components to match (k x variables)
+
+    :rtype: np.ndarray
+    """
+
+    _, result = linear_sum_assignment(
+        get_cosine_similarities(reference, components), maximize=True)
+
+    return result
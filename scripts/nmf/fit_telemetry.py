@@ -0,0 +1,160 @@
+"""
+Records the convergence and cost of NMF fits, and summarizes them.
+
+Each fit is described by its number of iterations, the Frobenius norm of its
+residual, whether it stopped at the iteration limit rather than converging,
+and its wall time in seconds.
+"""
+
+import feather
+import logging
+import numpy as np
+import time
+
+TELEMETRY_COLUMNS = [
+    'n_iter', 'reconstruction_err', 'max_iter_reached', 'seconds'
+]
+
+
+def make_telemetry(n_iter, reconstruction_err, max_iter, seconds):
+    """
+    Produces telemetry for a fit with the given values.
+
+    :param int n_iter
+
+    :param float reconstruction_err
+
+    :param int max_iter
+
+    :param float seconds
+
+    :rtype: dict
+    """
+
+    return {
+        'n_iter': n_iter,
+        'reconstruction_err': reconstruction_err,
+        'max_iter_reached': n_iter >= max_iter,
+        'seconds': seconds
+    }
+
+
+def get_empty_telemetry():
+    """
+    Produces telemetry for a fit that was not run.
+
+    :rtype: dict
+    """
+
+    return {
+        'n_iter': 0,
+        'reconstruction_err': np.nan,
+        'max_iter_reached': False,
+        'seconds': 0.
+    }
+
+
+def fit_with_telemetry(nmf, X, **kwargs):
+    """
+    Fits the given NMF model to the given data, returning the coefficients and
+    the telemetry of the fit.
+
+    :param NMF nmf
+
+    :param Union[np.ndarray, sp.spmatrix] X
+
+    :rtype: Tuple[np.ndarray, dict]
+    """
+
+    start = time.perf_counter()
+
+    W = nmf.fit_transform(X, **kwargs)
+
+    return W, make_telemetry(nmf.n_iter_, nmf.reconstruction_err_,
+                             nmf.max_iter, time.perf_counter() - start)
+
+
+def get_batch_telemetry(results, max_iter, seconds):
+    """
+    Produces telemetry for each of the given batched fits, sharing the wall
+    time of the batch equally between them.
+
+    :param List[BatchResult] results
+
+    :param int max_iter
+
+    :param float seconds
+
+    :rtype: List[dict]
+    """
+
+    return [
+        make_telemetry(r.n_iter, r.reconstruction_err, max_iter,
+                       seconds / len(results)) for r in results
+    ]
+
+
+def summarize_telemetry(df, keys, n=10):
+    """
+    Logs the slowest fits, and the configurations with fits that stopped at
+    the iteration limit.
+
+    :param pd.DataFrame df: telemetry, with one row per fit, identified by the
+        columns other than the telemetry
+
+    :param List[str] keys: the columns identifying a configuration
+
+    :param int n: the number of fits and configurations to report
+    """
+
+    fitted = df.loc[df['n_iter'] > 0]
+
+    fit_keys = [x for x in df.columns if x not in TELEMETRY_COLUMNS]
+
+    logging.info('Telemetry for {} fits: {:.1f} s in total, {:.1f} iterations '
+                 'on average, {} at the iteration limit'.format(
+                     len(fitted), fitted['seconds'].sum(),
+                     fitted['n_iter'].mean(),
+                     fitted['max_iter_reached'].sum()))
+
+    logging.info('Slowest fits:')
+
+    for _, row in fitted.nlargest(n, 'seconds').iterrows():
+
+        logging.info('  - {}: {:.3f} s, {} iterations'.format(
+            ', '.join('{}={}'.format(key, row[key]) for key in fit_keys),
+            row['seconds'], row['n_iter']))
+
+    configurations = fitted.groupby(keys)['max_iter_reached'].agg(
+        ['sum', 'mean'])
+
+    configurations = configurations.loc[configurations['sum'] > 0]
+
+    if configurations.empty:
+
+        logging.info('All fits converged')
+
+        return
+
+    logging.info('Configurations with fits at the iteration limit:')
+
+    for key, row in configurations.nlargest(n, 'mean').iterrows():
+
+        logging.info('  - {}: {} fits ({:.0%})'.format(
+            ', '.join('{}={}'.format(*x)
+                      for x in zip(keys, key if isinstance(key, tuple) else
+                                   (key, ))), int(row['sum']), row['mean']))
+
+
+def write_telemetry(df, path):
+    """
+    Writes the given telemetry to the given path.
+
+    :param pd.DataFrame df
+
+    :param str path
+    """
+
+    logging.info('Writing telemetry to {}'.format(path))
+
+    feather.write_dataframe(df.reset_index(drop=True), path)
@@ -4,9 +4,10 @@ Obtains cluster assignments from the given NMF scores.
 
 import argparse
 import logging
-import numpy as np
 import pandas as pd
-import string
+
+from cluster_assignment import (assign, get_labels, get_letter_labels,
+                                get_variance_thresholds)
 
 
 def get_arguments():
@@ -84,24 +85,6 @@ def load_scores(handle):
     return result
 
 
-def get_mle_variance(series, mean=None):
-    """
-    Obtains the MLE variance given a series of values and a calculated mean.
-
-    :param pd.Series[float] series
-
-    :param float mean
-
-    :rtype float
-    """
-
-    if mean is None:
-
-        mean = series.mean()
-
-    return 1 / series.size * ((series - mean)**2).sum()
-
-
 def get_clusters(df, allow_unassigned, variance_coefficient, letters):
     """
     Obtains cluster assignments from the given scores.
@@ -119,34 +102,20 @@ def get_clusters(df, allow_unassigned, variance_coefficient, letters):
 
     logging.info('Calculating cluster assignments')
 
-    # Calculate minimum thresholds to call cluster assignments.
-
-    min_thresholds = pd.Series(np.tile(1e-6, df.shape[1]), index=df.columns)
-
-    if allow_unassigned:
-
-        # Estimate the variance for each factor by fixing the MLE estimate of
-        # the mean to 0.
-
-        min_thresholds = df.apply(
-            get_mle_variance, mean=0).apply(np.sqrt) * variance_coefficient
+    # Calculate minimum thresholds to call cluster assignments. To allow
+    # unassigned patients, estimate the variance for each factor by fixing the
+    # MLE estimate of the mean to 0.
 
-    unassigned_mask = (df >= min_thresholds).sum(axis=1) < 1
+    min_thresholds = get_variance_thresholds(
+        df.values, variance_coefficient) if allow_unassigned else 1e-6
 
-    result = df.apply(pd.Series.argmax, axis=1)
+    assignments = assign(df.values, min_thresholds)
 
-    # Apply letters if required.
+    # Apply letters if required, and set unassigned patients.
 
-    if letters:
+    labels = get_letter_labels(df.columns) if letters else df.columns
 
-        result = (
-            result.astype(int) - 1).apply(string.ascii_uppercase.__getitem__)
-
-    # Set unassigned patients.
-
-    result.loc[unassigned_mask] = 0
-
-    return result
+    return pd.Series(get_labels(assignments, labels, 0), index=df.index)
 
 
 def write_output(series, filename):
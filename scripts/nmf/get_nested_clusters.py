@@ -3,9 +3,10 @@ Obtains cluster assignments from the nested NMF oligo-n approach.
 """
 
 import pandas as pd
-import string
 
 from click import *
+from cluster_assignment import (assign, get_labels, get_letter_labels,
+                                get_number_labels)
 from logging import *
 
 
@@ -46,22 +47,23 @@ def main(l1_score_input, l2_score_input, output):
 
     l2_scores.info()
 
-    info('Renaming factors')
-
-    l1_scores.columns = (l1_scores.columns.astype(int)).map('{:02d}'.format)
-
-    l2_scores.columns = (l2_scores.columns.astype(int) - 1
-                         ).map(string.ascii_uppercase.__getitem__)
-
     info('Assigning patient groups')
 
-    l1_clusters = l1_scores.apply(
-        pd.Series.argmax, axis=1).to_frame().rename(
-            columns={0: 'classification'})
-
-    l2_clusters = l2_scores.apply(
-        pd.Series.argmax, axis=1).to_frame().rename(
-            columns={0: 'classification'})
+    l1_clusters = pd.DataFrame(
+        {
+            'classification':
+            get_labels(
+                assign(l1_scores.values), get_number_labels(l1_scores.columns))
+        },
+        index=l1_scores.index)
+
+    l2_clusters = pd.DataFrame(
+        {
+            'classification':
+            get_labels(
+                assign(l2_scores.values), get_letter_labels(l2_scores.columns))
+        },
+        index=l2_scores.index)
 
     info('Concatenating assignments')
 
@@ -0,0 +1,113 @@
+"""
+Bundles a fitted NMF model with what is needed to project new data onto it:
+the variables it was fitted on, the parameters that scaled its input data, the
+order of its factors relative to the original fit, and its sparsity mask.
+"""
+
+import joblib
+import logging
+import pandas as pd
+
+from collections import namedtuple
+
+ModelBundle = namedtuple(
+    'ModelBundle', ['model', 'variables', 'scaling', 'factor_order', 'mask'])
+
+
+def load_scaling_parameters(handle):
+    """
+    Loads scaling parameters, as output by scale_data.py, from the given
+    handle.
+
+    :param io.file handle
+
+    :rtype: pd.DataFrame
+    """
+
+    logging.info('Loading scaling parameters')
+
+    result = pd.read_csv(handle, index_col=0)
+
+    result.index = result.index.astype(str)
+
+    return result
+
+
+def scale_data(bundle, df):
+    """
+    Scales the given data with the scaling parameters of the given bundle,
+    ordering its columns as the variables of the model.
+
+    :param ModelBundle bundle
+
+    :param pd.DataFrame df
+
+    :rtype: pd.DataFrame
+    """
+
+    bad_data_fields = df.columns.difference(bundle.variables)
+
+    if bad_data_fields.shape[0] > 0:
+
+        raise KeyError('data contains extra columns: {!r}'.format(
+            sorted(bad_data_fields.tolist())))
+
+    df = df[bundle.variables]
+
+    if bundle.scaling is None:
+
+        return df
+
+    scaling = bundle.scaling.loc[bundle.variables]
+
+    return (df + scaling['shift']) * scaling['scale']
+
+
+def project(bundle, df, scaled=False):
+    """
+    Projects the given data onto the factors of the given bundle, scaling it
+    first unless it has already been scaled.
+
+    :param ModelBundle bundle
+
+    :param pd.DataFrame df
+
+    :param bool scaled
+
+    :rtype: pd.DataFrame
+    """
+
+    df = df[bundle.variables] if scaled else scale_data(bundle, df)
+
+    return pd.DataFrame(
+        bundle.model.transform(df.values),
+        index=df.index,
+        columns=[str(j + 1) for j in range(bundle.model.n_components)])
+
+
+def write_bundle(bundle, path):
+    """
+    Writes the given bundle to the given path.
+
+    :param ModelBundle bundle
+
+    :param str path
+    """
+
+    logging.info('Writing model bundle to {}'.format(path))
+
+    joblib.dump(bundle._asdict(), path)
+
+
+def load_bundle(path):
+    """
+    Loads a bundle from the given path.
+
+    :param str path
+
+    :rtype: ModelBundle
+    """
+
+    logging.info('Loading model bundle from {}'.format(path))
+
+    return ModelBundle(**joblib.load(path))
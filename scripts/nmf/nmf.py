@@ -7,8 +7,11 @@ import logging
 import numpy as np
 import pandas as pd
 
+from fit_telemetry import (fit_with_telemetry, summarize_telemetry,
+                           write_telemetry)
+from nmf_model import save_model
 from sklearn.decomposition import NMF
-from sklearn.externals import joblib
+from sparse_data import load_sparse_csv
 
 
 def get_arguments():
@@ -38,7 +41,8 @@ def get_arguments():
         '--model-output',
         required=True,
         metavar='MODEL-OUTPUT',
-        help='output the resulting model to Pickle file %(metavar)s')
+        help='output the resulting model to %(metavar)s, in the binary model '
+        'format if it ends in .npz or as a Pickle file otherwise')
 
     parser.add_argument(
         '--basis-output',
@@ -54,6 +58,11 @@ def get_arguments():
         metavar='SCORE-OUTPUT',
         help='output the scores/coefficients to %(metavar)s')
 
+    parser.add_argument(
+        '--sparse',
+        action='store_true',
+        help='load the input as a sparse matrix and keep it sparse throughout')
+
     parser.add_argument(
         '--init',
         choices=('random', 'nndsvd', 'nndsvda', 'nndsvdar'),
@@ -86,6 +95,12 @@ def get_arguments():
         metavar='SEED',
         help='set the seed to %(metavar)s')
 
+    parser.add_argument(
+        '--telemetry-output',
+        metavar='TELEMETRY-OUTPUT',
+        help='output the convergence and wall time of the fit to Feather file '
+        '%(metavar)s')
+
     parser.add_argument(
         '--log',
         metavar='LOG',
@@ -122,17 +137,23 @@ def configure_logging(log=None):
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 
-def load_data(handle):
+def load_data(handle, sparse=False):
     """
     Loads data from the given handle.
 
     :param io.file handle
 
-    :rtype pd.DataFrame
+    :param bool sparse
+
+    :rtype Union[pd.DataFrame, SparseFrame]
     """
 
     logging.info('Loading data')
 
+    if sparse:
+
+        return load_sparse_csv(handle)
+
     result = pd.read_csv(handle, index_col=0)
 
     logging.info('Loaded a table with shape {}'.format(result.shape))
@@ -144,7 +165,7 @@ def run_nmf(data, k, init, l1_ratio, alpha):
     """
     Runs NMF on the given data for a given number of factors.
 
-    :param pd.DataFrame data
+    :param Union[pd.DataFrame, SparseFrame] data
 
     :param int k
 
@@ -154,22 +175,27 @@ def run_nmf(data, k, init, l1_ratio, alpha):
 
     :param float alpha
 
-    :rtype Tuple[NMF, pd.DataFrame, pd.DataFrame]
+    :rtype Tuple[NMF, pd.DataFrame, pd.DataFrame, pd.DataFrame]
     """
 
     logging.info('Conducting NMF')
 
     nmf = NMF(n_components=k, init=init, l1_ratio=l1_ratio, alpha=alpha)
 
+    coefficients, telemetry = fit_with_telemetry(nmf, data.values)
+
     scores = pd.DataFrame(
-        nmf.fit_transform(data), index=data.index, columns=np.arange(k) + 1)
+        coefficients, index=data.index, columns=np.arange(k) + 1)
 
     basis = pd.DataFrame(
         nmf.components_.T, index=data.columns, columns=np.arange(k) + 1)
 
     basis.index.name = 'variable'
 
-    return nmf, basis, scores
+    telemetry = pd.DataFrame([dict(telemetry, k=k, alpha=alpha)],
+                             columns=['k', 'alpha'] + list(telemetry))
+
+    return nmf, basis, scores, telemetry
 
 
 def write_output(model, basis, scores, model_output, basis_handle,
@@ -190,9 +216,7 @@ def write_output(model, basis, scores, model_output, basis_handle,
     :param str score_handle
     """
 
-    logging.info('Writing model to {}'.format(model_output))
-
-    joblib.dump(model, model_output)
+    save_model(model, model_output)
 
     logging.info('Writing basis to {}'.format(basis_handle.name))
 
@@ -215,14 +239,20 @@ if __name__ == '__main__':
 
     # Conduct the analysis.
 
-    data = load_data(args.input)
+    data = load_data(args.input, sparse=args.sparse)
 
     np.random.seed(args.seed)
 
-    nmf, basis, scores = run_nmf(data, args.k, args.init, args.l1_ratio,
-                                 args.alpha)
+    nmf, basis, scores, telemetry = run_nmf(data, args.k, args.init,
+                                            args.l1_ratio, args.alpha)
 
     write_output(nmf, basis, scores, args.model_output, args.basis_output,
                  args.score_output)
 
+    if args.telemetry_output:
+
+        summarize_telemetry(telemetry, ['k', 'alpha'])
+
+        write_telemetry(telemetry, args.telemetry_output)
+
     logging.info('Done')
@@ -9,11 +9,22 @@ import joblib
 import logging
 import numpy as np
 import pandas as pd
+import time
 import tqdm
 
+from batched_nmf import fit_batch, initialize, initialize_weighted
+from bootstrap_samples import write_sample_array
+from contextlib import ExitStack
+from factor_matching import match_components
+from fit_telemetry import (TELEMETRY_COLUMNS, fit_with_telemetry,
+                           get_batch_telemetry, summarize_telemetry,
+                           write_telemetry)
+from nmf_model import load_model
+from quantile_sketch import QuantileSketch
+from result_log import ResultLog, order_rows, restore_index
 from sklearn.decomposition import NMF
-from sklearn.externals import joblib as sklearn_joblib
 from sklearn.utils import resample
+from sparse_data import load_sparse_csv
 
 
 def get_arguments():
@@ -36,7 +47,13 @@ def get_arguments():
         '--model-input',
         required=True,
         metavar='MODEL-INPUT',
-        help='read the base model from Pickle file %(metavar)s')
+        help='read the base model from binary model or Pickle file '
+        '%(metavar)s')
+
+    parser.add_argument(
+        '--sparse',
+        action='store_true',
+        help='load the input as a sparse matrix and keep it sparse throughout')
 
     parser.add_argument(
         '--iterations',
@@ -47,9 +64,23 @@ def get_arguments():
 
     parser.add_argument(
         '--output',
-        required=True,
         metavar='OUTPUT',
-        help='output samples to Feather file %(metavar)s')
+        help='output samples to Feather file %(metavar)s, or to a '
+        'seeds x factors x variables array if %(metavar)s ends in .npy')
+
+    parser.add_argument(
+        '--sketch-output',
+        metavar='SKETCH-OUTPUT',
+        help='output quantile sketches of the samples to NumPy archive '
+        '%(metavar)s')
+
+    parser.add_argument(
+        '--sketch-capacity',
+        type=int,
+        default=256,
+        metavar='CAPACITY',
+        help='keep at most %(metavar)s samples per level of each quantile '
+        'sketch (default: %(default)s)')
 
     parser.add_argument(
         '--seed',
@@ -65,12 +96,64 @@ def get_arguments():
         metavar='CORES',
         help='run the analysis with %(metavar)s processes')
 
+    parser.add_argument(
+        '--engine',
+        choices=('sklearn', 'batched', 'weighted'),
+        default='sklearn',
+        metavar='ENGINE',
+        help='fit models with scikit-learn one at a time, or in batches with '
+        'the solver of the model, either on resampled data or on bootstrap '
+        'row weights (default: %(default)s)')
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=64,
+        metavar='BATCH-SIZE',
+        help='fit %(metavar)s bootstraps per batch with the batched engines '
+        '(default: %(default)s)')
+
+    parser.add_argument(
+        '--result-log',
+        metavar='RESULT-LOG',
+        help='append samples to Arrow IPC stream %(metavar)s as bootstraps '
+        'finish')
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='skip seeds whose samples are already in the result log')
+
+    parser.add_argument(
+        '--log-every',
+        type=int,
+        default=100,
+        metavar='LOG-EVERY',
+        help='append samples to the result log and sketches every '
+        '%(metavar)s bootstraps (default: %(default)s)')
+
+    parser.add_argument(
+        '--telemetry-output',
+        metavar='TELEMETRY-OUTPUT',
+        help='output the convergence and wall time of every fit to Feather '
+        'file %(metavar)s, and log a summary of them')
+
     parser.add_argument(
         '--log',
         metavar='LOG',
         help='write logging information to %(metavar)s')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+
+    if args.resume and not args.result_log:
+
+        parser.error('--resume requires --result-log')
+
+    if not args.output and not args.sketch_output:
+
+        parser.error('one of --output and --sketch-output is required')
+
+    return args
 
 
 def configure_logging(log=None):
@@ -101,7 +184,7 @@ def configure_logging(log=None):
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 
-def load_data(data_handle, model_path):
+def load_data(data_handle, model_path, sparse=False):
     """
     Loads data and a model from the given handles.
 
@@ -109,18 +192,24 @@ def load_data(data_handle, model_path):
 
     :param io.file model_path
 
-    :rtype pd.DataFrame
+    :param bool sparse
+
+    :rtype Tuple[Union[pd.DataFrame, SparseFrame], NMF]
     """
 
     logging.info('Loading data')
 
-    result = pd.read_csv(data_handle, index_col=0)
+    if sparse:
+
+        result = load_sparse_csv(data_handle)
 
-    logging.info('Loaded a table with shape {}'.format(result.shape))
+    else:
+
+        result = pd.read_csv(data_handle, index_col=0)
 
-    logging.info('Loading model')
+        logging.info('Loaded a table with shape {}'.format(result.shape))
 
-    model = sklearn_joblib.load(model_path)
+    model = load_model(model_path)
 
     return result, model
 
@@ -145,142 +234,200 @@ def get_seeds(seed, iterations):
     return np.random.randint(0, int_info.max, iterations)
 
 
+def get_sketch_seed(seeds):
+    """
+    Obtains a seed for the compactors of quantile sketches from the given
+    bootstrap seeds, so that batch jobs with different seeds compact their
+    sketches independently before the sketches are merged.
+
+    :param List[int] seeds
+
+    :rtype: int
+    """
+
+    return int(
+        np.random.SeedSequence([int(x) for x in seeds]).generate_state(1)[0])
+
+
 def bootstrap_nmf(df, model, seed):
     """
-    Runs a single bootstrap of NMF with the given table, NMF model, and seed.
+    Runs a single bootstrap of NMF with the given table, NMF model, and seed,
+    returning the samples and the telemetry of the fit.
 
-    :param pd.DataFrame df
+    :param Union[pd.DataFrame, SparseFrame] df
 
     :param NMF model
 
     :param int seed
 
-    :rtype pd.DataFrame
+    :rtype Tuple[pd.DataFrame, dict]
     """
 
-    k = model.n_components
-
-    k_range = np.arange(k)
-
-    resampled_df = resample(df, random_state=seed)
+    resampled_df = resample(df.values, random_state=seed)
 
     np.random.seed(seed)
 
-    nmf = NMF(n_components=k,
+    nmf = NMF(n_components=model.n_components,
               init=model.init,
               l1_ratio=model.l1_ratio,
               alpha=model.alpha)
 
-    nmf.fit(resampled_df)
+    _, telemetry = fit_with_telemetry(nmf, resampled_df)
 
-    # Create a mapping: original -> bootstrapped factors.
+    return match_factors(model, nmf.components_, seed, df.columns), telemetry
 
-    factor_map = {}
 
-    remaining_bootstrapped_factors = set(range(k))
+def bootstrap_nmf_batch(df, model, seeds):
+    """
+    Runs bootstraps of NMF with the given table, NMF model, and seeds, fitting
+    all bootstraps at once with the solver of the model, and returning the
+    samples and the telemetry of the fit of each bootstrap.
 
-    # Generate a table of factors and variables to look at, in descending order
-    # of basis matrix entry. This guarantees that better defined factors are
-    # taken care of first.
+    :param Union[pd.DataFrame, SparseFrame] df
 
-    original_index_order = pd.melt(
-        pd.DataFrame(
-            model.components_,
-            index=pd.Index(
-                np.arange(
-                    k, dtype=int), name='factor')).reset_index(),
-        id_vars='factor',
-        var_name='variable',
-        value_name='basis')
+    :param NMF model
+
+    :param List[int] seeds
+
+    :rtype List[Tuple[pd.DataFrame, dict]]
+    """
+
+    k = model.n_components
+
+    resampled = []
+
+    initial_factors = []
+
+    for seed in seeds:
+
+        X = resample(df.values, random_state=seed)
+
+        np.random.seed(seed)
+
+        resampled.append(X)
+
+        initial_factors.append(initialize(X, k, model.init))
+
+    W, H = zip(*initial_factors)
+
+    start = time.perf_counter()
+
+    results = fit_batch(
+        resampled, k, model.alpha, model.l1_ratio, W=W, H=H, tol=model.tol,
+        max_iter=model.max_iter, solver=model.solver)
+
+    telemetry = get_batch_telemetry(results, model.max_iter,
+                                    time.perf_counter() - start)
+
+    return [(match_factors(model, r.H, seed, df.columns), t)
+            for seed, r, t in zip(seeds, results, telemetry)]
+
+
+def get_bootstrap_weights(n, seed):
+    """
+    Draws the multiplicity of each of n rows in a bootstrap sample.
+
+    The counts are drawn from the same indices as resample with the same seed,
+    so that they describe exactly the same bootstrap sample.
+
+    :param int n
 
-    original_index_order.sort_values('basis', ascending=False, inplace=True)
+    :param int seed
 
-    for _, row in original_index_order.iterrows():
+    :rtype np.ndarray
+    """
 
-        original_factor = row['factor']
+    return np.bincount(
+        np.random.RandomState(seed).randint(0, n, size=n), minlength=n)
 
-        max_boostrapped_factor = nmf.components_[:, row['variable']].argmax()
 
-        if (max_boostrapped_factor in remaining_bootstrapped_factors and
-                original_factor not in factor_map):
+def bootstrap_nmf_weighted(df, model, seeds):
+    """
+    Runs bootstraps of NMF with the given table, NMF model, and seeds, fitting
+    all bootstraps at once with the solver of the model.
 
-            factor_map[original_factor] = max_boostrapped_factor
+    Instead of resampling the table, each bootstrap weights the rows of the
+    table by their multiplicities in the bootstrap sample, so that the data
+    are never copied: the initialization is obtained from the weighted Gram
+    matrix of the columns, and the fit weights the terms of each row in the
+    objective. With coordinate descent, this is the same fit as on the
+    resampled table, up to the truncated SVD scikit-learn uses for NNDSVD.
 
-            remaining_bootstrapped_factors.remove(max_boostrapped_factor)
+    :param Union[pd.DataFrame, SparseFrame] df
 
-            continue
+    :param NMF model
 
-        if not remaining_bootstrapped_factors:
+    :param List[int] seeds
 
-            break
+    :rtype List[Tuple[pd.DataFrame, dict]]
+    """
 
-    # If we still have unmapped factors, we have no choice but to map them by
-    # distance between basis matrix entries. Scale so that the L2 norm is one
-    # before proceeding.
+    k = model.n_components
 
-    if remaining_bootstrapped_factors:
+    X = df.values
 
-        unmapped_original = set(range(k)) - set(factor_map.keys())
+    weights = []
 
-        # If there's only one unmapped factor, just assign the mapping.
+    initial_factors = []
 
-        if len(unmapped_original) == 1:
+    for seed in seeds:
 
-            factor_map[unmapped_original.pop(
-            )] = remaining_bootstrapped_factors.pop()
+        c = get_bootstrap_weights(X.shape[0], seed)
 
-        # Otherwise, calculate distances and map based on that.
+        np.random.seed(seed)
 
-        else:
+        weights.append(c)
 
-            original_basis_vectors = {
-                i: model.components_[i] /
-                np.sqrt(np.sum(model.components_[i]**2))
-                for i in unmapped_original
-            }
+        initial_factors.append(initialize_weighted(X, c, k, model.init))
 
-            bootstrapped_basis_factors = {
-                j:
-                nmf.components_[j] / np.sqrt(np.sum(nmf.components_[j]**2))
-                for j in remaining_bootstrapped_factors
-            }
+    W, H = zip(*initial_factors)
 
-            distances = pd.DataFrame.from_records(
-                [(i, j, np.sqrt(
-                    np.sum((original_basis_vectors[i] -
-                            bootstrapped_basis_factors[j])**2)))
-                 for i in unmapped_original
-                 for j in remaining_bootstrapped_factors],
-                columns=['original', 'bootstrapped', 'distance'])
+    start = time.perf_counter()
 
-            distances.sort_values('distance', ascending=False, inplace=True)
+    results = fit_batch(
+        [X] * len(seeds), k, model.alpha, model.l1_ratio, W=W, H=H,
+        tol=model.tol, max_iter=model.max_iter, weights=weights,
+        solver=model.solver)
 
-            for _, row in distances.iterrows():
+    telemetry = get_batch_telemetry(results, model.max_iter,
+                                    time.perf_counter() - start)
 
-                original_factor = int(row['original'])
+    return [(match_factors(model, r.H, seed, df.columns), t)
+            for seed, r, t in zip(seeds, results, telemetry)]
 
-                bootstrapped_factor = int(row['bootstrapped'])
 
-                if (bootstrapped_factor in remaining_bootstrapped_factors and
-                        original_factor not in factor_map):
+def match_factors(model, components, seed, columns):
+    """
+    Matches the given bootstrapped components to the factors of the given NMF
+    model, returning the components in the order of the model's factors.
 
-                    factor_map[original_factor] = bootstrapped_factor
+    Factors are matched by an optimal assignment on the cosine similarities
+    between their basis vectors.
 
-                    remaining_bootstrapped_factors.remove(bootstrapped_factor)
+    :param NMF model
 
-                    if not remaining_bootstrapped_factors:
+    :param np.ndarray components
 
-                        break
+    :param int seed
 
-    # Generate a mapping from bootstrapped factors to original factors.
+    :param pd.Index columns
 
-    reverse_map = [v for _, v in sorted(factor_map.items())]
+    :rtype pd.DataFrame
+    """
+
+    k = model.n_components
+
+    k_range = np.arange(k)
+
+    # Find the one-to-one mapping between original and bootstrapped factors
+    # that maximizes the total cosine similarity of their basis vectors.
+
+    order = match_components(model.components_, components)
 
     ix = pd.MultiIndex.from_arrays(
         [np.tile(seed, k), k_range + 1], names=['seed', 'factor'])
 
-    return pd.DataFrame(
-        nmf.components_[reverse_map], index=ix, columns=df.columns)
+    return pd.DataFrame(components[order], index=ix, columns=columns)
 
 
 def reshape_samples(df):
@@ -299,12 +446,87 @@ def reshape_samples(df):
         value_name='loading')
 
 
-def bootstrap(df, model, seeds, processes):
+def _run_bootstraps(df, model, seeds, parallel, engine, batch_size):
+    """
+    Runs bootstraps for the given seeds, returning samples indexed by seed and
+    factor, and the telemetry of the fit of each seed.
+
+    :param Union[pd.DataFrame, SparseFrame] df
+
+    :param NMF model
+
+    :param List[int] seeds
+
+    :param joblib.Parallel parallel
+
+    :param str engine
+
+    :param int batch_size
+
+    :rtype Tuple[pd.DataFrame, pd.DataFrame]
+    """
+
+    if engine in ('batched', 'weighted'):
+
+        fit = bootstrap_nmf_weighted if engine == 'weighted' else \
+            bootstrap_nmf_batch
+
+        batches = [
+            seeds[i:i + batch_size] for i in range(0, len(seeds), batch_size)
+        ]
+
+        results = itertools.chain.from_iterable(
+            parallel(
+                joblib.delayed(fit)(df, model, b)
+                for b in tqdm.tqdm(batches, mininterval=1)))
+
+    else:
+
+        # results = (bootstrap_nmf(df, model, seed)
+        #            for seed in tqdm.tqdm(
+        #                seeds, mininterval=1))
+
+        results = parallel(joblib.delayed(bootstrap_nmf)(
+            df, model, seed) for seed in tqdm.tqdm(
+                seeds, mininterval=1))
+
+    samples, telemetry = zip(*results)
+
+    telemetry = pd.DataFrame(list(telemetry), columns=TELEMETRY_COLUMNS)
+
+    telemetry.insert(0, 'seed', seeds)
+
+    return pd.concat(samples), telemetry
+
+
+def bootstrap(df,
+              model,
+              seeds,
+              processes,
+              engine='sklearn',
+              batch_size=64,
+              result_log=None,
+              resume=False,
+              log_every=100,
+              sketch=None,
+              keep_samples=True,
+              telemetry=None):
     """
     Bootstraps the NMF basis matrix using the given table, NMF model, and
-    seeds.
+    seeds, returning samples indexed by seed and factor.
 
-    :param pd.DataFrame df
+    If result_log is given, samples are appended to it every log_every seeds,
+    and if resume is also set, seeds whose samples are already in it are
+    skipped.
+
+    If sketch is given, samples are added to it every log_every seeds. If
+    keep_samples is not set, samples are discarded once they have been logged
+    and sketched, and None is returned.
+
+    If telemetry is given, the telemetry of the fits that are run is appended
+    to it.
+
+    :param Union[pd.DataFrame, SparseFrame] df
 
     :param NMF model
 
@@ -312,27 +534,149 @@ def bootstrap(df, model, seeds, processes):
 
     :param int processes
 
+    :param str engine
+
+    :param int batch_size
+
+    :param str result_log
+
+    :param bool resume
+
+    :param int log_every
+
+    :param QuantileSketch sketch
+
+    :param bool keep_samples
+
+    :param list telemetry
+
     :rtype pd.DataFrame
     """
 
     logging.info('Running bootstrapped analysis')
 
-    # samples = (bootstrap_nmf(df, model, seed)
-    #            for seed in tqdm.tqdm(
-    #                seeds, mininterval=1))
+    seeds = list(seeds)
+
+    if result_log is None and sketch is None:
+
+        result, fit_telemetry = _run_bootstraps(
+            df, model, seeds, joblib.Parallel(n_jobs=processes), engine,
+            batch_size)
+
+        if telemetry is not None:
+
+            telemetry.append(fit_telemetry)
+
+        return result
+
+    with ExitStack() as stack:
+
+        parallel = stack.enter_context(joblib.Parallel(n_jobs=processes))
+
+        log = None if result_log is None else stack.enter_context(
+            ResultLog(result_log, resume=resume))
+
+        # Determine which seeds have been recovered from a previous run.
+
+        recovered = None
+
+        done = set()
+
+        if log is not None and log.recovered is not None:
+
+            recovered = restore_index(log.recovered).set_index(
+                ['seed', 'factor'])
+
+            done = set(recovered.index.get_level_values('seed')) & set(seeds)
+
+            recovered = recovered.loc[recovered.index.get_level_values(
+                'seed').isin(done)]
+
+            logging.info('Skipping {} of {} seeds already done'.format(
+                len(done), len(seeds)))
+
+            if sketch is not None:
 
-    samples = joblib.Parallel(n_jobs=processes)(joblib.delayed(bootstrap_nmf)(
-        df, model, seed) for seed in tqdm.tqdm(
-            seeds, mininterval=1))
+                sketch.update(get_sample_values(recovered, model.n_components))
 
-    reshaped_samples = (reshape_samples(s) for s in samples)
+        remaining = [seed for seed in seeds if seed not in done]
 
-    return pd.concat(reshaped_samples)
+        # Run the remaining seeds in chunks, logging and sketching the samples
+        # of each chunk.
+
+        result = []
+
+        for i in range(0, len(remaining), log_every):
+
+            chunk_result, fit_telemetry = _run_bootstraps(
+                df, model, remaining[i:i + log_every], parallel, engine,
+                batch_size)
+
+            if telemetry is not None:
+
+                telemetry.append(fit_telemetry)
+
+            if log is not None:
+
+                log.append(chunk_result.reset_index())
+
+            if sketch is not None:
+
+                sketch.update(
+                    get_sample_values(chunk_result, model.n_components))
+
+            if keep_samples:
+
+                result.append(chunk_result)
+
+    if not keep_samples:
+
+        return None
+
+    if recovered is not None:
+
+        result.append(recovered)
+
+    result = pd.concat(result).reset_index()
+
+    return order_rows(result, 'seed', seeds).set_index(['seed', 'factor'])
+
+
+def get_sample_values(df, k):
+    """
+    Obtains the values of the given samples as a seeds x factors x variables
+    array.
+
+    :param pd.DataFrame df: samples indexed by seed and factor, with the k
+        factors of each seed in order
+
+    :param int k
+
+    :rtype np.ndarray
+    """
+
+    return df.values.reshape((-1, k, df.shape[1]))
+
+
+def write_sketch(sketch, path):
+    """
+    Writes the given quantile sketches to the given path.
+
+    :param QuantileSketch sketch
+
+    :param str path
+    """
+
+    logging.info('Writing quantile sketches of {} samples'.format(
+        sketch.count))
+
+    sketch.save(path)
 
 
 def write_output(df, path):
     """
-    Writes the given samples to the given path.
+    Writes the given samples to the given path, as a sample array if the path
+    ends in .npy and as a long table in Feather format otherwise.
 
     :param pd.DataFrame df
 
@@ -341,7 +685,16 @@ def write_output(df, path):
 
     logging.info('Writing output')
 
-    feather.write_dataframe(df, path)
+    if path.endswith('.npy'):
+
+        write_sample_array(df, path)
+
+        return
+
+    feather.write_dataframe(
+        pd.concat(
+            reshape_samples(s)
+            for _, s in df.groupby(level='seed', sort=False)), path)
 
 
 if __name__ == '__main__':
@@ -356,10 +709,48 @@ if __name__ == '__main__':
 
     # Conduct the analysis.
 
-    data, model = load_data(args.data_input, args.model_input)
+    data, model = load_data(
+        args.data_input, args.model_input, sparse=args.sparse)
 
     seeds = get_seeds(args.seed, args.iterations)
 
-    samples = bootstrap(data, model, seeds, processes=args.processes)
+    sketch = QuantileSketch(
+        model.components_.shape,
+        args.sketch_capacity,
+        seed=get_sketch_seed(seeds),
+        labels={
+            'factors': list(range(1, model.n_components + 1)),
+            'variables': [str(x) for x in data.columns]
+        }) if args.sketch_output else None
+
+    telemetry = [] if args.telemetry_output else None
+
+    samples = bootstrap(
+        data,
+        model,
+        seeds,
+        processes=args.processes,
+        engine=args.engine,
+        batch_size=args.batch_size,
+        result_log=args.result_log,
+        resume=args.resume,
+        log_every=args.log_every,
+        sketch=sketch,
+        keep_samples=bool(args.output),
+        telemetry=telemetry)
+
+    if args.output:
+
+        write_output(samples, args.output)
+
+    if sketch is not None:
+
+        write_sketch(sketch, args.sketch_output)
+
+    if telemetry:
+
+        telemetry = pd.concat(telemetry)
+
+        summarize_telemetry(telemetry, ['seed'])
 
-    write_output(samples, args.output)
+        write_telemetry(telemetry, args.telemetry_output)
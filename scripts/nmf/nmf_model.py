@@ -0,0 +1,405 @@
+"""
+Stores fitted NMF models in a compact binary format, and projects data onto
+them without importing scikit-learn.
+
+A model file is an uncompressed ZIP archive, like those written by np.savez,
+holding the basis matrix as components.npy and the hyperparameters as
+header.json. Because the archive is uncompressed, the basis matrix is
+memory-mapped directly from the file on loading.
+
+Files that are not ZIP archives are taken to be pickled scikit-learn models,
+and are loaded and written with joblib.
+"""
+
+import json
+import logging
+import numpy as np
+import zipfile
+
+FORMAT_NAME = 'nmf-model'
+
+FORMAT_VERSION = 1
+
+PARAMETERS = [
+    'init', 'solver', 'beta_loss', 'tol', 'max_iter', 'alpha', 'l1_ratio'
+]
+
+# Machine epsilon for guarding divisions in the multiplicative updates, as in
+# scikit-learn.
+
+EPSILON = np.finfo(np.float32).eps
+
+
+class NMFModel:
+    """
+    A fitted NMF model, with the attributes of a scikit-learn NMF model that
+    are needed to project data onto it.
+    """
+
+    def __init__(self,
+                 components,
+                 init=None,
+                 solver='cd',
+                 beta_loss='frobenius',
+                 tol=1e-4,
+                 max_iter=200,
+                 alpha=0.,
+                 l1_ratio=0.):
+
+        self.components_ = components
+
+        self.init = init
+
+        self.solver = solver
+
+        self.beta_loss = beta_loss
+
+        self.tol = tol
+
+        self.max_iter = max_iter
+
+        self.alpha = alpha
+
+        self.l1_ratio = l1_ratio
+
+    @property
+    def n_components(self):
+
+        return self.components_.shape[0]
+
+    def transform(self, X):
+        """
+        Projects the given data onto the model, fixing the basis matrix and
+        solving for the coefficients as scikit-learn does with the
+        'both' regularization.
+
+        :param Union[np.ndarray, sp.spmatrix] X
+
+        :rtype: np.ndarray
+        """
+
+        if not hasattr(X, 'tocsr'):
+
+            X = np.asarray(X, dtype=float)
+
+        if X.min() < 0:
+
+            raise ValueError('negative values in data passed to transform')
+
+        if self.beta_loss not in ('frobenius', 2):
+
+            raise ValueError('unsupported beta loss: {!r}'.format(
+                self.beta_loss))
+
+        H = np.asarray(self.components_, dtype=float)
+
+        l1_reg = self.alpha * self.l1_ratio
+
+        l2_reg = self.alpha * (1. - self.l1_ratio)
+
+        if self.solver == 'cd':
+
+            return _transform_cd(X, H, l1_reg, l2_reg, self.tol,
+                                 self.max_iter)
+
+        elif self.solver == 'mu':
+
+            return _transform_mu(X, H, l1_reg, l2_reg, self.tol,
+                                 self.max_iter)
+
+        raise ValueError('unsupported solver: {!r}'.format(self.solver))
+
+
+def _transform_cd(X, H, l1_reg, l2_reg, tol, max_iter):
+    """
+    Solves for the coefficients of the given data by coordinate descent.
+
+    Each coordinate update only involves the row of its sample, so the updates
+    to a factor are made for all samples at once.
+
+    :param Union[np.ndarray, sp.spmatrix] X
+
+    :param np.ndarray H
+
+    :param float l1_reg
+
+    :param float l2_reg
+
+    :param float tol
+
+    :param int max_iter
+
+    :rtype: np.ndarray
+    """
+
+    k = H.shape[0]
+
+    W = np.zeros((X.shape[0], k))
+
+    HHt = H @ H.T
+
+    HHt.flat[::k + 1] += l2_reg
+
+    XHt = np.asarray(X @ H.T) - l1_reg
+
+    violation_init = None
+
+    for _ in range(max_iter):
+
+        violation = 0.
+
+        for t in range(k):
+
+            grad = W @ HHt[t] - XHt[:, t]
+
+            projected_grad = np.where(W[:, t] == 0, np.minimum(grad, 0), grad)
+
+            violation += np.abs(projected_grad).sum()
+
+            if HHt[t, t] != 0:
+
+                W[:, t] = np.maximum(W[:, t] - grad / HHt[t, t], 0.)
+
+        if violation_init is None:
+
+            violation_init = violation
+
+        if violation_init == 0 or violation / violation_init <= tol:
+
+            break
+
+    return W
+
+
+def _transform_mu(X, H, l1_reg, l2_reg, tol, max_iter):
+    """
+    Solves for the coefficients of the given data by multiplicative updates.
+
+    :param Union[np.ndarray, sp.spmatrix] X
+
+    :param np.ndarray H
+
+    :param float l1_reg
+
+    :param float l2_reg
+
+    :param float tol
+
+    :param int max_iter
+
+    :rtype: np.ndarray
+    """
+
+    k = H.shape[0]
+
+    W = np.full((X.shape[0], k), np.sqrt(X.mean() / k))
+
+    HHt = H @ H.T
+
+    XHt = np.asarray(X @ H.T)
+
+    sum_of_squares = X.multiply(X).sum() if hasattr(X, 'tocsr') else np.sum(
+        X**2)
+
+    def get_error():
+
+        # The residual norm, expanded so that it needs only the products
+        # with H, which are fixed.
+
+        return np.sqrt(
+            max(sum_of_squares - 2 * np.sum(W * XHt) + np.sum(
+                (W.T @ W) * HHt), 0.))
+
+    error_at_init = previous_error = get_error()
+
+    for n_iter in range(1, max_iter + 1):
+
+        denominator = W @ HHt
+
+        if l1_reg > 0:
+
+            denominator += l1_reg
+
+        if l2_reg > 0:
+
+            denominator += l2_reg * W
+
+        denominator[denominator == 0] = EPSILON
+
+        W *= XHt / denominator
+
+        if tol > 0 and n_iter % 10 == 0:
+
+            error = get_error()
+
+            if (previous_error - error) / error_at_init < tol:
+
+                break
+
+            previous_error = error
+
+    return W
+
+
+def _get_parameters(model):
+    """
+    Obtains the hyperparameters of the given model.
+
+    :param Union[NMFModel, NMF] model
+
+    :rtype: dict
+    """
+
+    result = {x: getattr(model, x, None) for x in PARAMETERS}
+
+    result['solver'] = result['solver'] or 'cd'
+
+    result['beta_loss'] = result['beta_loss'] or 'frobenius'
+
+    return result
+
+
+def save_model(model, path):
+    """
+    Writes the given model to the given path: in the binary model format if
+    the path ends in .npz, or as a pickle otherwise.
+
+    :param Union[NMFModel, NMF] model
+
+    :param str path
+    """
+
+    logging.info('Writing model to {}'.format(path))
+
+    if not path.endswith('.npz'):
+
+        import joblib
+
+        joblib.dump(model, path)
+
+        return
+
+    components = np.ascontiguousarray(model.components_, dtype=float)
+
+    header = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'shape': list(components.shape),
+        'parameters': _get_parameters(model)
+    }
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+
+        archive.writestr('header.json', json.dumps(header))
+
+        with archive.open('components.npy', 'w', force_zip64=True) as handle:
+
+            np.lib.format.write_array(handle, components)
+
+
+def _map_member(path, archive, name):
+    """
+    Memory-maps the NumPy array stored uncompressed as the given member of the
+    given archive, copying on write.
+
+    :param str path
+
+    :param zipfile.ZipFile archive
+
+    :param str name
+
+    :rtype: np.ndarray
+    """
+
+    info = archive.getinfo(name)
+
+    if info.compress_type != zipfile.ZIP_STORED:
+
+        with archive.open(name) as handle:
+
+            return np.lib.format.read_array(handle)
+
+    with open(path, 'rb') as handle:
+
+        # Skip the local file header, whose name and extra field lengths may
+        # differ from those in the central directory.
+
+        handle.seek(info.header_offset + 26)
+
+        name_length, extra_length = np.frombuffer(handle.read(4), '<u2')
+
+        handle.seek(
+            info.header_offset + 30 + int(name_length) + int(extra_length))
+
+        version = np.lib.format.read_magic(handle)
+
+        read_header = np.lib.format.read_array_header_1_0 if version == (
+            1, 0) else np.lib.format.read_array_header_2_0
+
+        shape, fortran_order, dtype = read_header(handle)
+
+        offset = handle.tell()
+
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode='c',
+        offset=offset,
+        shape=shape,
+        order='F' if fortran_order else 'C')
+
+
+def load_model(path, mmap=True):
+    """
+    Loads a model from the given path, in either the binary model format or
+    as a pickle.
+
+    :param str path
+
+    :param bool mmap: whether to memory-map the basis matrix of a model in the
+        binary format; the mapping is copy-on-write, so the basis matrix may
+        be modified without changing the file
+
+    :rtype: Union[NMFModel, NMF]
+    """
+
+    logging.info('Loading model from {}'.format(path))
+
+    if not zipfile.is_zipfile(path):
+
+        import joblib
+
+        return joblib.load(path)
+
+    with zipfile.ZipFile(path) as archive:
+
+        header = json.loads(archive.read('header.json').decode('utf-8'))
+
+        if header.get('format') != FORMAT_NAME:
+
+            raise ValueError('{} is not an NMF model file'.format(path))
+
+        if header['version'] > FORMAT_VERSION:
+
+            raise ValueError(
+                '{} has model format version {}, but only versions up to {} '
+                'are supported'.format(path, header['version'],
+                                       FORMAT_VERSION))
+
+        if mmap:
+
+            components = _map_member(path, archive, 'components.npy')
+
+        else:
+
+            with archive.open('components.npy') as handle:
+
+                components = np.lib.format.read_array(handle)
+
+    if list(components.shape) != header['shape']:
+
+        raise ValueError('{} has a basis matrix with shape {}, but its header '
+                         'gives shape {}'.format(path, components.shape,
+                                                 tuple(header['shape'])))
+
+    return NMFModel(components, **header['parameters'])
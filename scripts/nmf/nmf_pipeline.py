@@ -0,0 +1,283 @@
+"""
+Conducts NMF on input data, re-orders the factors from head to toe, sparsifies
+the factors by representative sites, and optionally projects new data onto the
+result, all in one process.
+
+Writes a model bundle for the final model, as well as the model, basis, and
+scores of each stage in the same form as nmf.py, reorder_factors.py, and
+sparsify_nmf_representative_sites.py.
+"""
+
+import argparse
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+from model_bundle import (ModelBundle, load_scaling_parameters, project,
+                          write_bundle)
+from nmf import configure_logging, load_data, run_nmf
+from nmf_model import save_model
+from reorder_factors import (get_factor_order, load_joint_order,
+                             reorder_basis, reorder_model, reorder_scores)
+from sparsify_nmf_representative_sites import sparsify_model
+
+
+def get_arguments():
+    """
+    Obtains command-line arguments.
+
+    :rtype argparse.Namespace
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--input',
+        type=argparse.FileType('rU'),
+        required=True,
+        metavar='INPUT',
+        help='read scaled input data from CSV file %(metavar)s')
+
+    parser.add_argument(
+        '--parameter-input',
+        type=argparse.FileType('rU'),
+        metavar='PARAMETER-INPUT',
+        help='read the parameters that scaled the input data from CSV file '
+        '%(metavar)s')
+
+    parser.add_argument(
+        '--joint-order-input',
+        type=argparse.FileType('rU'),
+        required=True,
+        metavar='JOINT-ORDER-INPUT',
+        help='read the head-to-toe order of sites from %(metavar)s')
+
+    parser.add_argument(
+        '--k',
+        type=int,
+        required=True,
+        metavar='K',
+        help='reduce the input to rank %(metavar)s')
+
+    parser.add_argument(
+        '--init',
+        choices=('random', 'nndsvd', 'nndsvda', 'nndsvdar'),
+        default='nndsvd',
+        metavar='INIT',
+        help='use method %(metavar)s to initialize values (default: '
+        '%(default)s)')
+
+    parser.add_argument(
+        '--l1-ratio',
+        type=float,
+        default=0.,
+        metavar='L1-RATIO',
+        help='use %(metavar)s as the regularization mixing parameter '
+        '(default: %(default)s)')
+
+    parser.add_argument(
+        '--alpha',
+        type=float,
+        default=0.,
+        metavar='ALPHA',
+        help='use %(metavar)s as the regularization constant (default: '
+        '%(default)s)')
+
+    parser.add_argument(
+        '--coefficient',
+        type=float,
+        default=1.,
+        metavar='COEFFICIENT',
+        help='for each site, zero basis matrix entries that are less than '
+        '%(metavar)s times the maximum (default: %(default)s)')
+
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=301290193,
+        metavar='SEED',
+        help='set the seed to %(metavar)s')
+
+    parser.add_argument(
+        '--bundle-output',
+        required=True,
+        metavar='BUNDLE-OUTPUT',
+        help='output the model bundle to Pickle file %(metavar)s')
+
+    parser.add_argument(
+        '--nmf-output-dir',
+        metavar='DIR',
+        help='output the model, basis, and scores of the NMF to directory '
+        '%(metavar)s')
+
+    parser.add_argument(
+        '--reordered-output-dir',
+        metavar='DIR',
+        help='output the model, basis, and scores of the re-ordered model to '
+        'directory %(metavar)s')
+
+    parser.add_argument(
+        '--sparsified-output-dir',
+        metavar='DIR',
+        help='output the model, basis, and scores of the sparsified model to '
+        'directory %(metavar)s')
+
+    parser.add_argument(
+        '--projection-input',
+        type=argparse.FileType('rU'),
+        metavar='PROJECTION-INPUT',
+        help='read unscaled data to project onto the sparsified model from '
+        'CSV file %(metavar)s')
+
+    parser.add_argument(
+        '--projection-output',
+        metavar='PROJECTION-OUTPUT',
+        help='output scores of the projected data to CSV file %(metavar)s')
+
+    parser.add_argument(
+        '--log',
+        metavar='LOG',
+        help='write logging information to %(metavar)s')
+
+    args = parser.parse_args()
+
+    if bool(args.projection_input) != bool(args.projection_output):
+
+        parser.error('--projection-input and --projection-output must be '
+                     'given together')
+
+    return args
+
+
+def write_stage(model, basis, scores, directory):
+    """
+    Writes the given model, basis, and scores of a stage to the given
+    directory, as model.pkl, basis.csv, and scores.csv.
+
+    :param NMF model
+
+    :param pd.DataFrame basis
+
+    :param pd.DataFrame scores
+
+    :param str directory
+    """
+
+    if directory is None:
+
+        return
+
+    logging.info('Writing model, basis, and scores to {}'.format(directory))
+
+    os.makedirs(directory, exist_ok=True)
+
+    save_model(model, os.path.join(directory, 'model.pkl'))
+
+    basis.to_csv(os.path.join(directory, 'basis.csv'))
+
+    scores.to_csv(os.path.join(directory, 'scores.csv'))
+
+
+def run_pipeline(data, scaling, joint_order, k, init, l1_ratio, alpha,
+                 coefficient, output_dirs):
+    """
+    Conducts NMF on the given data, re-orders and sparsifies the factors, and
+    returns a bundle of the final model, writing the model, basis, and scores
+    of each stage to the given directories.
+
+    :param pd.DataFrame data
+
+    :param pd.DataFrame scaling
+
+    :param List[str] joint_order
+
+    :param int k
+
+    :param str init
+
+    :param float l1_ratio
+
+    :param float alpha
+
+    :param float coefficient
+
+    :param Tuple[str, str, str] output_dirs: directories for the NMF, the
+        re-ordered model, and the sparsified model, or None to skip writing
+        a stage
+
+    :rtype ModelBundle
+    """
+
+    nmf_dir, reordered_dir, sparsified_dir = output_dirs
+
+    model, basis, scores, _ = run_nmf(data, k, init, l1_ratio, alpha)
+
+    write_stage(model, basis, scores, nmf_dir)
+
+    # Re-ordering permutes the factors, so the scores need not be
+    # recalculated.
+
+    factor_order = get_factor_order(basis, joint_order)
+
+    reorder_model(model, factor_order)
+
+    write_stage(model,
+                reorder_basis(basis, factor_order),
+                reorder_scores(scores, factor_order), reordered_dir)
+
+    basis = sparsify_model(model, data.columns, coefficient)
+
+    logging.info('Getting scores')
+
+    scores = pd.DataFrame(
+        model.transform(data.values), index=data.index, columns=basis.columns)
+
+    write_stage(model, basis, scores, sparsified_dir)
+
+    return ModelBundle(model, list(data.columns), scaling,
+                       np.asarray(factor_order), model.components_ != 0)
+
+
+if __name__ == '__main__':
+
+    # Get arguments.
+
+    args = get_arguments()
+
+    # Configure logging.
+
+    configure_logging(args.log)
+
+    # Load all data.
+
+    data = load_data(args.input)
+
+    scaling = load_scaling_parameters(
+        args.parameter_input) if args.parameter_input else None
+
+    joint_order = load_joint_order(args.joint_order_input)
+
+    # Run the pipeline.
+
+    np.random.seed(args.seed)
+
+    bundle = run_pipeline(data, scaling, joint_order, args.k, args.init,
+                          args.l1_ratio, args.alpha, args.coefficient,
+                          (args.nmf_output_dir, args.reordered_output_dir,
+                           args.sparsified_output_dir))
+
+    write_bundle(bundle, args.bundle_output)
+
+    # Project new data.
+
+    if args.projection_input:
+
+        projection_data = pd.read_csv(args.projection_input, index_col=0)
+
+        logging.info('Projecting a table with shape {}'.format(
+            projection_data.shape))
+
+        project(bundle, projection_data).to_csv(args.projection_output)
+
+    logging.info('Done')
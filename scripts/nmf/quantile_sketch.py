@@ -0,0 +1,213 @@
+"""
+Mergeable quantile sketches for many cells at once, e.g., one per factor and
+variable of a basis matrix.
+
+Each sketch is a stack of compactors as in KLL. Values enter the first
+compactor with a weight of one. Whenever a compactor holds capacity values, it
+sorts them and promotes every other one, starting at a random offset, to the
+next compactor with twice the weight. All cells receive the same number of
+values, so each compactor is one array with the cells along its trailing axes.
+
+Until the first compaction, the sketch holds every value and its quantiles
+match np.quantile exactly. Afterwards, the rank error of a quantile is on the
+order of log2(n / capacity) / capacity.
+"""
+
+import json
+import numpy as np
+
+from bootstrap_samples import get_metadata_path
+
+
+class QuantileSketch(object):
+    """
+    Quantile sketches for cells of the given shape, with optional labels for
+    the cells that are saved with the sketches.
+    """
+
+    def __init__(self, shape, capacity=256, seed=0, labels=None):
+
+        self.shape = tuple(shape)
+
+        self.labels = labels or {}
+
+        self.capacity = capacity
+
+        self.count = 0
+
+        self.compactors = [np.empty((0, ) + self.shape)]
+
+        self._random = np.random.RandomState(seed)
+
+    def update(self, values):
+        """
+        Adds the given values to the sketch.
+
+        :param np.ndarray values: (values, ) + shape
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+
+        self.count += values.shape[0]
+
+        self._compact()
+
+    def merge(self, other):
+        """
+        Merges the given sketch into this one.
+
+        :param QuantileSketch other
+        """
+
+        if other.shape != self.shape or other.labels != self.labels:
+
+            raise ValueError('cannot merge sketches of different cells')
+
+        for level, values in enumerate(other.compactors):
+
+            if level == len(self.compactors):
+
+                self.compactors.append(np.empty((0, ) + self.shape))
+
+            self.compactors[level] = np.concatenate(
+                [self.compactors[level], values])
+
+        self.count += other.count
+
+        self._compact()
+
+    def _compact(self):
+        """
+        Compacts every compactor that has reached capacity.
+        """
+
+        level = 0
+
+        while level < len(self.compactors):
+
+            values = self.compactors[level]
+
+            if values.shape[0] < self.capacity:
+
+                level += 1
+
+                continue
+
+            # Promote every other value of an even number of sorted values,
+            # and keep the odd one out, if any, at this level.
+
+            n = values.shape[0] - values.shape[0] % 2
+
+            ordered = np.sort(values[:n], axis=0)
+
+            offset = self._random.randint(2)
+
+            if level + 1 == len(self.compactors):
+
+                self.compactors.append(np.empty((0, ) + self.shape))
+
+            self.compactors[level + 1] = np.concatenate(
+                [self.compactors[level + 1], ordered[offset::2]])
+
+            self.compactors[level] = values[n:]
+
+    def quantile(self, q):
+        """
+        Estimates the given quantile of each cell, interpolating linearly
+        between ranks as np.quantile does.
+
+        :param float q
+
+        :rtype: np.ndarray
+        """
+
+        values = np.concatenate(self.compactors)
+
+        weights = np.concatenate([
+            np.full(x.shape[0], 2**level)
+            for level, x in enumerate(self.compactors)
+        ])
+
+        order = np.argsort(values, axis=0)
+
+        values = np.take_along_axis(values, order, axis=0)
+
+        # Each value covers the ranks from the cumulative weight before it up
+        # to, but excluding, the cumulative weight including it.
+
+        upper_ranks = np.cumsum(weights[order], axis=0)
+
+        position = q * (weights.sum() - 1)
+
+        lower = np.floor(position)
+
+        fraction = position - lower
+
+        def value_at(rank):
+
+            i = np.sum(upper_ranks <= rank, axis=0, keepdims=True)
+
+            return np.take_along_axis(
+                values, np.minimum(i, values.shape[0] - 1), axis=0)[0]
+
+        return (1 - fraction) * value_at(lower) + fraction * value_at(
+            lower + 1)
+
+    def save(self, path):
+        """
+        Saves the sketch to the given NumPy archive, with its labels in a JSON
+        file alongside it.
+
+        :param str path
+        """
+
+        # Write to a handle, as np.savez appends .npz to paths without it.
+
+        with open(path, 'wb') as handle:
+
+            np.savez(
+                handle,
+                count=self.count,
+                capacity=self.capacity,
+                **{'compactor_{}'.format(i): x
+                   for i, x in enumerate(self.compactors)})
+
+        with open(get_metadata_path(path), 'w') as handle:
+
+            json.dump(self.labels, handle)
+
+    @classmethod
+    def load(cls, path, seed=0):
+        """
+        Loads a sketch and its labels from the given NumPy archive.
+
+        :param str path
+
+        :param int seed
+
+        :rtype: QuantileSketch
+        """
+
+        with np.load(path) as archive:
+
+            n_compactors = sum(
+                name.startswith('compactor_') for name in archive.files)
+
+            compactors = [
+                archive['compactor_{}'.format(i)] for i in range(n_compactors)
+            ]
+
+            result = cls(compactors[0].shape[1:], int(archive['capacity']),
+                         seed)
+
+            result.count = int(archive['count'])
+
+        result.compactors = compactors
+
+        with open(get_metadata_path(path)) as handle:
+
+            result.labels = json.load(handle)
+
+        return result
@@ -4,10 +4,9 @@ Orders the clusters from head to toe.
 
 import argparse
 import logging
+import nmf_model
 import numpy as np
 import pandas as pd
-from sklearn.decomposition import NMF
-from sklearn.externals import joblib
 
 
 def get_arguments():
@@ -76,7 +75,7 @@ def load_model(filename):
 
     logging.info('Loading model')
 
-    return joblib.load(filename)
+    return nmf_model.load_model(filename)
 
 
 def load_basis(handle):
@@ -219,9 +218,7 @@ def write_model(model, filename):
     :param str filename
     """
 
-    logging.info('Writing model to {}'.format(filename))
-
-    joblib.dump(model, filename)
+    nmf_model.save_model(model, filename)
 
 
 def write_basis(basis, filename):
@@ -7,15 +7,14 @@ import pandas as pd
 
 from click import *
 from logging import *
-from sklearn.decomposition import NMF
-from sklearn.externals import joblib
+from nmf_model import load_model, save_model
 
 
 @command()
 @option(
     '--model-input',
     required=True,
-    help='the Pickle file to read the model from')
+    help='the binary model or Pickle file to read the model from')
 @option(
     '--basis-input',
     required=True,
@@ -25,7 +24,8 @@ from sklearn.externals import joblib
 @option(
     '--model-output',
     required=True,
-    help='the Pickle file to write the model to')
+    help='the file to write the model to, in the binary model format if it '
+    'ends in .npz or as a Pickle file otherwise')
 @option(
     '--basis-output',
     required=True,
@@ -49,9 +49,7 @@ def main(model_input, basis_input, score_input, model_output, basis_output,
 
     # Load the model.
 
-    info('Loading model')
-
-    model = joblib.load(model_input)
+    model = load_model(model_input)
 
     info('Loading basis matrix')
 
@@ -92,7 +90,7 @@ def main(model_input, basis_input, score_input, model_output, basis_output,
 
     info('Writing output')
 
-    joblib.dump(model, model_output)
+    save_model(model, model_output)
 
     basis.to_csv(basis_output)
 
@@ -0,0 +1,197 @@
+"""
+Appends result tables to an Arrow IPC stream as they are produced, so that an
+interrupted run can be resumed from the results it already completed.
+
+Each table is logged with its index in an extra column, so that the tables
+recovered from a log can be reassembled into exactly the table that an
+uninterrupted run would have produced.
+"""
+
+import logging
+import os
+import pandas as pd
+import pyarrow as pa
+
+INDEX_COLUMN = '__index__'
+
+
+def read_log(path):
+    """
+    Reads the complete record batches of the log at the given path, ignoring
+    a truncated batch at the end.
+
+    :param str path
+
+    :rtype: pd.DataFrame
+    """
+
+    batches = []
+
+    with open(path, 'rb') as handle:
+
+        try:
+
+            reader = pa.ipc.open_stream(handle)
+
+            for batch in reader:
+
+                batches.append(batch)
+
+        except (pa.ArrowInvalid, OSError, EOFError):
+
+            logging.warning('Ignoring truncated data at the end of {}'.format(
+                path))
+
+    if not batches:
+
+        return None
+
+    return pa.Table.from_batches(batches).to_pandas()
+
+
+def restore_index(df):
+    """
+    Restores the index of the given table from its logged index column.
+
+    :param pd.DataFrame df
+
+    :rtype: pd.DataFrame
+    """
+
+    result = df.set_index(INDEX_COLUMN)
+
+    result.index.name = None
+
+    return result
+
+
+def order_rows(df, keys, order):
+    """
+    Orders the rows of the given table by the position of their keys in the
+    given order, keeping ties in their current order.
+
+    :param pd.DataFrame df
+
+    :param Union[str, List[str]] keys: the column(s) forming the key
+
+    :param List order: the keys in the order to use
+
+    :rtype: pd.DataFrame
+    """
+
+    position = {key: i for i, key in enumerate(order)}
+
+    key_values = df[keys].itertuples(index=False, name=None) if isinstance(
+        keys, list) else df[keys]
+
+    row_position = pd.Series([position[key] for key in key_values])
+
+    return df.iloc[row_position.sort_values(kind='mergesort').index]
+
+
+class ResultLog(object):
+    """
+    A log of result tables in an Arrow IPC stream.
+
+    If resuming, the complete results in an existing log are available as
+    recovered and are carried over into the new log.
+    """
+
+    def __init__(self, path, resume=False):
+
+        self.path = path
+
+        self.recovered = read_log(path) if resume and os.path.exists(
+            path) else None
+
+        self._handle = self._writer = self._schema = None
+
+        if self.recovered is not None:
+
+            logging.info('Recovered {} rows from {}'.format(
+                len(self.recovered), path))
+
+            # Rewrite the complete results before appending to the log, so
+            # that a truncated batch does not remain in the middle of it.
+
+            self._open(
+                pa.Table.from_pandas(self.recovered, preserve_index=False),
+                path + '.tmp')
+
+            os.replace(path + '.tmp', path)
+
+    def _open(self, table, path):
+        """
+        Opens the log for writing with the schema of the given table, and
+        writes the table.
+
+        :param pa.Table table
+
+        :param str path
+        """
+
+        self._schema = table.schema
+
+        self._handle = open(path, 'wb')
+
+        self._writer = pa.RecordBatchStreamWriter(self._handle, self._schema)
+
+        self._write(table)
+
+    def _write(self, table):
+        """
+        Writes the given table to the log and flushes it to disk.
+
+        :param pa.Table table
+        """
+
+        self._writer.write_table(table)
+
+        self._handle.flush()
+
+        os.fsync(self._handle.fileno())
+
+    def append(self, df):
+        """
+        Appends the given table to the log.
+
+        :param pd.DataFrame df
+        """
+
+        if df.empty:
+
+            return
+
+        df = df.rename_axis(INDEX_COLUMN).reset_index()
+
+        if self._writer is None:
+
+            self._open(pa.Table.from_pandas(df, preserve_index=False),
+                       self.path)
+
+        else:
+
+            self._write(
+                pa.Table.from_pandas(
+                    df, schema=self._schema, preserve_index=False))
+
+    def close(self):
+        """
+        Closes the log.
+        """
+
+        if self._writer is not None:
+
+            self._writer.close()
+
+            self._handle.close()
+
+            self._writer = self._handle = None
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
@@ -0,0 +1,57 @@
+"""
+Loads mostly-zero data tables as sparse matrices.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from collections import namedtuple
+
+
+class SparseFrame(namedtuple('SparseFrame', ['values', 'index', 'columns'])):
+    """
+    A table of data held as a CSR matrix, with the row and column labels of
+    the table it was read from.
+    """
+
+    @property
+    def shape(self):
+
+        return self.values.shape
+
+
+def load_sparse_csv(handle, chunksize=10000):
+    """
+    Loads a table from the given CSV handle as a sparse table, reading at most
+    chunksize rows into memory at once.
+
+    :param io.file handle
+
+    :param int chunksize
+
+    :rtype: SparseFrame
+    """
+
+    blocks = []
+
+    index = []
+
+    columns = None
+
+    for chunk in pd.read_csv(handle, index_col=0, chunksize=chunksize):
+
+        blocks.append(sp.csr_matrix(chunk.values.astype(np.float64)))
+
+        index.append(chunk.index)
+
+        columns = chunk.columns
+
+    result = SparseFrame(
+        sp.vstack(blocks, format='csr'), index[0].append(index[1:]), columns)
+
+    logging.info('Loaded a sparse table with shape {} and {} non-zero '
+                 'entries'.format(result.shape, result.values.nnz))
+
+    return result
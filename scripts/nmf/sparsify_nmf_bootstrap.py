@@ -9,8 +9,9 @@ import logging
 import numpy as np
 import pandas as pd
 
-from sklearn.decomposition import NMF
-from sklearn.externals import joblib as sklearn_joblib
+from bootstrap_samples import load_sample_array
+from nmf_model import load_model, save_model
+from quantile_sketch import QuantileSketch
 
 
 def get_arguments():
@@ -26,7 +27,8 @@ def get_arguments():
         '--model-input',
         required=True,
         metavar='MODEL-INPUT',
-        help='read the base model from Pickle file %(metavar)s')
+        help='read the base model from binary model or Pickle file '
+        '%(metavar)s')
 
     parser.add_argument(
         '--data-input',
@@ -38,9 +40,12 @@ def get_arguments():
     parser.add_argument(
         '--bootstrapped-sample-input',
         required=True,
+        nargs='+',
         metavar='BOOTSTRAPPED-SAMPLE-INPUT',
         help=('read bootstrapped basis matrix samples from Feather file '
-              '%(metavar)s'))
+              '%(metavar)s, from a sample array if %(metavar)s ends in .npy, '
+              'or from quantile sketches if %(metavar)s ends in .npz; '
+              'quantile sketches from several files are merged'))
 
     parser.add_argument(
         '--iterations',
@@ -53,7 +58,8 @@ def get_arguments():
         '--model-output',
         required=True,
         metavar='MODEL-OUTPUT',
-        help='output the model to Pickle file %(metavar)s')
+        help='output the model to %(metavar)s, in the binary model format if '
+        'it ends in .npz or as a Pickle file otherwise')
 
     parser.add_argument(
         '--basis-output',
@@ -122,7 +128,7 @@ def configure_logging(log=None):
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 
-def load_data(model_path, data_handle, bootstrap_sample_path):
+def load_data(model_path, data_handle, bootstrap_sample_paths):
     """
     Loads a model, input data, and bootstrapped basis matrix samples from the
     given paths and handles.
@@ -131,14 +137,13 @@ def load_data(model_path, data_handle, bootstrap_sample_path):
 
     :param io.file data_handle
 
-    :param str bootstrap_sample_path
+    :param List[str] bootstrap_sample_paths
 
-    :rtype: Tuple[NMF, pd.DataFrame, pd.DataFrame]
+    :rtype: Tuple[NMF, pd.DataFrame, Union[pd.DataFrame, SampleArray,
+        QuantileSketch]]
     """
 
-    logging.info('Loading model')
-
-    model = sklearn_joblib.load(model_path)
+    model = load_model(model_path)
 
     logging.info('Loading data')
 
@@ -148,6 +153,21 @@ def load_data(model_path, data_handle, bootstrap_sample_path):
 
     logging.info('Loading bootstrapped basis matrix samples')
 
+    if all(path.endswith('.npz') for path in bootstrap_sample_paths):
+
+        return model, result, load_sketches(bootstrap_sample_paths)
+
+    if len(bootstrap_sample_paths) > 1:
+
+        raise ValueError('only quantile sketches can be read from more than '
+                         'one file')
+
+    bootstrap_sample_path, = bootstrap_sample_paths
+
+    if bootstrap_sample_path.endswith('.npy'):
+
+        return model, result, load_sample_array(bootstrap_sample_path)
+
     samples = feather.read_dataframe(bootstrap_sample_path)
 
     logging.info('Loaded a table with shape {}'.format(samples.shape))
@@ -155,6 +175,86 @@ def load_data(model_path, data_handle, bootstrap_sample_path):
     return model, result, samples
 
 
+def load_sketches(paths):
+    """
+    Loads quantile sketches from the given paths and merges them.
+
+    :param List[str] paths
+
+    :rtype: QuantileSketch
+    """
+
+    result = QuantileSketch.load(paths[0])
+
+    for path in paths[1:]:
+
+        result.merge(QuantileSketch.load(path))
+
+    logging.info('Loaded quantile sketches of {} samples from {} files'.format(
+        result.count, len(paths)))
+
+    return result
+
+
+def get_statistics(samples, lower_quantile_threshold, upper_quantile):
+    """
+    Calculates the median and the given quantiles of the bootstrapped basis
+    matrix entries for each factor and variable.
+
+    For a sample array, the statistics are taken along the seed axis. For
+    quantile sketches, they are estimated from the sketches.
+
+    :param Union[pd.DataFrame, SampleArray, QuantileSketch] samples
+
+    :param float lower_quantile_threshold
+
+    :param float upper_quantile
+
+    :rtype: pd.DataFrame
+    """
+
+    if isinstance(samples, pd.DataFrame):
+
+        return samples.groupby(['factor', 'variable'])['loading'].agg({
+            'median': pd.Series.median,
+            'lower': functools.partial(
+                pd.Series.quantile, q=lower_quantile_threshold),
+            'upper': functools.partial(
+                pd.Series.quantile, q=upper_quantile)
+        })
+
+    if isinstance(samples, QuantileSketch):
+
+        median, lower, upper = (samples.quantile(q) for q in (
+            0.5, lower_quantile_threshold, upper_quantile))
+
+        factors = samples.labels['factors']
+
+        variables = samples.labels['variables']
+
+    else:
+
+        values = np.asarray(samples.values, dtype=np.float64)
+
+        median, lower, upper = np.quantile(
+            values, [0.5, lower_quantile_threshold, upper_quantile], axis=0)
+
+        factors = samples.factors
+
+        variables = samples.variables
+
+    result = pd.DataFrame(
+        {
+            'median': median.ravel(),
+            'lower': lower.ravel(),
+            'upper': upper.ravel()
+        },
+        index=pd.MultiIndex.from_product(
+            [factors, variables], names=['factor', 'variable']))
+
+    return result.sort_index()
+
+
 def sparsify_model(model, samples, variables, lower_quantile_threshold,
                    upper_quantile):
     """
@@ -163,7 +263,7 @@ def sparsify_model(model, samples, variables, lower_quantile_threshold,
 
     :param NMF model
 
-    :param pd.DataFrame samples
+    :param Union[pd.DataFrame, SampleArray, QuantileSketch] samples
 
     :param pd.Index[str] variables
 
@@ -178,13 +278,8 @@ def sparsify_model(model, samples, variables, lower_quantile_threshold,
 
     # Calculate statistics.
 
-    statistics = samples.groupby(['factor', 'variable'])['loading'].agg({
-        'median': pd.Series.median,
-        'lower': functools.partial(
-            pd.Series.quantile, q=lower_quantile_threshold),
-        'upper': functools.partial(
-            pd.Series.quantile, q=upper_quantile)
-    })
+    statistics = get_statistics(samples, lower_quantile_threshold,
+                                upper_quantile)
 
     # For each factor, determine the variable with the maximum median basis.
 
@@ -308,9 +403,7 @@ def write_model(model, path):
     :param str path
     """
 
-    logging.info('Writing model to {}'.format(path))
-
-    sklearn_joblib.dump(model, path)
+    save_model(model, path)
 
 
 def write_basis(df, path):
@@ -8,8 +8,7 @@ import numpy as np
 import pandas as pd
 
 from logging import *
-from sklearn.decomposition import NMF
-from sklearn.externals import joblib as sklearn_joblib
+from nmf_model import NMFModel, load_model, save_model
 
 
 def clean_basis_vector(x: pd.Series, coefficient: float) -> np.ndarray:
@@ -17,11 +16,51 @@ def clean_basis_vector(x: pd.Series, coefficient: float) -> np.ndarray:
     return np.where(x >= np.max(x) * coefficient, x, np.zeros(x.size))
 
 
+def sparsify_model(model: NMFModel, variables: pd.Index,
+                   coefficient: float) -> pd.DataFrame:
+    """
+    Zeroes the basis matrix entries of the given model that are less than
+    coefficient times the maximum entry of their factor, rescaling each
+    factor to its original L2 norm. Modifies the model in place, and returns
+    the new basis matrix.
+    """
+
+    info('Sparsifying basis')
+
+    original_basis = pd.DataFrame(
+        model.components_.T,
+        index=pd.Series(
+            variables, name='variable'),
+        columns=np.arange(model.n_components) + 1)
+
+    new_basis = original_basis.copy()
+    for j, values in new_basis.iteritems():
+        new_basis.loc[:, j] = clean_basis_vector(values, coefficient=coefficient)
+
+    info('Rescaling factors')
+
+    original_norms = ((original_basis**2).sum())**0.5
+
+    new_norms = ((new_basis**2).sum())**0.5
+
+    scales = original_norms / new_norms
+
+    info('Scaling factors by following factors:\n{}'.format(scales))
+
+    new_basis *= scales
+
+    info('Modifying model')
+
+    model.components_ = new_basis.values.T
+
+    return new_basis
+
+
 @click.command()
 @click.option(
     '--model-input',
     required=True,
-    help='read the model from Pickle file MODEL_INPUT')
+    help='read the model from binary model or Pickle file MODEL_INPUT')
 @click.option(
     '--data-input',
     required=True,
@@ -29,7 +68,8 @@ def clean_basis_vector(x: pd.Series, coefficient: float) -> np.ndarray:
 @click.option(
     '--model-output',
     required=True,
-    help='output the resulting model to Pickle file MODEL_OUTPUT')
+    help='output the resulting model to MODEL_OUTPUT, in the binary model '
+    'format if it ends in .npz or as a Pickle file otherwise')
 @click.option(
     '--basis-output',
     required=True,
@@ -60,46 +100,16 @@ def main(model_input, data_input, model_output, basis_output, score_output,
 
     data.info()
 
-    info('Loading model')
-
-    model = sklearn_joblib.load(model_input)
-
-    info('Sparsifying basis')
+    model = load_model(model_input)
 
-    original_basis = pd.DataFrame(
-        model.components_.T,
-        index=pd.Series(
-            data.columns, name='variable'),
-        columns=np.arange(model.n_components) + 1)
-
-    new_basis = original_basis.copy()
-    for j, values in new_basis.iteritems():
-        new_basis.loc[:, j] = clean_basis_vector(values, coefficient=coefficient)
-
-    info('Rescaling factors')
-
-    original_norms = ((original_basis**2).sum())**0.5
-
-    new_norms = ((new_basis**2).sum())**0.5
-
-    scales = original_norms / new_norms
-
-    info('Scaling factors by following factors:\n{}'.format(scales))
-
-    new_basis *= scales
-
-    info('Modifying model')
-
-    model.components_ = new_basis.values.T
+    new_basis = sparsify_model(model, data.columns, coefficient)
 
     info('Getting scores')
 
     scores = pd.DataFrame(
         model.transform(data), index=data.index, columns=new_basis.columns)
 
-    info('Writing model to {}'.format(model_output))
-
-    sklearn_joblib.dump(model, model_output)
+    save_model(model, model_output)
 
     info('Writing basis to {}'.format(basis_output))
 
@@ -0,0 +1,123 @@
+"""
+Tests batched NMF against scikit-learn.
+"""
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from batched_nmf import fit_batch, initialize, initialize_weighted
+from sklearn.decomposition import NMF
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+@pytest.mark.parametrize('l1_ratio', [0., 1.])
+def test_cd_matches_sklearn(sparse, l1_ratio):
+
+    random_state = np.random.RandomState(0)
+
+    data = [
+        random_state.poisson(0.5, (60 - 5 * i, 25)).astype(np.float64)
+        for i in range(4)
+    ]
+
+    k = [2, 3, 4, 5]
+
+    alpha = [0., 0.5, 2., 8.]
+
+    W, H = zip(*(initialize(X, k_, 'nndsvd') for X, k_ in zip(data, k)))
+
+    results = fit_batch([sp.csr_matrix(X) if sparse else X for X in data],
+                        k,
+                        alpha,
+                        l1_ratio,
+                        W=[x.copy() for x in W],
+                        H=[x.copy() for x in H],
+                        tol=1e-6)
+
+    for X, k_, a, W_, H_, result in zip(data, k, alpha, W, H, results):
+
+        nmf = NMF(n_components=k_,
+                  init='custom',
+                  alpha=a,
+                  l1_ratio=l1_ratio,
+                  tol=1e-6)
+
+        coefficients = nmf.fit_transform(X, W=W_.copy(), H=H_.copy())
+
+        assert result.n_iter == nmf.n_iter_
+
+        np.testing.assert_allclose(result.W, coefficients, atol=1e-10)
+
+        np.testing.assert_allclose(result.H, nmf.components_, atol=1e-10)
+
+        np.testing.assert_allclose(result.reconstruction_err,
+                                   nmf.reconstruction_err_)
+
+
+@pytest.mark.parametrize('l1_ratio', [0., 1.])
+def test_weights_match_repeated_rows(l1_ratio):
+
+    random_state = np.random.RandomState(0)
+
+    X = random_state.poisson(0.7, (50, 20)).astype(np.float64)
+
+    weights = np.bincount(random_state.randint(0, 50, 50), minlength=50)
+
+    repeated = np.repeat(X, weights, axis=0)
+
+    nmf = NMF(n_components=4, init='custom', alpha=2., l1_ratio=l1_ratio)
+
+    W, H = initialize(repeated, 4, 'nndsvd')
+
+    nmf.fit_transform(repeated, W=W, H=H)
+
+    W, H = initialize_weighted(X, weights, 4, 'nndsvd')
+
+    result = fit_batch([X],
+                       4,
+                       2.,
+                       l1_ratio,
+                       W=[W],
+                       H=[H],
+                       tol=1e-4,
+                       weights=[weights])[0]
+
+    assert result.n_iter == nmf.n_iter_
+
+    np.testing.assert_allclose(result.H, nmf.components_, atol=1e-10)
+
+    np.testing.assert_allclose(result.reconstruction_err,
+                               nmf.reconstruction_err_)
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_weighted_initialization_matches_repeated_rows(sparse):
+
+    random_state = np.random.RandomState(0)
+
+    # Enough rows for the Gram matrix to be accumulated in several chunks.
+
+    X = random_state.poisson(0.5, (2500, 15)).astype(np.float64)
+
+    weights = np.bincount(random_state.randint(0, 2500, 2500), minlength=2500)
+
+    W, H = initialize(np.repeat(X, weights, axis=0), 4, 'nndsvd')
+
+    W_weighted, H_weighted = initialize_weighted(
+        sp.csr_matrix(X) if sparse else X, weights, 4, 'nndsvd')
+
+    np.testing.assert_allclose(H_weighted, H, atol=1e-10)
+
+    np.testing.assert_allclose(np.repeat(W_weighted, weights, axis=0),
+                               W,
+                               atol=1e-10)
+
+    assert not W_weighted[weights == 0].any()
+
+
+def test_unknown_solver():
+
+    with pytest.raises(ValueError):
+
+        fit_batch([np.ones((3, 3))], 1, solver='als')
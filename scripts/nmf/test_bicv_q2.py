@@ -0,0 +1,85 @@
+"""
+Tests Q2 against reconstructions from the pseudo-inverses of the factors.
+"""
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from bicv_q2 import get_q2, get_q2_batch
+
+
+def _get_expected_q2(bottomleft, topright, test, components, coefficients):
+
+    reconstruction = bottomleft @ np.linalg.pinv(components) @ np.linalg.pinv(
+        coefficients) @ topright
+
+    return 1 - np.sum((test - reconstruction)**2) / np.sum(test**2)
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_batch_matches_reconstructions(sparse):
+
+    random_state = np.random.RandomState(0)
+
+    shapes = [(20, 15), (25, 10), (18, 12)]
+
+    bottomleft, topright, test, components, coefficients = [], [], [], [], []
+
+    for k, (n, m) in zip([2, 3, 5], shapes):
+
+        bottomleft.append(random_state.poisson(1., (n, m)).astype(np.float64))
+
+        topright.append(
+            random_state.poisson(1., (n + 3, m + 2)).astype(np.float64))
+
+        test.append(random_state.poisson(1., (n, m + 2)).astype(np.float64))
+
+        components.append(random_state.rand(k, m))
+
+        coefficients.append(random_state.rand(n + 3, k))
+
+    # Zero out a factor, as strong penalties do.
+
+    components[2][1] = 0
+
+    coefficients[2][:, 1] = 0
+
+    expected = [
+        _get_expected_q2(*x)
+        for x in zip(bottomleft, topright, test, components, coefficients)
+    ]
+
+    blocks = [[sp.csr_matrix(x) for x in y] if sparse else y
+              for y in (bottomleft, topright, test)]
+
+    np.testing.assert_allclose(
+        get_q2_batch(*blocks, components, coefficients), expected)
+
+
+def test_ill_conditioned_factors():
+
+    random_state = np.random.RandomState(0)
+
+    bottomleft = random_state.poisson(1., (20, 15)).astype(np.float64)
+
+    topright = random_state.poisson(1., (30, 12)).astype(np.float64)
+
+    test = random_state.poisson(1., (20, 12)).astype(np.float64)
+
+    # Make two factors nearly collinear, so that the Gram matrices of the
+    # factors are nearly singular.
+
+    components = random_state.rand(3, 15)
+
+    components[2] = components[1] + 1e-5 * random_state.rand(15)
+
+    coefficients = random_state.rand(30, 3)
+
+    coefficients[:, 2] = coefficients[:, 1] + 1e-5 * random_state.rand(30)
+
+    np.testing.assert_allclose(
+        get_q2(bottomleft, topright, test, components, coefficients),
+        _get_expected_q2(bottomleft, topright, test, components,
+                         coefficients),
+        rtol=1e-8)
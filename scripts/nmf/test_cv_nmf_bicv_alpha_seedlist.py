@@ -0,0 +1,66 @@
+"""
+Tests BiCV of NMF models.
+"""
+
+import numpy as np
+import pandas as pd
+
+from cv_nmf_bicv_alpha_seedlist import (Settings,
+                                        _get_surviving_configurations,
+                                        _run_cross_validation)
+
+
+def _get_data(seed=0):
+
+    random_state = np.random.RandomState(seed)
+
+    return pd.DataFrame(random_state.poisson(1., (40, 30)).astype(np.float64))
+
+
+def _get_settings():
+
+    return Settings(folds=2,
+                    init='nndsvd',
+                    l1_ratio=1.,
+                    cores=1,
+                    svd_cache=0,
+                    engine='sklearn',
+                    batch_size=1,
+                    log_every=1)
+
+
+def test_batched_engine_matches_sklearn():
+
+    df = _get_data()
+
+    configurations = [(k, a) for k in [2, 3, 4] for a in [0.5, 2., 8.]]
+
+    q2 = [
+        _run_cross_validation(
+            df, df, configurations, [1, 2, 3],
+            _get_settings()._replace(engine=engine, batch_size=8))
+        for engine in ['sklearn', 'batched']
+    ]
+
+    np.testing.assert_allclose(q2[1]['q2'], q2[0]['q2'], atol=1e-8)
+
+    best = [x.groupby(['k', 'alpha'])['q2'].mean().idxmax() for x in q2]
+
+    assert best[0] == best[1]
+
+
+def test_configurations_without_q2_are_pruned():
+
+    q2 = pd.DataFrame({
+        'k': [2, 2, 3, 3, 4, 4, 5, 5],
+        'alpha': [1.] * 8,
+        'q2': [0.5, 0.6, 0.4, 0.55, -1., -3., np.nan, np.nan]
+    })
+
+    configurations = [(2, 1.), (3, 1.), (4, 1.), (5, 1.)]
+
+    assert _get_surviving_configurations(q2, configurations,
+                                         1.96) == [(2, 1.), (3, 1.)]
+
+    assert _get_surviving_configurations(q2.loc[q2['k'] > 3],
+                                         configurations, 1.96) == []
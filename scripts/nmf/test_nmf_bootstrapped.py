@@ -0,0 +1,49 @@
+"""
+Tests the batched bootstrap engines against scikit-learn.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nmf_bootstrapped import (bootstrap_nmf, bootstrap_nmf_batch,
+                              bootstrap_nmf_weighted, get_seeds,
+                              get_sketch_seed)
+from sklearn.decomposition import NMF
+
+
+@pytest.mark.parametrize('fit', [bootstrap_nmf_batch, bootstrap_nmf_weighted])
+def test_engines_match_sklearn(fit):
+
+    random_state = np.random.RandomState(0)
+
+    df = pd.DataFrame(random_state.poisson(1., (50, 20)).astype(np.float64))
+
+    model = NMF(n_components=3, init='nndsvd', l1_ratio=1., alpha=2.)
+
+    model.fit(df.values)
+
+    seeds = [1, 2, 3]
+
+    for (samples, _), seed in zip(fit(df, model, seeds), seeds):
+
+        expected = bootstrap_nmf(df, model, seed)[0]
+
+        # scikit-learn initializes NNDSVD from a randomized SVD, so the fits
+        # only agree to within the tolerance of the solver.
+
+        np.testing.assert_allclose(samples.values,
+                                   expected.values,
+                                   atol=1e-6)
+
+        np.testing.assert_array_equal(samples.values == 0,
+                                      expected.values == 0)
+
+
+def test_sketch_seeds_differ_between_jobs():
+
+    seeds = [get_seeds(seed, 4) for seed in [1, 2]]
+
+    assert get_sketch_seed(seeds[0]) == get_sketch_seed(list(seeds[0]))
+
+    assert get_sketch_seed(seeds[0]) != get_sketch_seed(seeds[1])
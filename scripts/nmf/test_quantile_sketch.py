@@ -0,0 +1,40 @@
+"""
+Tests quantile sketches.
+"""
+
+import numpy as np
+
+from quantile_sketch import QuantileSketch
+
+
+def test_save_keeps_path(tmp_path):
+
+    sketch = QuantileSketch((2, 3), capacity=8, labels={'factors': [1, 2]})
+
+    sketch.update(np.random.RandomState(0).random_sample((20, 2, 3)))
+
+    path = str(tmp_path / 'sketch')
+
+    sketch.save(path)
+
+    result = QuantileSketch.load(path)
+
+    assert result.count == sketch.count
+
+    assert result.labels == sketch.labels
+
+    np.testing.assert_array_equal(result.quantile(0.5), sketch.quantile(0.5))
+
+
+def test_exact_before_compaction():
+
+    values = np.random.RandomState(0).random_sample((10, 4))
+
+    sketch = QuantileSketch((4, ), capacity=16)
+
+    sketch.update(values)
+
+    for q in [0., 0.3, 0.5, 1.]:
+
+        np.testing.assert_allclose(sketch.quantile(q),
+                                   np.quantile(values, q, axis=0))
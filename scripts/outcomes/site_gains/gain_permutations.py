@@ -0,0 +1,237 @@
+"""
+Shuffles future involvements within patient groups and sites, and counts the
+patients who gain each site, for many seeds at once.
+
+Future involvements are sorted once by patient group and site, so that each
+group is a contiguous segment of a value array delimited by offsets, and are
+aligned once with baseline involvements. A batch of permutations then shuffles
+every segment with random keys and counts gains with segment reductions.
+"""
+
+import joblib as jl
+import numpy as np
+import pandas as pd
+
+from typing import *
+
+
+class GroupedInvolvements(NamedTuple):
+    """
+    Future involvements sorted by patient group and site, with the matching
+    baseline involvements.
+    """
+
+    # Future and baseline involvements, with NaN for missing baseline
+    # involvements.
+
+    future: np.ndarray
+
+    baseline: np.ndarray
+
+    # The group of each row, and the offset at which each group starts.
+
+    group_ids: np.ndarray
+
+    offsets: np.ndarray
+
+    # The patient group and site of each group.
+
+    groups: pd.MultiIndex
+
+
+def group_involvements(df_future: pd.DataFrame,
+                       df_baseline: pd.DataFrame) -> GroupedInvolvements:
+    """
+    Sorts the given future involvements by patient group and site, and aligns
+    the given baseline involvements with them.
+
+    Args:
+        df_future: Future involvement data (merged), with one row per patient
+            and site.
+        df_baseline: Baseline data.
+
+    Returns:
+        The grouped involvements.
+    """
+
+    keys = ['classification', 'site']
+
+    df_future = df_future.sort_values(keys, kind='mergesort')
+
+    group_index = pd.MultiIndex.from_arrays([df_future[x] for x in keys])
+
+    groups = group_index.unique()
+
+    group_ids = groups.get_indexer(group_index)
+
+    row_keys = ['subject_id', 'site', 'classification']
+
+    baseline_index = pd.MultiIndex.from_arrays(
+        [df_baseline[x] for x in row_keys])
+
+    positions = baseline_index.get_indexer(
+        pd.MultiIndex.from_arrays([df_future[x] for x in row_keys]))
+
+    baseline = np.append(df_baseline['value'].values.astype(np.float64),
+                         np.nan)[positions]
+
+    return GroupedInvolvements(
+        future=df_future['value'].values.astype(np.float64),
+        baseline=baseline,
+        group_ids=group_ids,
+        offsets=np.flatnonzero(np.diff(group_ids, prepend=-1)),
+        groups=groups)
+
+
+def get_sampled_groups(grouped: GroupedInvolvements) -> pd.MultiIndex:
+    """
+    Obtains the patient groups and sites with baseline involvements for some
+    patients, outside of which no patients are ever considered.
+
+    Args:
+        grouped: The grouped involvements.
+
+    Returns:
+        The patient groups and sites.
+    """
+
+    has_baseline = np.add.reduceat(
+        (~np.isnan(grouped.baseline)).astype(np.int64), grouped.offsets) > 0
+
+    return grouped.groups[has_baseline]
+
+
+def shuffle_within_groups(grouped: GroupedInvolvements,
+                          seeds: Sequence[int]) -> np.ndarray:
+    """
+    Shuffles future involvements within each group, once for each of the
+    given seeds.
+
+    Each row draws a uniform random key from the generator for its seed, and
+    rows are sorted by group and then by key.
+
+    Args:
+        grouped: The grouped involvements.
+        seeds: The seeds to shuffle with.
+
+    Returns:
+        Shuffled future involvements with shape (seeds, rows).
+    """
+
+    n = grouped.future.size
+
+    keys = np.stack(
+        [np.random.RandomState(seed).random_sample(n) for seed in seeds])
+
+    order = np.argsort(grouped.group_ids + keys, axis=1)
+
+    return grouped.future[order]
+
+
+def count_gains(grouped: GroupedInvolvements,
+                future: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts, for each group, the patients with both future and baseline
+    involvements, and the patients who gain the site.
+
+    Args:
+        grouped: The grouped involvements.
+        future: Future involvements with shape (seeds, rows).
+
+    Returns:
+        Numbers of patients considered and of patients gaining the site, each
+        with shape (seeds, groups).
+    """
+
+    differences = future - grouped.baseline
+
+    with np.errstate(invalid='ignore'):
+
+        gained = differences > 0
+
+    n = np.add.reduceat(
+        (~np.isnan(differences)).astype(np.int64), grouped.offsets, axis=1)
+
+    n_gained = np.add.reduceat(
+        gained.astype(np.int64), grouped.offsets, axis=1)
+
+    return n, n_gained
+
+
+def get_gains(grouped: GroupedInvolvements,
+              seeds: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts gains in permutations with the given seeds.
+
+    Args:
+        grouped: The grouped involvements.
+        seeds: The seeds to shuffle with.
+
+    Returns:
+        Numbers of patients considered and of patients gaining the site, each
+        with shape (seeds, groups).
+    """
+
+    return count_gains(grouped, shuffle_within_groups(grouped, seeds))
+
+
+def sample_gains(grouped: GroupedInvolvements,
+                 seeds: Sequence[int],
+                 cores: int,
+                 batch_size: int = 100) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts gains in permutations with the given seeds, in batches of seeds run
+    across the given number of processes, with smaller batches if needed to
+    occupy all processes.
+
+    Args:
+        grouped: The grouped involvements.
+        seeds: The seeds to shuffle with.
+        cores: The number of processes to run the permutations with.
+        batch_size: The number of seeds to shuffle with at once.
+
+    Returns:
+        Numbers of patients considered and of patients gaining the site, each
+        with shape (seeds, groups).
+    """
+
+    batch_size = max(1, min(batch_size, -(-len(seeds) // cores)))
+
+    batches = [
+        seeds[start:start + batch_size]
+        for start in range(0, len(seeds), batch_size)
+    ]
+
+    results = [get_gains(grouped, x) for x in batches
+               ] if cores == 1 else jl.Parallel(n_jobs=cores)(
+                   jl.delayed(get_gains)(grouped, x) for x in batches)
+
+    return (np.concatenate([x[0] for x in results]),
+            np.concatenate([x[1] for x in results]))
+
+
+def to_frame(grouped: GroupedInvolvements, seeds: Sequence[int],
+             n: np.ndarray, n_gained: np.ndarray) -> pd.DataFrame:
+    """
+    Converts the given counts to a table with one row per seed, patient group,
+    and site, omitting groups without patients considered.
+
+    Args:
+        grouped: The grouped involvements.
+        seeds: The seeds the involvements were shuffled with.
+        n: Numbers of patients considered.
+        n_gained: Numbers of patients gaining the site.
+
+    Returns:
+        A table with classification, site, n, n_gained, and seed columns.
+    """
+
+    b, j = np.nonzero(n > 0)
+
+    return pd.DataFrame({
+        'classification': grouped.groups.get_level_values(0)[j],
+        'site': grouped.groups.get_level_values(1)[j],
+        'n': n[b, j],
+        'n_gained': n_gained[b, j],
+        'seed': np.asarray(seeds)[b]
+    })
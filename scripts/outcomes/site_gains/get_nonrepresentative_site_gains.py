@@ -5,52 +5,13 @@ future given future visits.
 
 import feather
 import pandas as pd
-import tqdm
 
 from click import *
 from logging import *
+from representative_sites import filter_representative_sites
 from typing import *
 
 
-def filter_representative_sites_patient(
-        df: pd.DataFrame, representative_sites: List[str]) -> pd.DataFrame:
-    """
-    Filters out representative sites from the given data frame for a single
-    patient.
-
-    Args:
-        df: The data frame to filter.
-        representative_sites: Representative sites to filter out.
-
-    Returns:
-        The filtered data.
-    """
-
-    return df.loc[~(df['site'].isin(representative_sites))]
-
-
-def filter_representative_sites(
-        df: pd.DataFrame, clusters: pd.Series,
-        representative_sites: pd.DataFrame) -> pd.DataFrame:
-    """
-    Filters out representative sites from the given data frame.
-
-    Args:
-        df: The data frame to filter.
-        clusters: Cluster assignments.
-        representative_sites: Representative sites for each cluster.
-
-    Returns:
-        The filtered data.
-    """
-
-    return pd.concat(
-        filter_representative_sites_patient(
-            df.loc[df['subject_id'] == i],
-            representative_sites.loc[[clusters.loc[i]]]['site'].tolist())
-        for i in tqdm.tqdm(clusters.index))
-
-
 def get_differences(df_future: pd.DataFrame,
                     df_baseline: pd.DataFrame) -> pd.DataFrame:
     """
@@ -3,38 +3,98 @@ Calculates P-values from the permutation test.
 """
 
 import feather
-import functools as ft
 import numpy as np
 import pandas as pd
-import tqdm
 
 from click import *
 from logging import *
+from p_value_accumulators import (PValueAccumulator, accumulate_samples,
+                                  load_accumulators)
 from statsmodels.sandbox.stats.multicomp import multipletests
+from typing import *
 
 
-def get_stats(df: pd.DataFrame, df_baseline: pd.DataFrame) -> pd.DataFrame:
+def accumulate_sample_table(df: pd.DataFrame,
+                            df_baseline: pd.DataFrame) -> PValueAccumulator:
     """
-    Obtains statistics for the given data slice for a classification and site.
+    Accumulates sampled numbers of patients gaining each site, with one row per
+    seed, classification, and site, against the baseline numbers.
 
     Args:
-        df: The data slice to compute statistics from.
+        df: The samples.
         df_baseline: Baseline (unshuffled) statistics.
 
+    Returns:
+        The accumulator, over the classifications and sites that are sampled.
+    """
+
+    samples = df.set_index(['seed', 'classification',
+                            'site'])['n_gained'].unstack(
+                                ['classification', 'site']).dropna(
+                                    axis=1, how='all').sort_index(axis=1)
+
+    return accumulate_samples(samples,
+                              df_baseline.loc[samples.columns, 'n_gained'])
+
+
+def load_samples(paths: Tuple[str, ...],
+                 df_baseline: pd.DataFrame) -> PValueAccumulator:
+    """
+    Loads samples from the given Feather files of samples or NumPy archives of
+    P-value counters, and merges them.
+
+    Args:
+        paths: The paths to load samples from.
+        df_baseline: Baseline (unshuffled) statistics.
+
+    Returns:
+        The accumulator.
+    """
+
+    is_counters = [x.endswith('.npz') for x in paths]
+
+    if all(is_counters):
+
+        return load_accumulators(paths)
+
+    if any(is_counters):
+
+        raise ValueError('cannot merge samples with P-value counters')
+
+    samples = pd.concat(feather.read_dataframe(x) for x in paths)
+
+    info('Result: {}'.format(samples.shape))
+
+    return accumulate_sample_table(samples, df_baseline)
+
+
+def get_stats(accumulator: PValueAccumulator) -> pd.DataFrame:
+    """
+    Obtains, for each classification and site that is sampled, the number of
+    samples in which more patients gain the site than at baseline, and the
+    fraction of such samples.
+
+    Sites that no patients gain at baseline have P-values of 1.
+
+    Args:
+        accumulator: Samples accumulated against the baseline statistics.
+
     Returns:
         The statistics.
     """
 
-    baseline_n = df_baseline.loc[(df['classification'].unique()[0], df['site']
-                                  .unique()[0]), 'n_gained']
+    stats = accumulator.to_frame(missing='excluded')
 
-    if baseline_n == 0:
+    stats.index.names = ['classification', 'site']
 
-        return pd.DataFrame({'n': [np.nan], 'p': [1.]})
+    stats = stats.loc[stats['n_missing'] < stats['n']].sort_index()
 
-    mask = df['n_gained'] > baseline_n
+    no_gains = stats['observed'] == 0
 
-    return pd.DataFrame({'n': [mask.sum()], 'p': [mask.mean()]})
+    return pd.DataFrame({
+        'n': stats['n_extreme'].where(~no_gains),
+        'p': stats['p'].where(~no_gains, 1.)
+    }).reset_index()
 
 
 def correct_p_values(x: pd.Series) -> pd.Series:
@@ -59,7 +119,10 @@ def correct_p_values(x: pd.Series) -> pd.Series:
 @option(
     '--sample-input',
     required=True,
-    help='the Feather file to load sample information from')
+    multiple=True,
+    help='the Feather file to load sample information from, or the NumPy '
+    'archive to load P-value counters from if it ends in .npz (multiple '
+    'allowed)')
 @option('--output', required=True, help='the CSV file to output statistics to')
 def main(base_input, sample_input, output):
 
@@ -78,18 +141,11 @@ def main(base_input, sample_input, output):
 
     info('Loading samples')
 
-    samples = feather.read_dataframe(sample_input)
-
-    info('Result: {}'.format(samples.shape))
+    accumulator = load_samples(sample_input, baseline)
 
     info('Calculating statistics')
 
-    tqdm.tqdm.pandas()
-
-    results = samples.groupby(['classification', 'site']).progress_apply(
-        ft.partial(
-            get_stats, df_baseline=baseline)).reset_index(
-                ['classification', 'site']).reset_index(drop=True)
+    results = get_stats(accumulator)
 
     info('Correcting P-values')
 
@@ -4,187 +4,187 @@ overrepresented in terms of the number of patients who gain it at later visits.
 """
 
 import feather
-import joblib as jl
+import functools as ft
 import numpy as np
 import pandas as pd
 import tqdm
 
 from click import *
 from logging import *
+from gain_permutations import (GroupedInvolvements, get_sampled_groups,
+                               group_involvements, sample_gains, to_frame)
+from p_value_accumulators import PValueAccumulator, get_labels
+from representative_sites import filter_representative_sites
+from sequential_testing import SequentialTest, run_sequential_test
 from typing import *
 
 
-def filter_representative_sites_patient(
-        df: pd.DataFrame, representative_sites: List[str]) -> pd.DataFrame:
+def do_permutation_tests(grouped: GroupedInvolvements, seeds: List[int],
+                         cores: int) -> pd.DataFrame:
     """
-    Filters out representative sites from the given data frame for a single
-    patient.
+    Conducts permutation tests.
 
     Args:
-        df: The data frame to filter.
-        representative_sites: Representative sites to filter out.
+        grouped: Future involvements grouped by patient group and site, with
+            matching baseline involvements.
+        seeds: The seeds to use for shuffling the data.
+        cores: The number of cores to run the analysis with.
 
     Returns:
-        The filtered data.
+        For each patient group and site and iteration, the number of patients
+        who gain that site.
     """
 
-    return df.loc[~(df['site'].isin(representative_sites))]
-
+    result = to_frame(grouped, seeds, *sample_gains(grouped, seeds, cores))
 
-def filter_representative_sites(
-        df: pd.DataFrame, clusters: pd.Series,
-        representative_sites: pd.DataFrame) -> pd.DataFrame:
-    """
-    Filters out representative sites from the given data frame.
-
-    Args:
-        df: The data frame to filter.
-        clusters: Cluster assignments.
-        representative_sites: Representative sites for each cluster.
+    for j in ['seed', 'site', 'classification']:
 
-    Returns:
-        The filtered data.
-    """
+        result[j] = result[j].astype('category')
 
-    return pd.concat(
-        filter_representative_sites_patient(
-            df.loc[df['subject_id'] == i],
-            representative_sites.loc[[clusters.loc[i]]]['site'].tolist())
-        for i in tqdm.tqdm(clusters.index))
+    return result
 
 
-def get_differences(df_future: pd.DataFrame,
-                    df_baseline: pd.DataFrame) -> pd.DataFrame:
+def get_sampled_gains(grouped: GroupedInvolvements, observed: pd.Series,
+                      cores: int, seeds: List[int]) -> np.ndarray:
     """
-    Calculates differences between future involvements and baseline
-    involvements.
+    Obtains, for each of the given seeds, the number of patients in each
+    patient group who gain each site in the permuted data.
 
     Args:
-        df_future: Involvements in the future.
-        df_baseline: Involvements at baseline.
+        grouped: Future involvements grouped by patient group and site, with
+            matching baseline involvements.
+        observed: The observed number of patients gaining each site, indexed
+            by patient group and site.
+        cores: The number of cores to run the permutations with.
+        seeds: The seeds to use for shuffling the data.
 
     Returns:
-        The differences.
+        Numbers of patients with shape (seeds, patient groups and sites), with
+        NaN for patient groups and sites missing from the permuted data.
     """
 
-    return (df_future.set_index(['subject_id', 'site', 'classification']) -
-            df_baseline.set_index(['subject_id', 'site', 'classification'])
-            ).reset_index().dropna(subset=['value'])
+    n, n_gained = sample_gains(grouped, seeds, cores)
 
+    n_gained = np.where(n > 0, n_gained, np.nan)
 
-def shuffle_data(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Shuffles the given data.
+    # Append a column of NaN for patient groups and sites that are never
+    # sampled.
 
-    Args:
-        df: The data to shuffle.
-
-    Returns:
-        The shuffled data.
-    """
+    n_gained = np.concatenate(
+        [n_gained, np.full((len(seeds), 1), np.nan)], axis=1)
 
-    df_shuffled = df[['subject_id', 'value']].copy()
+    return n_gained[:, grouped.groups.get_indexer(observed.index)]
 
-    df_shuffled['value'] = np.random.permutation(df_shuffled['value'])
 
-    return df_shuffled
-
-
-def get_stats(x: pd.Series) -> pd.DataFrame:
+def get_exceedances(grouped: GroupedInvolvements, observed: pd.Series,
+                    cores: int, seeds: List[int]) -> np.ndarray:
     """
-    Calculates the gain probability from the given series, as well as the
-    number of patients considered and the number of patients who gained the
-    site specified by the series.
+    Determines, for each of the given seeds and each patient group and site,
+    whether more patients gain the site in the permuted data than observed.
+
+    As in get_p_values.py, patient groups and sites where no patients gain the
+    site always count as exceeded, and those missing from the permuted data
+    are left out.
 
     Args:
-        x: An indicator specifying whether a patient has gained involvement in
-            a site at any future time point.
+        grouped: Future involvements grouped by patient group and site, with
+            matching baseline involvements.
+        observed: The observed number of patients gaining each site, indexed
+            by patient group and site.
+        cores: The number of cores to run the permutations with.
+        seeds: The seeds to use for shuffling the data.
 
     Returns:
-        The gain probability, the number of patients considered, and the number
-        of patients gaining involvement in the site specified by the input.
+        Indicators with shape (seeds, patient groups and sites), with NaN for
+        patient groups and sites missing from the permuted data.
     """
 
-    mask = x > 0
+    n_gained = get_sampled_gains(grouped, observed, cores, seeds)
 
-    return pd.DataFrame({'n': [x.size], 'n_gained': [mask.sum()]})
+    with np.errstate(invalid='ignore'):
 
+        exceeded = (n_gained > observed.values) | (observed.values == 0)
 
-def do_permutation_test(df_future: pd.DataFrame,
-                        df_baseline: pd.DataFrame,
-                        seed: int) -> pd.DataFrame:
-    """
-    Conducts a permutation test.
+    return np.where(np.isnan(n_gained), np.nan, exceeded)
 
-    Args:
-        df_future: Future involvement data (merged).
-        df_baseline: Baseline data.
-        seed: The seed to use for shuffling the data.
 
-    Returns:
-        For each patient group and site, the number of patients who gain that
-        site.
+def run_sequential_tests(grouped: GroupedInvolvements,
+                         observed: pd.Series,
+                         seeds: List[int],
+                         cores: int,
+                         h: int,
+                         alpha: Optional[float] = None,
+                         error: float = 1e-3) -> pd.DataFrame:
     """
+    Conducts sequential permutation tests, stopping for each patient group and
+    site once its P-value is resolved.
 
-    # Shuffle the data.
-
-    np.random.seed(seed)
+    As in get_p_values.py, patient groups and sites that are never sampled
+    are left out.
 
-    df_future_shuffled = df_future.groupby(
-        ['classification', 'site']).apply(shuffle_data).reset_index(
-            ['classification', 'site']).reset_index(drop=True)
-
-    # Calculate differences between baseline and future.
+    Args:
+        grouped: Future involvements grouped by patient group and site, with
+            matching baseline involvements.
+        observed: The observed number of patients gaining each site, indexed
+            by patient group and site.
+        seeds: The seeds to use for shuffling the data.
+        cores: The number of cores to run the permutations with.
+        h: The number of permutations exceeding the observed gains after
+            which to stop.
+        alpha: If given, the significance level with respect to which to also
+            stop once the P-value is resolved.
+        error: The probability of resolving a P-value wrongly.
 
-    differences = get_differences(df_future_shuffled, df_baseline)
+    Returns:
+        For each patient group and site, the numbers of permutations and of
+        permutations exceeding the observed gains, and the P-value.
+    """
 
-    # Calculate stats.
+    observed = observed.loc[observed.index.isin(get_sampled_groups(grouped))]
 
-    stats = differences.groupby(
-        ['classification', 'site'])['value'].apply(get_stats).reset_index(
-            ['classification', 'site']).reset_index(drop=True)
+    test = run_sequential_test(
+        ft.partial(get_exceedances, grouped, observed, cores), seeds,
+        SequentialTest((observed.size, ),
+                       len(seeds),
+                       h=h,
+                       alpha=alpha,
+                       error=error,
+                       batch_size=16 * cores))
 
-    stats['seed'] = seed
+    result = test.to_frame(observed.index)
 
-    return stats
+    return result.loc[result['n'] > 0].reset_index()
 
 
-def do_permutation_tests(df_future: pd.DataFrame,
-                         df_baseline: pd.DataFrame,
-                         seeds: List[int],
-                         cores: int) -> pd.DataFrame:
+def accumulate_permutations(grouped: GroupedInvolvements,
+                            observed: pd.Series, seeds: List[int], cores: int,
+                            batch_size: int) -> PValueAccumulator:
     """
-    Conducts permutation tests.
-
-    The input data frames should contain the classifications as a
-    `classification` column.
+    Accumulates the numbers of patients gaining each site in permuted data
+    against the observed numbers, in batches of seeds.
 
     Args:
-        df_future: Future involvement data (merged).
-        df_baseline: Baseline data.
-        clusters: Patient group assignments.
+        grouped: Future involvements grouped by patient group and site, with
+            matching baseline involvements.
+        observed: The observed number of patients gaining each site, indexed
+            by patient group and site.
         seeds: The seeds to use for shuffling the data.
-        cores: The number of cores to run the analysis with.
+        cores: The number of cores to run the permutations with.
+        batch_size: The number of seeds to permute at once.
 
     Returns:
-        For each patient group and site and iteration, the number of patients
-        who gain that site.
+        The accumulator.
     """
 
-    it = tqdm.tqdm(seeds)
-
-    results = (do_permutation_test(df_future, df_baseline, seed)
-               for seed in it) if cores == 1 else jl.Parallel(n_jobs=cores)(
-                   jl.delayed(do_permutation_test)(df_future, df_baseline,
-                                                   seed) for seed in it)
-
-    concatenated = pd.concat(results)
+    result = PValueAccumulator(observed.values, get_labels(observed.index))
 
-    for j in ['seed', 'site', 'classification']:
+    for start in tqdm.trange(0, len(seeds), batch_size):
 
-        concatenated[j] = concatenated[j].astype('category')
+        result.update(
+            get_sampled_gains(grouped, observed, cores,
+                              seeds[start:start + batch_size]))
 
-    return concatenated
+    return result
 
 
 @command()
@@ -213,14 +213,51 @@ def do_permutation_tests(df_future: pd.DataFrame,
 @option(
     '--output',
     required=True,
-    help='the Feather file to output gain information to')
+    help='the Feather file to output gain information to, or the NumPy '
+    'archive to output P-value counters to if it ends in .npz')
 @option(
     '--cores',
     type=int,
     default=1,
     help='the number of cores to run the analysis with')
+@option(
+    '--base-input',
+    help='the CSV file to load baseline information from, as required by '
+    '--sequential-h and .npz outputs')
+@option(
+    '--sequential-h',
+    type=IntRange(1),
+    help='the number of permutations exceeding the observed gains after which '
+    'to stop permuting a patient group and site; if given, P-values and the '
+    'numbers of permutations drawn are output instead of samples')
+@option(
+    '--sequential-alpha',
+    type=FloatRange(0, 1),
+    help='the significance level with respect to which to also stop once the '
+    'P-value is resolved, as required by --sequential-h: significant patient '
+    'groups and sites never reach SEQUENTIAL_H permutations, so without it '
+    'every permutation is still drawn')
+@option(
+    '--sequential-error',
+    type=FloatRange(0, 1),
+    default=1e-3,
+    help='the probability of resolving a P-value wrongly overall, split '
+    'equally across batches of permutations (default: 0.001)')
 def main(cluster_input, representative_site_input, site_input, seedlist, visit,
-         output, cores):
+         output, cores, base_input, sequential_h, sequential_alpha,
+         sequential_error):
+
+    if sequential_h and not base_input:
+
+        raise UsageError('--sequential-h requires --base-input')
+
+    if sequential_h and sequential_alpha is None:
+
+        raise UsageError('--sequential-h requires --sequential-alpha')
+
+    if output.endswith('.npz') and not base_input:
+
+        raise UsageError('.npz outputs require --base-input')
 
     basicConfig(
         level=INFO,
@@ -313,12 +350,61 @@ def main(cluster_input, representative_site_input, site_input, seedlist, visit,
     involvements_future_nonrep = involvements_future_nonrep.groupby(
         ['classification', 'subject_id', 'site'])['value'].max().reset_index()
 
+    # Group future involvements by patient group and site once for all
+    # permutations.
+
+    info('Grouping involvements')
+
+    grouped = group_involvements(involvements_future_nonrep,
+                                 involvements_baseline_nonrep)
+
+    # Conduct the permutation tests sequentially if required.
+
+    if sequential_h:
+
+        info('Loading baseline information')
+
+        observed = pd.read_csv(
+            base_input, index_col=['classification', 'site'])['n_gained']
+
+        info('Conducting sequential permutation tests')
+
+        result = run_sequential_tests(grouped, observed, seeds, cores,
+                                      h=sequential_h,
+                                      alpha=sequential_alpha,
+                                      error=sequential_error)
+
+        info('Writing output')
+
+        feather.write_dataframe(result, output)
+
+        return
+
+    # Accumulate counters instead of keeping the samples if required.
+
+    if output.endswith('.npz'):
+
+        info('Loading baseline information')
+
+        observed = pd.read_csv(
+            base_input, index_col=['classification', 'site'])['n_gained']
+
+        info('Accumulating permutations')
+
+        accumulator = accumulate_permutations(grouped, observed, seeds, cores,
+                                              16 * cores)
+
+        info('Writing output')
+
+        accumulator.save(output)
+
+        return
+
     # Conduct the permutation tests.
 
     info('Conducting permutation tests')
 
-    test_results = do_permutation_tests(
-        involvements_future_nonrep, involvements_baseline_nonrep, seeds, cores)
+    test_results = do_permutation_tests(grouped, seeds, cores)
 
     # Write the output.
 
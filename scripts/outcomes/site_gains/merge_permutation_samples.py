@@ -7,6 +7,7 @@ import pandas as pd
 
 from click import *
 from logging import *
+from p_value_accumulators import load_accumulators
 
 
 @command()
@@ -14,8 +15,13 @@ from logging import *
     '--input',
     required=True,
     multiple=True,
-    help='the Feather file to load samples from (multiple allowed)')
-@option('--output', required=True, help='the Feather file to write output to')
+    help='the Feather file to load samples from, or the NumPy archive to load '
+    'P-value counters from if it ends in .npz (multiple allowed)')
+@option(
+    '--output',
+    required=True,
+    help='the Feather file to write output to, or the NumPy archive to write '
+    'merged P-value counters to if it ends in .npz')
 def main(input, output):
 
     basicConfig(
@@ -25,6 +31,16 @@ def main(input, output):
                 '{}.log'.format(output), mode='w')
         ])
 
+    # Merge counters if required.
+
+    if output.endswith('.npz'):
+
+        info('Merging counters')
+
+        load_accumulators(input).save(output)
+
+        return
+
     # Concatenate away.
 
     info('Concatenating data')
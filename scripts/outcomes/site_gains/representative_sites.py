@@ -0,0 +1,42 @@
+"""
+Filters representative sites out of site involvements for each patient.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def filter_representative_sites(
+        df: pd.DataFrame, clusters: pd.Series,
+        representative_sites: pd.DataFrame) -> pd.DataFrame:
+    """
+    Filters out, for each patient, the representative sites of their cluster
+    from the given data frame.
+
+    Rows are matched against (cluster, site) pairs in one pass, and rows of
+    patients without cluster assignments are dropped. The result is ordered by
+    patient as in the cluster assignments, and by row within each patient.
+
+    Args:
+        df: The data frame to filter, with subject_id and site columns.
+        clusters: Cluster assignments.
+        representative_sites: Representative sites for each cluster, indexed
+            by cluster.
+
+    Returns:
+        The filtered data.
+    """
+
+    patients = clusters.index.get_indexer(df['subject_id'])
+
+    representative_pairs = pd.MultiIndex.from_arrays(
+        [representative_sites.index, representative_sites['site']])
+
+    pairs = pd.MultiIndex.from_arrays(
+        [df['subject_id'].map(clusters), df['site']])
+
+    mask = (patients >= 0) & ~pairs.isin(representative_pairs)
+
+    order = np.argsort(patients[mask], kind='mergesort')
+
+    return df.loc[mask].iloc[order]
@@ -0,0 +1,62 @@
+"""
+Tests that sequential permutation tests of site gains agree with P-values
+calculated from all samples.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('statsmodels')
+
+from gain_permutations import group_involvements
+from get_p_values import get_stats
+from get_permutation_samples import (accumulate_permutations,
+                                     run_sequential_tests)
+
+
+def test_sequential_p_values_match_samples():
+
+    random_state = np.random.RandomState(0)
+
+    future = pd.DataFrame(
+        [(s % 3, s, site, float(random_state.rand() < 0.4)) for s in range(60)
+         for site in 'abcd'],
+        columns=['classification', 'subject_id', 'site', 'value'])
+
+    baseline = future.assign(
+        value=(random_state.rand(len(future)) < 0.3).astype(np.float64))
+
+    # Leave one patient group and site without baseline involvements.
+
+    baseline = baseline.loc[(baseline['classification'] != 2) |
+                            (baseline['site'] != 'd')]
+
+    grouped = group_involvements(future, baseline)
+
+    # Include a patient group that is missing from the data, and a site that
+    # no patients gain.
+
+    index = pd.MultiIndex.from_product([[0, 1, 2, 5], list('abcd')],
+                                       names=['classification', 'site'])
+
+    observed = pd.Series(random_state.randint(0, 6, index.size),
+                         index=index,
+                         dtype=np.float64)
+
+    observed.iloc[0] = 0
+
+    seeds = list(range(200))
+
+    keys = ['classification', 'site']
+
+    expected = get_stats(
+        accumulate_permutations(grouped, observed, seeds, 1,
+                                50)).set_index(keys)
+
+    result = run_sequential_tests(grouped, observed, seeds, 1,
+                                  len(seeds) + 1).set_index(keys)
+
+    assert result.index.equals(expected.index)
+
+    np.testing.assert_allclose(result['p'], expected['p'])
@@ -4,69 +4,152 @@ discovery cohorts.
 """
 
 import feather
-import functools as ft
 import numpy as np
 import pandas as pd
 import tqdm
 
 from click import *
 from logging import *
-from sklearn.utils import resample
+from p_value_accumulators import PValueAccumulator, get_labels
+from typing import *
 
 
-def bootstrap_distances_cluster(df: pd.DataFrame,
-                                discovery_frequencies: pd.DataFrame,
-                                seed: int) -> float:
+def get_resample_counts(n: int, seeds: List[int]) -> np.ndarray:
     """
-    Calculates a bootstrapped Euclidean distance in site frequencies for a
-    single cluster.
+    Draws, for each of the given seeds, the number of times each of the given
+    number of rows is picked when resampling the rows with replacement.
+
+    The rows picked for a seed are those that sklearn.utils.resample picks
+    with the seed as its random state.
+
+    Args:
+        n: the number of rows.
+        seeds: the seeds to initialize the random number generator with.
+
+    Returns:
+        Counts with shape (seeds, rows).
+    """
+
+    picks = np.empty((len(seeds), n), dtype=np.int64)
+
+    random_state = np.random.RandomState()
+
+    for b, seed in enumerate(seeds):
+
+        random_state.seed(seed)
+
+        picks[b] = random_state.randint(0, n, size=n) + b * n
+
+    return np.bincount(
+        picks.ravel(), minlength=len(seeds) * n).reshape((len(seeds), n))
+
+
+def bootstrap_frequencies(X: np.ndarray, seeds: List[int]) -> np.ndarray:
+    """
+    Calculates bootstrapped site frequencies from the given involvements, as
+    one product of resampling counts with the involvements.
 
     Args:
-        df: the data for the cluster.
+        X: site involvements with shape (patients, sites), with NaN for
+            missing involvements.
+        seeds: the seeds to initialize the random number generator with.
+
+    Returns:
+        Frequencies with shape (seeds, sites).
+    """
+
+    counts = get_resample_counts(X.shape[0], seeds).astype(np.float64)
+
+    missing = np.isnan(X)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        return (counts @ np.where(missing, 0., X)) / (counts @ ~missing)
+
+
+def bootstrap_distances(df: pd.DataFrame, discovery_frequencies: pd.DataFrame,
+                        seeds: List[int]) -> pd.DataFrame:
+    """
+    Generates bootstrapped distances for a batch of seeds.
+
+    Args:
+        df: a table of site involvements and cluster assignments.
         discovery_frequencies: a table of discovery cohort site frequencies per
             patient group.
-        seed: the seed to initialize the random number generator with.
+        seeds: the seeds to initialize the random number generator with.
+
+    Returns:
+        Distances with shape (seeds, clusters), with clusters in sorted order
+        as columns.
     """
 
-    cluster = df['classification'].unique()[0]
+    sites = df.columns.drop('classification')
 
-    discovery_frequencies_cluster = discovery_frequencies.loc[cluster][
-        'frequency']
+    results = {}
 
-    resampled_data = resample(
-        df.drop('classification', axis=1), random_state=seed)
+    for cluster, df_cluster in df.groupby('classification'):
 
-    validation_frequencies = resampled_data.mean()
+        frequencies = bootstrap_frequencies(
+            df_cluster[sites].values.astype(np.float64), seeds)
 
-    return np.sqrt(((validation_frequencies - discovery_frequencies_cluster)
-                    **2).sum())
+        discovery_frequencies_cluster = discovery_frequencies.loc[cluster][
+            'frequency'].reindex(sites).values
 
+        # Sites missing from either cohort do not count towards distances.
 
-def bootstrap_distances(df: pd.DataFrame, discovery_frequencies: pd.DataFrame,
-                        seed: int) -> pd.DataFrame:
+        results[cluster] = np.sqrt(
+            np.nansum((frequencies - discovery_frequencies_cluster)**2,
+                      axis=1))
+
+    return pd.DataFrame(results, index=pd.Index(seeds, name='seed'))
+
+
+def melt_distances(distances: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reshapes the given bootstrapped distances to one row per seed and cluster.
+
+    Args:
+        distances: distances indexed by seed, with one column per cluster.
     """
-    Generates bootstrapped distances.
+
+    result = distances.rename_axis(
+        'classification', axis=1).stack().rename('distance').reset_index()
+
+    return result[['classification', 'distance', 'seed']]
+
+
+def accumulate_distances(df: pd.DataFrame,
+                         discovery_frequencies: pd.DataFrame,
+                         observed: pd.Series,
+                         seeds: List[int],
+                         batch_size: int = 1000) -> PValueAccumulator:
+    """
+    Accumulates bootstrapped distances against the observed distances, keeping
+    only the counts of lower distances and the moments of the distances.
 
     Args:
         df: a table of site involvements and cluster assignments.
         discovery_frequencies: a table of discovery cohort site frequencies per
             patient group.
-        seed: the seed to initialize the random number generator with.
+        observed: the observed distances, indexed by cluster.
+        seeds: the seeds to initialize the random number generator with.
+        batch_size: the number of seeds to bootstrap at once.
     """
 
-    samples = df.groupby('classification').apply(
-        ft.partial(
-            bootstrap_distances_cluster,
-            discovery_frequencies=discovery_frequencies,
-            seed=seed))
+    result = PValueAccumulator(
+        observed.values,
+        get_labels(observed.index),
+        tail='lower',
+        moments=True)
 
-    samples.name = 'distance'
+    for start in tqdm.trange(0, len(seeds), batch_size):
 
-    samples = samples.reset_index()
+        distances = bootstrap_distances(df, discovery_frequencies,
+                                        seeds[start:start + batch_size])
 
-    samples['seed'] = seed
+        result.update(distances.reindex(columns=observed.index).values)
 
-    return samples
+    return result
 
 
 @command()
@@ -88,9 +171,18 @@ def bootstrap_distances(df: pd.DataFrame, discovery_frequencies: pd.DataFrame,
 @option(
     '--output',
     required=True,
-    help='the Feather file to write sample distances to')
+    help='the Feather file to write sample distances to, or the NumPy archive '
+    'to write P-value counters to if it ends in .npz')
+@option(
+    '--observed-input',
+    help='the CSV file to read observed distances from, as required by .npz '
+    'outputs')
 def main(data_input: str, discovery_frequency_input: str, cluster_input: str,
-         seeds, output: str):
+         seeds, output: str, observed_input: Optional[str]):
+
+    if output.endswith('.npz') and not observed_input:
+
+        raise UsageError('.npz outputs require --observed-input')
 
     basicConfig(
         level=INFO,
@@ -132,15 +224,36 @@ def main(data_input: str, discovery_frequency_input: str, cluster_input: str,
 
     merged_data = data.join(clusters)
 
+    # Accumulate counters instead of keeping the samples if required.
+
+    if output.endswith('.npz'):
+
+        info('Loading observed distances')
+
+        observed = pd.read_csv(observed_input, index_col=0, squeeze=True)
+
+        info('Result: {}'.format(observed.shape))
+
+        info('Accumulating bootstrapped distances')
+
+        accumulator = accumulate_distances(merged_data, discovery_frequencies,
+                                           observed, seeds)
+
+        info('Writing output')
+
+        accumulator.save(output)
+
+        return
+
     # Conduct the bootstrap.
 
     info('Calculating bootstrapped distances')
 
-    bootstrapped_distances = (bootstrap_distances(
-        df=merged_data, discovery_frequencies=discovery_frequencies, seed=seed)
-                              for seed in tqdm.tqdm(seeds))
-
-    bootstrapped_distances = pd.concat(bootstrapped_distances)
+    bootstrapped_distances = pd.concat(
+        melt_distances(
+            bootstrap_distances(merged_data, discovery_frequencies,
+                                seeds[start:start + 1000]))
+        for start in tqdm.trange(0, len(seeds), 1000))
 
     # Write the output.
 
@@ -8,6 +8,7 @@ import tqdm
 
 from click import *
 from logging import *
+from p_value_accumulators import load_accumulators
 from typing import *
 
 
@@ -16,11 +17,13 @@ from typing import *
     '--input',
     required=True,
     multiple=True,
-    help='the Feather file(s) of samples to concatenate')
+    help='the Feather file(s) of samples to concatenate, or NumPy archives '
+    'ending in .npz of P-value counters to merge')
 @option(
     '--output',
     required=True,
-    help='the Feather file to write the concatenated data to')
+    help='the Feather file to write the concatenated data to, or the NumPy '
+    'archive to write merged P-value counters to if it ends in .npz')
 def main(input: Tuple[str], output: str):
 
     basicConfig(
@@ -30,6 +33,16 @@ def main(input: Tuple[str], output: str):
             FileHandler('{}.log'.format(output), mode='w')
         ])
 
+    # Merge counters if required.
+
+    if output.endswith('.npz'):
+
+        info('Merging counters')
+
+        load_accumulators(input).save(output)
+
+        return
+
     # Load the data.
 
     info('Loading and concatenating data')
@@ -4,10 +4,10 @@ Calculates factor scores from input data.
 
 import numpy as np
 import pandas as pd
-from sklearn.externals import joblib
 
 from click import *
 from logging import *
+from nmf_model import load_model
 
 
 @command()
@@ -18,7 +18,7 @@ from logging import *
 @option(
     '--model-input',
     required=True,
-    help='the Pickle file to read the model from')
+    help='the binary model or Pickle file to read the model from')
 @option('--output', required=True, help='the CSV file to write scores to')
 def main(data_input: str, model_input: str, output: str):
 
@@ -37,9 +37,7 @@ def main(data_input: str, model_input: str, output: str):
 
     info('Result: {}'.format(data.shape))
 
-    info('Loading model')
-
-    model = joblib.load(model_input)
+    model = load_model(model_input)
 
     # XXX
 
@@ -8,31 +8,65 @@ import pandas as pd
 
 from click import *
 from logging import *
+from p_value_accumulators import (PValueAccumulator, accumulate_samples,
+                                  load_accumulators)
+from typing import *
 
 
-def get_stats(observed: float, cluster: str,
-              samples: pd.Series) -> pd.DataFrame:
+def load_samples(observed: pd.Series,
+                 paths: Tuple[str, ...]) -> PValueAccumulator:
     """
-    Calculates statistics for a single cluster.
+    Loads bootstrapped distances from the given Feather files of samples or
+    NumPy archives of P-value counters, and merges them.
 
     Args:
-        observed: the observed distance.
-        cluster: the cluster assignment.
-        samples: sampled distances.
+        observed: the observed distances, indexed by cluster.
+        paths: the paths to load samples from.
     """
 
-    n_lower = (samples < observed).sum()
+    is_counters = [x.endswith('.npz') for x in paths]
 
-    total = samples.shape[0]
+    if all(is_counters):
 
-    return pd.DataFrame(
-        {
-            'classification': cluster,
-            'n_lower': n_lower,
-            'total': total,
-            'p': n_lower / total
-        },
-        index=[0])
+        return load_accumulators(paths)
+
+    if any(is_counters):
+
+        raise ValueError('cannot merge samples with P-value counters')
+
+    samples = pd.concat(feather.read_dataframe(x) for x in paths)
+
+    info('Result: {}'.format(samples.shape))
+
+    samples = samples.astype({'classification': observed.index.dtype})
+
+    # Seeds may repeat across files, so samples are matched up by position.
+
+    samples = samples.assign(
+        draw=samples.groupby('classification').cumcount()).pivot(
+            index='draw', columns='classification', values='distance')
+
+    return accumulate_samples(samples, observed, tail='lower')
+
+
+def get_stats(accumulator: PValueAccumulator) -> pd.DataFrame:
+    """
+    Calculates, for each cluster, the fraction of bootstrapped distances that
+    are lower than the observed distance.
+
+    Args:
+        accumulator: bootstrapped distances accumulated against the observed
+            distances.
+    """
+
+    stats = accumulator.to_frame(missing='ignored')
+
+    stats.index.name = 'classification'
+
+    return stats.rename(columns={
+        'n_extreme': 'n_lower',
+        'n': 'total'
+    })[['n_lower', 'total', 'p']]
 
 
 @command()
@@ -43,12 +77,15 @@ def get_stats(observed: float, cluster: str,
 @option(
     '--sample-input',
     required=True,
-    help='the Feather file to read bootstrapped samples from')
+    multiple=True,
+    help='the Feather file to read bootstrapped samples from, or the NumPy '
+    'archive to read P-value counters from if it ends in .npz (multiple '
+    'allowed)')
 @option(
     '--output',
     required=True,
     help='the CSV file to write the transformed data to')
-def main(observed_input: str, sample_input: str, output: str):
+def main(observed_input: str, sample_input: Tuple[str, ...], output: str):
 
     basicConfig(
         level=INFO,
@@ -67,24 +104,14 @@ def main(observed_input: str, sample_input: str, output: str):
 
     info('Loading samples')
 
-    samples = feather.read_dataframe(sample_input)
-
-    info('Result: {}'.format(samples.shape))
+    accumulator = load_samples(observed, sample_input)
 
     # For each cluster, calculate the proportion of samples that are lower than
     # the observed distance.
 
     info('Calculating statistics')
 
-    samples.drop('seed', axis=1, inplace=True)
-
-    samples.set_index('classification', inplace=True)
-
-    samples = samples.squeeze()
-
-    stats = pd.concat(
-        get_stats(v, k, samples[k])
-        for k, v in observed.iteritems()).set_index('classification')
+    stats = get_stats(accumulator)
 
     # Write the output.
 